@@ -31,7 +31,15 @@ echo -e "${YELLOW}[*] Installing dependencies (PyInstaller, pyserial) inside ven
 # 4. Compile the project
 echo -e "${CYAN}[*] Compiling kanagawa_main.py into a single binary...${NC}"
 # Use the PyInstaller binary located inside our temporary venv
-./kanagawa_venv/bin/pyinstaller --onefile --clean --name kanagawa_toolkit kanagawa_main.py
+# The tools are imported by name when picked from the menu, so PyInstaller has to be told about them
+./kanagawa_venv/bin/pyinstaller --onefile --clean --name kanagawa_toolkit \
+    --hidden-import kanagawa_adb_partition_extractor \
+    --hidden-import kanagawa_force_fastboot \
+    --hidden-import kanagawa_vbmeta_disabler \
+    --hidden-import kanagawa_force_shutdown \
+    --hidden-import kanagawa_inspect \
+    --hidden-import kanagawa_cli \
+    kanagawa_main.py
 
 # 5. Verify and clean up
 if [ -f "dist/kanagawa_toolkit" ]; then
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+import os
+import shlex
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from kanagawa_metrics import count_spawn, increment
+
+ADB_HOST = os.environ.get("ANDROID_ADB_SERVER_ADDRESS", "127.0.0.1")
+ADB_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+SYNC_DATA_MAX = 64 * 1024
+READY_STATES = ("device", "recovery")
+
+class AdbError(Exception):
+    pass
+
+def su_command(command):
+    """Wraps command for su -c with proper quoting, instead of hand-built '...' strings."""
+    return f"su -c {shlex.quote(command)}"
+
+def recv_exact(sock, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise AdbError(f"Connection closed after {len(data)}/{length} bytes")
+        data += chunk
+    return bytes(data)
+
+def recv_all(sock):
+    data = bytearray()
+    while True:
+        chunk = sock.recv(SYNC_DATA_MAX)
+        if not chunk:
+            return bytes(data)
+        data += chunk
+
+class AdbClient:
+    """Talks to the adb server's smart-socket protocol on tcp:5037 directly.
+
+    Every request is a socket connect instead of a fork/exec of the adb
+    client, and commands reach the device shell without a host shell in the
+    way. Smart-socket services are one-shot by protocol, so only sync
+    sessions (which accept many requests) are pooled and reused.
+    """
+
+    def __init__(self, host=ADB_HOST, port=ADB_PORT, autostart=True):
+        self.host = host
+        self.port = port
+        self.autostart = autostart
+        self._sync_pool = {}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            return socket.create_connection((self.host, self.port), timeout=10)
+        except ConnectionRefusedError:
+            if not self.autostart:
+                raise AdbError(f"No adb server on {self.host}:{self.port}")
+        try:
+            count_spawn(["adb", "start-server"])
+            subprocess.run(["adb", "start-server"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            return socket.create_connection((self.host, self.port), timeout=10)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise AdbError(f"Could not start the adb server: {e}")
+
+    @staticmethod
+    def _send(sock, request):
+        payload = request.encode('utf-8')
+        sock.sendall(b"%04x" % len(payload) + payload)
+
+    @staticmethod
+    def _read_status(sock):
+        status = recv_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            length = int(recv_exact(sock, 4), 16)
+            raise AdbError(recv_exact(sock, length).decode('utf-8', 'replace'))
+        raise AdbError(f"Unexpected adb server reply: {status!r}")
+
+    @staticmethod
+    def _read_length_prefixed(sock):
+        length = int(recv_exact(sock, 4), 16)
+        return recv_exact(sock, length).decode('utf-8', 'replace')
+
+    def host_query(self, request):
+        with self._connect() as sock:
+            self._send(sock, request)
+            self._read_status(sock)
+            return self._read_length_prefixed(sock)
+
+    def version(self):
+        return int(self.host_query("host:version"), 16)
+
+    def devices(self):
+        """Returns [(serial, state), ...] for every device the server knows about."""
+        devices = []
+        for line in self.host_query("host:devices").splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                devices.append((fields[0], fields[1]))
+        return devices
+
+    def usb_path(self, serial):
+        """The USB port path (e.g. '1-2.3') the device is attached to, from host:devices-l."""
+        if not serial:
+            return None
+        try:
+            listing = self.host_query("host:devices-l")
+        except (AdbError, OSError):
+            return None
+        for line in listing.splitlines():
+            fields = line.split()
+            if fields and fields[0] == serial:
+                return next((f[4:] for f in fields[2:] if f.startswith("usb:")), None)
+        return None
+
+    def track_devices(self, on_connect=None):
+        """Yields {serial: state} every time the server reports a change, starting with the current table.
+
+        on_connect(sock) is handed the tracking socket, so another thread can close it to end the stream.
+        """
+        with self._connect() as sock:
+            if on_connect:
+                on_connect(sock)
+            self._send(sock, "host:track-devices")
+            self._read_status(sock)
+            sock.settimeout(None)
+            while True:
+                table = {}
+                for line in self._read_length_prefixed(sock).splitlines():
+                    fields = line.split()
+                    if len(fields) >= 2:
+                        table[fields[0]] = fields[1]
+                yield table
+
+    def kill_server(self):
+        # The tracker would otherwise reconnect within reconnect_delay and bring the server back.
+        stop_tracker()
+        try:
+            with socket.create_connection((self.host, self.port), timeout=2) as sock:
+                self._send(sock, "host:kill")
+                self._read_status(sock)
+        except (OSError, AdbError):
+            pass
+
+    def open_service(self, service, serial=None):
+        """Switches a fresh connection to the device transport and opens service on it."""
+        increment("adb_services", service=service.split(":", 1)[0])
+        sock = self._connect()
+        try:
+            self._send(sock, f"host:transport:{serial}" if serial else "host:transport-any")
+            self._read_status(sock)
+            self._send(sock, service)
+            self._read_status(sock)
+        except Exception:
+            sock.close()
+            raise
+        sock.settimeout(None)
+        return sock
+
+    def shell(self, command, serial=None):
+        with self.open_service(f"shell:{command}", serial) as sock:
+            return recv_all(sock).decode('utf-8', 'replace').replace('\r\n', '\n').strip()
+
+    def exec_out(self, command, serial=None):
+        """Runs command with the binary-safe exec: service and returns a readable stream."""
+        sock = self.open_service(f"exec:{command}", serial)
+        stream = sock.makefile('rb')
+        sock.close()
+        return stream
+
+    def exec_bytes(self, command, serial=None):
+        with self.open_service(f"exec:{command}", serial) as sock:
+            return recv_all(sock)
+
+    def reboot(self, target="", serial=None):
+        """Returns False if the server refused (device gone offline or unauthorized) or the connection failed."""
+        try:
+            with self.open_service(f"reboot:{target}", serial) as sock:
+                recv_all(sock)
+        except (AdbError, OSError):
+            return False
+        return True
+
+    def _acquire_sync(self, serial):
+        with self._lock:
+            pool = self._sync_pool.get(serial)
+            if pool:
+                return pool.pop()
+        return self.open_service("sync:", serial)
+
+    def _release_sync(self, serial, sock):
+        with self._lock:
+            self._sync_pool.setdefault(serial, []).append(sock)
+
+    def stat(self, remote_path, serial=None):
+        """Returns (mode, size, mtime) from a sync STAT; all zero means the path is missing."""
+        sock = self._acquire_sync(serial)
+        try:
+            path = remote_path.encode('utf-8')
+            sock.sendall(b"STAT" + struct.pack("<I", len(path)) + path)
+            reply = recv_exact(sock, 16)
+            if reply[:4] != b"STAT":
+                raise AdbError(f"Unexpected sync reply: {reply[:4]!r}")
+        except Exception:
+            sock.close()
+            raise
+        self._release_sync(serial, sock)
+        return struct.unpack("<III", reply[4:])
+
+    def pull(self, remote_path, local_path, serial=None, progress=None, hasher=None):
+        """Copies remote_path to local_path over a pooled sync session, returning the byte count.
+
+        hasher.update() sees every DATA block as it is written, so the file never has to be re-read.
+        """
+        sock = self._acquire_sync(serial)
+        received = 0
+        try:
+            path = remote_path.encode('utf-8')
+            sock.sendall(b"RECV" + struct.pack("<I", len(path)) + path)
+            with open(local_path, 'wb') as out:
+                while True:
+                    header = recv_exact(sock, 8)
+                    ident, length = header[:4], struct.unpack("<I", header[4:])[0]
+                    if ident == b"DONE":
+                        break
+                    if ident == b"FAIL":
+                        raise AdbError(recv_exact(sock, length).decode('utf-8', 'replace'))
+                    if ident != b"DATA":
+                        raise AdbError(f"Unexpected sync reply: {ident!r}")
+                    data = recv_exact(sock, length)
+                    out.write(data)
+                    if hasher:
+                        hasher.update(data)
+                    received += length
+                    if progress:
+                        progress(received)
+        except Exception:
+            sock.close()
+            raise
+        self._release_sync(serial, sock)
+        return received
+
+    def close(self):
+        with self._lock:
+            for pool in self._sync_pool.values():
+                for sock in pool:
+                    try:
+                        sock.sendall(b"QUIT" + struct.pack("<I", 0))
+                    except OSError:
+                        pass
+                    sock.close()
+            self._sync_pool.clear()
+
+class DeviceTracker:
+    """Keeps a live serial -> state table fed by host:track-devices.
+
+    The server pushes every transition (device, unauthorized, offline,
+    recovery, sideload, ...) on one long-lived connection, so waiters are
+    woken the moment something changes instead of forking adb devices in a loop.
+    """
+
+    def __init__(self, client=None, reconnect_delay=0.5):
+        # Never autostart: a reconnect must not resurrect a server the tool has just killed.
+        self.client = client or AdbClient(autostart=False)
+        self.reconnect_delay = reconnect_delay
+        self.states = {}
+        self.connected = False
+        self.error = None
+        self.updated_at = None
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._sock = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=2):
+        """Ends tracking: closes the live connection so a blocked read returns, then waits for the thread."""
+        self._stopped.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _attach(self, sock):
+        self._sock = sock
+        if self._stopped.is_set():
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def add_listener(self, callback):
+        """callback(serial, old_state, new_state, monotonic_time) runs on the tracker thread."""
+        self._listeners.append(callback)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                for table in self.client.track_devices(on_connect=self._attach):
+                    if self._stopped.is_set():
+                        break
+                    self._update(table)
+            except (AdbError, OSError) as e:
+                self.error = e
+            self._sock = None
+            with self._cond:
+                self.connected = False
+                self._cond.notify_all()
+            self._stopped.wait(self.reconnect_delay)
+
+    def _update(self, table):
+        now = time.monotonic()
+        with self._cond:
+            old = self.states
+            self.states = table
+            self.connected = True
+            self.updated_at = now
+            self._cond.notify_all()
+        for serial in set(old) | set(table):
+            if old.get(serial) != table.get(serial):
+                for callback in self._listeners:
+                    callback(serial, old.get(serial), table.get(serial), now)
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.states)
+
+    def wait_for(self, predicate, timeout=None):
+        """Blocks until predicate(states) is truthy and returns its value, or None on timeout."""
+        with self._cond:
+            result = predicate(self.states)
+            if result or timeout == 0:
+                return result or None
+            self._cond.wait_for(lambda: predicate(self.states), timeout)
+            return predicate(self.states) or None
+
+    def ready_serials(self, states=READY_STATES):
+        return [serial for serial, state in self.snapshot().items() if state in states]
+
+    def wait_for_ready(self, states=READY_STATES, timeout=None):
+        return self.wait_for(lambda table: [s for s, st in table.items() if st in states], timeout)
+
+    def wait_until_gone(self, serial, timeout=None):
+        return self.wait_for(lambda table: table.get(serial) not in READY_STATES, timeout)
+
+_default_client = AdbClient()
+_default_tracker = None
+_tracker_lock = threading.Lock()
+
+def get_client():
+    return _default_client
+
+def get_tracker():
+    global _default_tracker
+    with _tracker_lock:
+        if _default_tracker is None:
+            # The tracker's own client never starts the server, so make sure one is up before it connects.
+            try:
+                _default_client.version()
+            except (AdbError, OSError):
+                pass
+            client = AdbClient(_default_client.host, _default_client.port, autostart=False)
+            _default_tracker = DeviceTracker(client).start()
+        return _default_tracker
+
+def stop_tracker():
+    """Stops the shared tracker; the next get_tracker() call starts a fresh one."""
+    global _default_tracker
+    with _tracker_lock:
+        tracker, _default_tracker = _default_tracker, None
+    if tracker is not None:
+        tracker.stop()
@@ -4,6 +4,21 @@ import sys
 import subprocess
 import itertools
 import os
+import json
+import hashlib
+import shutil
+
+from kanagawa_adb_client import AdbError, READY_STATES, get_client, get_tracker, su_command
+from kanagawa_dump_cache import HASH_CHUNK_SIZE, get_cache
+from kanagawa_history import DELTA_BLOCK_SIZE, REBASE_RATIO, HistoryError, PartitionHistory, block_lengths
+from kanagawa_inspect import describe, inspect_image
+from kanagawa_integrity import DEFAULT_DIGESTS, HashingWriter, MultiHasher, write_digest_manifest
+from kanagawa_lp_metadata import SUPER_PARTITION, get_lp_metadata
+from kanagawa_metrics import Progress, count_spawn, increment, span
+from kanagawa_partition_index import format_size, get_partition_index
+from kanagawa_compress import CODECS, CompressedWriter, compressed_path
+from kanagawa_sparse import SparseFileWriter, SparseImageWriter
+from kanagawa_scheduler import DiskBudget, Job, JobScheduler, DEFAULT_MAX_WORKERS, DEFAULT_PER_DEVICE
 
 class Colors:
     CYAN = '\033[96m'
@@ -13,6 +28,13 @@ class Colors:
     RESET = '\033[0m'
     BOLD = '\033[1m'
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+RESUME_CHUNK_SIZE = 16 * 1024 * 1024
+CHUNK_RETRIES = 3
+ZERO_SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+CACHE_SIZE_LIMIT = 512 * 1024 * 1024
+BATCH_EXCLUDE = ("userdata",)
+
 def print_banner():
     banner = fr"""{Colors.GREEN}{Colors.BOLD}
   _  __                                             
@@ -26,6 +48,7 @@ def print_banner():
     print(banner)
 
 def run_command(cmd, show_error=False):
+    count_spawn(cmd)
     try:
         stderr_target = None if show_error else subprocess.DEVNULL
         result = subprocess.check_output(cmd, shell=True, stderr=stderr_target)
@@ -40,79 +63,724 @@ def check_dependencies():
         sys.exit(1)
     print(f"{Colors.GREEN}[+] Dependencies verified.{Colors.RESET}\n")
 
+def adb_shell(command, serial=None, root=True):
+    command = f"{command} 2>/dev/null"
+    try:
+        return get_client().shell(su_command(command) if root else command, serial)
+    except (AdbError, OSError):
+        return ""
+
+def list_adb_devices():
+    try:
+        return [serial for serial, state in get_client().devices() if state in READY_STATES]
+    except (AdbError, OSError):
+        return []
+
 def wait_for_adb():
     print(f"{Colors.YELLOW}[*] Waiting for an ADB device (Requires Root or TWRP)...{Colors.RESET}")
     spinner = itertools.cycle(['|', '/', '-', '\\'])
+    tracker = get_tracker()
     
-    while True:
-        adb_output = run_command("adb devices")
-        if "device" in adb_output and len(adb_output.split('\n')) > 1:
-            lines = adb_output.split('\n')[1:]
-            for line in lines:
-                if "device" in line and "unauthorized" not in line and "offline" not in line:
-                    sys.stdout.write('\r' + ' ' * 50 + '\r')
-                    print(f"{Colors.GREEN}[+] ADB Device connected!{Colors.RESET}")
-                    return True
-                    
-        sys.stdout.write(f'\r{Colors.CYAN}[{next(spinner)}] Polling ADB daemon...{Colors.RESET}')
-        sys.stdout.flush()
-        time.sleep(0.1)
-
-def extract_single_partition(partition_name):
-    print(f"\n{Colors.CYAN}[*] Attempting to extract '{partition_name}'...{Colors.RESET}")
+    with span("wait_adb", tool="extract"):
+        while True:
+            # Wakes up the instant the server pushes a new device; the timeout only drives the spinner.
+            if tracker.wait_for_ready(timeout=0.1):
+                sys.stdout.write('\r' + ' ' * 50 + '\r')
+                print(f"{Colors.GREEN}[+] ADB Device connected!{Colors.RESET}")
+                return True
+                        
+            sys.stdout.write(f'\r{Colors.CYAN}[{next(spinner)}] Waiting for ADB daemon...{Colors.RESET}')
+            sys.stdout.flush()
+
+def transfer_progress(label, total, serial, target_path, show_progress):
+    return Progress(label, total, show=show_progress, color=Colors.CYAN, reset=Colors.RESET,
+                    tool="extract", serial=serial, target=target_path)
+
+def stream_partition(target_path, out, chunk_size=STREAM_CHUNK_SIZE, serial=None, show_progress=True, skip=0, count=None,
+                     total=None, progress=None):
+    """Pipes dd output from the device straight into out, one chunk at a time.
+
+    Returns the number of bytes written. skip/count select a range in units of chunk_size.
+    A caller dumping several ranges passes one shared progress for all of them.
+    """
+    dd_cmd = f"dd if={target_path} bs={chunk_size}"
+    if skip:
+        dd_cmd += f" skip={skip}"
+    if count is not None:
+        dd_cmd += f" count={count}"
     
-    target_path = f"/dev/block/by-name/{partition_name}"
+    own_progress = progress is None
+    if own_progress:
+        progress = transfer_progress("Streamed", total, serial, target_path, show_progress)
+    written = 0
+    error = None
+    try:
+        with get_client().exec_out(su_command(f"{dd_cmd} 2>/dev/null"), serial) as stream:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+                written += len(chunk)
+                progress.update(len(chunk))
+    except (AdbError, OSError) as e:
+        error = e
+    if own_progress:
+        progress.finish(ok=error is None)
+    if error is not None:
+        increment("stream_interruptions", serial=serial)
+        print(f"\n{Colors.RED}[-] Stream interrupted after {written} bytes: {error}{Colors.RESET}")
+        return 0
+    return written
+
+def device_chunk_hashes(target_path, size, chunk_size, serial=None):
+    """Hashes every chunk of the partition on the device in a single adb round-trip."""
+    count = (size + chunk_size - 1) // chunk_size
+    script = (f"i=0; while [ $i -lt {count} ]; do "
+              f"dd if={target_path} bs={chunk_size} skip=$i count=1 2>/dev/null | sha256sum; "
+              f"i=$((i+1)); done")
+    try:
+        output = get_client().exec_bytes(su_command(script), serial).decode('utf-8', 'replace')
+    except (AdbError, OSError):
+        return None
     
-    check_cmd = f"adb shell su -c 'ls {target_path}'"
-    if not run_command(check_cmd):
-        print(f"{Colors.RED}[-] Could not locate '{target_path}'. It may not exist on this device.{Colors.RESET}")
-        return False
+    hashes = [line.split()[0] for line in output.splitlines() if line.strip()]
+    return hashes if len(hashes) == count else None
+
+def dump_skipping_zeros(target_path, out, size, chunk_size=ZERO_SCAN_CHUNK_SIZE, serial=None, show_progress=True):
+    """Streams only the chunks the device reports as non-zero; zero chunks never cross USB."""
+    hashes = device_chunk_hashes(target_path, size, chunk_size, serial)
+    if hashes is None:
+        print(f"{Colors.YELLOW}[!] On-device zero scan unavailable, streaming every block.{Colors.RESET}")
+        return stream_partition(target_path, out, serial=serial, show_progress=show_progress) == size
+    
+    zero_hash = hashlib.sha256(bytes(chunk_size)).hexdigest()
+    tail = size - (len(hashes) - 1) * chunk_size
+    if hashes and hashes[-1] == hashlib.sha256(bytes(tail)).hexdigest():
+        hashes[-1] = zero_hash
+    
+    progress = transfer_progress("Dumped", size, serial, target_path, show_progress)
+    index = 0
+    while index < len(hashes):
+        start = index
+        if hashes[index] == zero_hash:
+            while index < len(hashes) and hashes[index] == zero_hash:
+                index += 1
+            skipped = min(index * chunk_size, size) - start * chunk_size
+            out.skip(skipped)
+            progress.update(skipped)
+            continue
+            
+        while index < len(hashes) and hashes[index] != zero_hash:
+            index += 1
+        expected = min(index * chunk_size, size) - start * chunk_size
+        got = stream_partition(target_path, out, chunk_size, serial, show_progress, skip=start, count=index - start,
+                               progress=progress)
+        if got != expected:
+            progress.finish(ok=False)
+            return False
+    progress.finish()
+    
+    zero_chunks = hashes.count(zero_hash)
+    print(f"{Colors.CYAN}[*] {zero_chunks}/{len(hashes)} chunk(s) were all zeros and skipped on the device side.{Colors.RESET}")
+    return True
+
+def open_output(local_path, output_format, compression=None, compression_level=None):
+    if compression:
+        return CompressedWriter(local_path, compression, compression_level)
+    if output_format == "sparse":
+        return SparseFileWriter(local_path)
+    if output_format == "simg":
+        return SparseImageWriter(local_path)
+    return open(local_path, 'wb')
+
+def get_partition_size(target_path, serial=None):
+    output = adb_shell(f"blockdev --getsize64 {target_path}", serial)
+    return int(output) if output.isdigit() else None
+
+def device_sha256(target_path, serial=None):
+    output = adb_shell(f"sha256sum {target_path}", serial)
+    digest = output.split()[0] if output else ""
+    return digest if len(digest) == 64 else None
+
+def detach_local(path):
+    """Gives path its own inode again if it is a hardlink into the dump cache."""
+    try:
+        if os.stat(path).st_nlink > 1:
+            tmp_path = path + ".detach"
+            shutil.copyfile(path, tmp_path)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+    except FileNotFoundError:
+        pass
+
+def read_device_chunk(target_path, index, chunk_size, serial=None):
+    dd_cmd = f"dd if={target_path} bs={chunk_size} skip={index} count=1 2>/dev/null"
+    try:
+        return get_client().exec_bytes(su_command(dd_cmd), serial)
+    except (AdbError, OSError):
+        return b""
+
+def load_manifest(manifest_path, size, chunk_size):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("size") == size and manifest.get("chunk_size") == chunk_size:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"size": size, "chunk_size": chunk_size, "algorithm": "sha256", "chunks": {}}
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def chunked_dump(target_path, local_path, size, chunk_size=RESUME_CHUNK_SIZE, serial=None, show_progress=True,
+                 hasher=None):
+    """Dumps the partition in dd skip/count chunks, resuming from the sidecar manifest.
+
+    Chunks already on disk whose sha256 matches the manifest are kept; anything
+    missing, short or corrupted is fetched again, so an interrupted run can pick
+    up where it left off. hasher is fed every chunk in order, reused or fetched.
+    """
+    manifest_path = local_path + ".manifest.json"
+    manifest = load_manifest(manifest_path, size, chunk_size)
+    manifest["source"] = target_path
+    chunks = manifest["chunks"]
+    total_chunks = (size + chunk_size - 1) // chunk_size
+    reused = fetched = 0
+    progress = transfer_progress("Chunked", size, serial, target_path, show_progress)
+    
+    with open(local_path, 'r+b' if os.path.exists(local_path) else 'w+b') as out:
+        out.truncate(size)
         
-    print(f"{Colors.GREEN}[+] Found partition at: {target_path}{Colors.RESET}")
+        for index in range(total_chunks):
+            offset = index * chunk_size
+            expected = min(chunk_size, size - offset)
+            
+            if str(index) in chunks:
+                out.seek(offset)
+                data = out.read(expected)
+                if hashlib.sha256(data).hexdigest() == chunks[str(index)]:
+                    if hasher:
+                        hasher.update(data)
+                    reused += 1
+                    progress.update(expected)
+                    continue
+                del chunks[str(index)]
+            
+            data = b""
+            for attempt in range(CHUNK_RETRIES):
+                if attempt:
+                    increment("chunk_retries", serial=serial)
+                data = read_device_chunk(target_path, index, chunk_size, serial)
+                if len(data) == expected:
+                    break
+            if len(data) != expected:
+                save_manifest(manifest_path, manifest)
+                progress.finish(ok=False)
+                print(f"{Colors.RED}[-] Chunk {index} came back {len(data)}/{expected} bytes. Rerun to resume.{Colors.RESET}")
+                return False
+                
+            out.seek(offset)
+            out.write(data)
+            if hasher:
+                hasher.update(data)
+            chunks[str(index)] = hashlib.sha256(data).hexdigest()
+            save_manifest(manifest_path, manifest)
+            fetched += 1
+            progress.update(expected)
     
+    progress.finish()
+    print(f"{Colors.CYAN}[*] {fetched} chunk(s) fetched, {reused} reused from a previous run.{Colors.RESET}")
+    return True
+
+def stage_and_pull_partition(target_path, local_path, partition_name, serial=None, size=None, show_progress=True,
+                             hasher=None):
     temp_path = f"/sdcard/{partition_name}_dump.img"
-    local_path = f"{partition_name}_dump.img"
     
     print(f"{Colors.YELLOW}[*] Dumping block to internal storage via dd...{Colors.RESET}")
-    dd_cmd = f"adb shell su -c 'dd if={target_path} of={temp_path}'"
-    run_command(dd_cmd)
+    with span("stage", tool="extract", serial=serial, target=target_path):
+        adb_shell(f"dd if={target_path} of={temp_path}", serial)
     
     print(f"{Colors.YELLOW}[*] Pulling {temp_path} to PC...{Colors.RESET}")
-    run_command(f"adb pull {temp_path} {local_path}", show_error=True)
+    progress = transfer_progress("Pulled", size, serial, target_path, show_progress)
+    ok = False
+    try:
+        get_client().pull(temp_path, local_path, serial, progress=lambda received: progress.update(received - progress.done),
+                          hasher=hasher)
+        progress.finish()
+        ok = True
+    except (AdbError, OSError) as e:
+        progress.finish(ok=False)
+        print(f"{Colors.RED}[-] Pull failed: {e}{Colors.RESET}")
     
     print(f"{Colors.CYAN}[*] Cleaning up temporary files on device...{Colors.RESET}")
-    run_command(f"adb shell su -c 'rm {temp_path}'")
+    adb_shell(f"rm {temp_path}", serial)
+    
+    return ok and os.path.exists(local_path)
+
+def block_runs(indices):
+    """Groups sorted block indices into (first, count) runs, one dd skip/count each."""
+    runs = []
+    for index in indices:
+        if runs and runs[-1][0] + runs[-1][1] == index:
+            runs[-1][1] += 1
+        else:
+            runs.append([index, 1])
+    return runs
+
+def incremental_dump(target_path, partition_name, size, serial=None, show_progress=True, tag=""):
+    """Records a new version of the partition, pulling only the blocks whose on-device hash changed.
+
+    The device hashes every block in one round-trip; those hashes are compared
+    with the last recorded version, and only the changed runs cross USB, into
+    a delta file. The first visit, or one that changed most of the partition,
+    is stored as a full base instead.
+    """
+    history = PartitionHistory(serial, partition_name)
+    block_size = DELTA_BLOCK_SIZE
+    with span("device_block_hashes", tool="extract", serial=serial, target=target_path):
+        hashes = device_chunk_hashes(target_path, size, block_size, serial)
+    if hashes is None:
+        print(f"{Colors.RED}[-] {tag}The device could not hash {target_path} block by block, which incremental mode needs.{Colors.RESET}")
+        return False
+
+    previous = history.block_hashes() if history.compatible(size, block_size) else None
+    if previous is None:
+        changed = list(range(len(hashes)))
+    else:
+        changed = [index for index, digest in enumerate(hashes) if digest != previous[index]]
+    if previous is not None and not changed:
+        print(f"{Colors.GREEN}{Colors.BOLD}[+] {tag}{partition_name} is unchanged since version {history.latest()['version']}. "
+              f"Nothing pulled.{Colors.RESET}")
+        return True
+
+    changed_bytes = sum(block_lengths(size, block_size, changed))
+    full = previous is None or changed_bytes > size * REBASE_RATIO
+    pending = history.begin(size, block_size, None if full else changed)
+    if full:
+        reason = "no earlier version to diff against" if previous is None else f"{len(changed)}/{len(hashes)} blocks changed"
+        print(f"{Colors.YELLOW}[*] {tag}Pulling all of {partition_name} as a new base ({reason})...{Colors.RESET}")
+        changed = list(range(len(hashes)))
+    else:
+        print(f"{Colors.YELLOW}[*] {tag}{len(changed)}/{len(hashes)} blocks changed since version {history.latest()['version']}, "
+              f"pulling {format_size(changed_bytes)}...{Colors.RESET}")
+
+    progress = transfer_progress("Delta", pending.expected, serial, target_path, show_progress)
+    for start, count in block_runs(changed):
+        expected = sum(block_lengths(size, block_size, range(start, start + count)))
+        got = stream_partition(target_path, pending, block_size, serial, show_progress, skip=start, count=count,
+                               progress=progress)
+        if got != expected:
+            progress.finish(ok=False)
+            pending.discard()
+            print(f"{Colors.RED}[-] {tag}Extraction failed for {partition_name}.{Colors.RESET}")
+            return False
+    progress.finish()
+
+    mismatched = [index for index, digest in zip(changed, pending.hashes) if digest != hashes[index]]
+    if mismatched or len(pending.hashes) != len(changed):
+        pending.discard()
+        print(f"{Colors.RED}[-] {tag}{len(mismatched) or 'Some'} pulled block(s) do not match the device's hashes "
+              f"(changed while dumping?). Nothing recorded.{Colors.RESET}")
+        return False
+    try:
+        record = history.commit(pending)
+    except (HistoryError, OSError) as e:
+        print(f"{Colors.RED}[-] {tag}Could not record the new version: {e}{Colors.RESET}")
+        return False
+
+    print(f"{Colors.GREEN}{Colors.BOLD}[+] {tag}Recorded {partition_name} version {record['version']} "
+          f"({record['kind']}, {format_size(record['stored'])} stored; history now {format_size(history.stored_bytes())}).{Colors.RESET}")
+    print(f"{Colors.CYAN}[*] {tag}Rebuild any version with: kanagawa_toolkit history {history.serial} {partition_name} "
+          f"--rebuild {record['version']}{Colors.RESET}")
+    return True
+
+def extent_block_size(offset, length, limit=STREAM_CHUNK_SIZE):
+    """The largest power-of-two dd block size, up to limit, that both offset and length are multiples of."""
+    bs = limit
+    while bs > 512 and (offset % bs or length % bs):
+        bs //= 2
+    return bs
+
+def extent_dd(source, offset, length):
+    bs = extent_block_size(offset, length)
+    return f"dd if=/dev/block/by-name/{source} bs={bs} skip={offset // bs} count={length // bs} 2>/dev/null"
+
+def dump_extents(ranges, out, size, serial=None, show_progress=True):
+    """Streams each (source, offset, length) range in order; zero-fill extents are never read from the device."""
+    progress = transfer_progress("Streamed", size, serial, SUPER_PARTITION, show_progress)
+    for source, offset, length in ranges:
+        if source is None:
+            out.skip(length)
+            progress.update(length)
+            continue
+        bs = extent_block_size(offset, length)
+        got = stream_partition(f"/dev/block/by-name/{source}", out, bs, serial, show_progress, skip=offset // bs,
+                               count=length // bs, progress=progress)
+        if got != length:
+            progress.finish(ok=False)
+            return False
+    progress.finish()
+    return True
+
+def device_extents_sha256(ranges, serial=None):
+    """sha256 of the extents concatenated on the device, in one shell round-trip."""
+    parts = [extent_dd(source, offset, length) if source else f"head -c {length} /dev/zero"
+             for source, offset, length in ranges]
+    output = adb_shell(f"{{ {'; '.join(parts)}; }} | sha256sum", serial)
+    digest = output.split()[0] if output else ""
+    return digest if len(digest) == 64 else None
+
+def extract_logical_partition(partition_name, lp, serial, local_path, show_progress=True, output_format="raw",
+                              compression=None, compression_level=None, verify=True, digests=DEFAULT_DIGESTS, tag=""):
+    """Pulls only the extents of one logical partition out of super and joins them into a standalone image."""
+    ranges = lp.ranges(partition_name)
+    size = lp.size(partition_name)
+    manifest = {"partition": partition_name, "serial": serial, "source": SUPER_PARTITION, "metadata_slot": lp.slot,
+                "extents": [[source, offset, length] for source, offset, length in ranges], "length": size,
+                "method": "extents", "format": output_format, "compression": compression}
+    
+    if os.path.lexists(local_path):
+        os.unlink(local_path)
+    print(f"{Colors.YELLOW}[*] {tag}Streaming {len(ranges)} extent(s) of {partition_name} from {SUPER_PARTITION}...{Colors.RESET}")
+    hasher = MultiHasher(digests)
+    with open_output(local_path, output_format, compression, compression_level) as raw_out:
+        ok = dump_extents(ranges, HashingWriter(raw_out, hasher), size, serial, show_progress)
+    if ok and hasher.length != size:
+        print(f"{Colors.RED}[-] {tag}Image is truncated: got {hasher.length} of {size} bytes.{Colors.RESET}")
+        ok = False
+    
+    device_digest = None
+    if ok and verify:
+        with span("device_sha256", tool="extract", serial=serial, target=partition_name):
+            device_digest = device_extents_sha256(ranges, serial)
+        if device_digest is None:
+            print(f"{Colors.YELLOW}[!] {tag}The device could not hash the extents; only the host-side digest is recorded.{Colors.RESET}")
+    if ok:
+        ok = verify_dump(local_path, partition_name, serial, hasher, device_digest, False, manifest, tag)
+    
+    if ok:
+        print(f"{Colors.GREEN}{Colors.BOLD}[+] {tag}Success! Logical partition saved as {local_path}{Colors.RESET}")
+        print_image_summary(local_path, output_format, compression, tag)
+    else:
+        print(f"{Colors.RED}[-] {tag}Extraction failed for {partition_name}.{Colors.RESET}")
+    return ok
+
+def print_image_summary(local_path, output_format, compression, tag=""):
+    """One line on what landed (boot header, vbmeta flags, super layout), read from the image's headers only."""
+    if compression or output_format == "simg":
+        return
+    try:
+        info = inspect_image(local_path)
+    except OSError:
+        return
+    if info.get("kind") not in (None, "unknown", "empty"):
+        print(f"{Colors.CYAN}[*] {tag}{describe(info)}{Colors.RESET}")
+
+def verify_dump(local_path, target_path, serial, hasher, device_digest, verify, manifest, tag=""):
+    """Checks the streamed sha256 against the device's and writes <image>.digests.json.
+
+    device_digest is reused when the cache lookup already computed it; otherwise
+    the device hashes the partition now, unless verify is off.
+    """
+    local_digest = hasher.hexdigest()
+    if device_digest is None and verify:
+        with span("device_sha256", tool="extract", serial=serial, target=target_path):
+            device_digest = device_sha256(target_path, serial)
+    
+    verified = None
+    if device_digest is None:
+        if verify:
+            print(f"{Colors.YELLOW}[!] {tag}The device could not hash {target_path}; only the host-side digest is recorded.{Colors.RESET}")
+    elif device_digest != local_digest:
+        print(f"{Colors.RED}[-] {tag}Image does not match the device's sha256 ({local_digest[:12]} != {device_digest[:12]}).{Colors.RESET}")
+        verified = False
+    else:
+        print(f"{Colors.GREEN}[+] {tag}sha256 {local_digest[:12]} matches the device.{Colors.RESET}")
+        verified = True
+    
+    manifest = dict(manifest, length=hasher.length)
+    write_digest_manifest(local_path, digests=hasher.hexdigests(), device_sha256=device_digest, verified=verified, **manifest)
+    return verified is not False
+
+def extract_single_partition(partition_name, method="stream", serial=None, output_dir="", show_progress=True, output_format="raw",
+                             compression=None, compression_level=None, use_cache=True, verify=True, digests=DEFAULT_DIGESTS):
+    with span("extract", tool="extract", serial=serial, usb=get_client().usb_path(serial), partition=partition_name,
+              method=method, format=output_format, compression=compression) as fields:
+        fields["ok"] = _extract_single_partition(partition_name, method, serial, output_dir, show_progress, output_format,
+                                                 compression, compression_level, use_cache, verify, digests)
+        return fields["ok"]
+
+def _extract_single_partition(partition_name, method, serial, output_dir, show_progress, output_format,
+                              compression, compression_level, use_cache, verify, digests):
+    tag = f"[{serial}] " if serial else ""
+    print(f"\n{Colors.CYAN}[*] {tag}Attempting to extract '{partition_name}'...{Colors.RESET}")
+    
+    target_path = f"/dev/block/by-name/{partition_name}"
+    index = get_partition_index(serial)
+    
+    if index is not None:
+        found = partition_name in index
+    else:
+        found = bool(adb_shell(f"ls {target_path}", serial))
+    logical = None
+    if not found:
+        lp = get_lp_metadata(serial)
+        logical = lp if lp is not None and partition_name in lp else None
+    if not found and logical is None:
+        print(f"{Colors.RED}[-] {tag}Could not locate '{target_path}'. It may not exist on this device.{Colors.RESET}")
+        return False
+    
+    if logical is not None:
+        extents = len(logical.partition(partition_name).extents)
+        print(f"{Colors.GREEN}[+] {tag}Found logical partition '{partition_name}' inside {SUPER_PARTITION} "
+              f"({extents} extent(s), {format_size(logical.size(partition_name))}){Colors.RESET}")
+        if method != "stream":
+            print(f"{Colors.YELLOW}[!] {tag}Logical partitions are always streamed extent by extent.{Colors.RESET}")
+            method = "stream"
+    else:
+        print(f"{Colors.GREEN}[+] {tag}Found partition at: {target_path}{Colors.RESET}")
+    
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    extension = "simg" if output_format == "simg" else "img"
+    local_path = os.path.join(output_dir, f"{partition_name}_dump.{extension}")
+    if compression and method == "stream":
+        local_path = compressed_path(local_path, compression)
+    
+    if logical is not None:
+        return extract_logical_partition(partition_name, logical, serial, local_path, show_progress, output_format,
+                                         compression, compression_level, verify, digests, tag)
     
-    if os.path.exists(local_path):
-        print(f"{Colors.GREEN}{Colors.BOLD}[+] Success! Partition saved as {local_path}{Colors.RESET}")
+    size = index.size(partition_name) if index is not None else get_partition_size(target_path, serial)
+    
+    if method == "incremental":
+        if size is None:
+            print(f"{Colors.RED}[-] {tag}Could not read the partition size, which incremental mode needs.{Colors.RESET}")
+            return False
+        return incremental_dump(target_path, partition_name, size, serial, show_progress, tag)
+    
+    cache = get_cache()
+    cache_key = serial or "default"
+    cacheable = use_cache and output_format == "raw" and not compression and size is not None and size <= CACHE_SIZE_LIMIT
+    manifest = {"partition": partition_name, "serial": serial, "source": target_path, "offset": 0, "length": size,
+                "method": method, "format": output_format, "compression": compression}
+    digest = None
+    if cacheable:
+        with span("device_sha256", tool="extract", serial=serial, target=target_path):
+            digest = device_sha256(target_path, serial)
+        if digest and cache.has(digest):
+            how = cache.materialize(digest, local_path)
+            # Only claim verified=True for bytes that were hashed again after leaving the store.
+            hasher = MultiHasher(digests)
+            with open(local_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+            if hasher.hexdigest() == digest:
+                cache.record(cache_key, partition_name, digest, size)
+                write_digest_manifest(local_path, digests=hasher.hexdigests(), device_sha256=digest, verified=True,
+                                      from_cache=True, **manifest)
+                verb = {"reflink": "reflinked", "copy": "copied"}[how]
+                print(f"{Colors.GREEN}{Colors.BOLD}[+] {tag}Unchanged since a previous dump (sha256 {digest[:12]}), "
+                      f"{verb} from the cache as {local_path}. Nothing pulled.{Colors.RESET}")
+                return True
+            print(f"{Colors.YELLOW}[!] {tag}The cached copy of {partition_name} is damaged "
+                  f"(sha256 {hasher.hexdigest()[:12]}), dropping it and pulling again.{Colors.RESET}")
+            cache.evict(digest)
+    
+    if method == "chunked":
+        detach_local(local_path)
+    elif os.path.lexists(local_path):
+        os.unlink(local_path)
+    
+    hasher = MultiHasher(digests)
+    if method == "chunked":
+        if size is None:
+            print(f"{Colors.RED}[-] {tag}Could not read the partition size, which resumable mode needs.{Colors.RESET}")
+            return False
+        print(f"{Colors.YELLOW}[*] {tag}Dumping in resumable {RESUME_CHUNK_SIZE // (1024 * 1024)} MiB chunks...{Colors.RESET}")
+        ok = chunked_dump(target_path, local_path, size, serial=serial, show_progress=show_progress, hasher=hasher)
+    elif method == "stream":
+        with open_output(local_path, output_format, compression, compression_level) as raw_out:
+            out = HashingWriter(raw_out, hasher)
+            if output_format != "raw" and size is not None:
+                print(f"{Colors.YELLOW}[*] {tag}Scanning for zero blocks on the device, then streaming the rest...{Colors.RESET}")
+                ok = dump_skipping_zeros(target_path, out, size, serial=serial, show_progress=show_progress)
+            else:
+                print(f"{Colors.YELLOW}[*] {tag}Streaming block directly to PC via dd (no device staging)...{Colors.RESET}")
+                if compression:
+                    print(f"{Colors.YELLOW}[*] {tag}Compressing on the fly with {compression} -{raw_out.level}...{Colors.RESET}")
+                ok = stream_partition(target_path, out, serial=serial, show_progress=show_progress, total=size) > 0
+            skipped = out.skipped
+        if skipped:
+            print(f"{Colors.CYAN}[*] {tag}{skipped / (1024 * 1024):.1f} MiB of zero blocks left out of {local_path}.{Colors.RESET}")
+    else:
+        ok = stage_and_pull_partition(target_path, local_path, partition_name, serial=serial, size=size,
+                                      show_progress=show_progress, hasher=hasher)
+    
+    # Every method hashed the bytes as they were written, so the image is never read back for verification.
+    dumped = hasher.length
+    if ok and size is not None and dumped != size:
+        print(f"{Colors.RED}[-] {tag}Image is truncated: got {dumped} of {size} bytes.{Colors.RESET}")
+        ok = False
+    
+    if ok:
+        ok = verify_dump(local_path, target_path, serial, hasher, digest, verify, manifest, tag)
+    if ok and cacheable and digest:
+        cache.ingest(local_path, cache_key, partition_name, digest)
+    
+    if ok:
+        print(f"{Colors.GREEN}{Colors.BOLD}[+] {tag}Success! Partition saved as {local_path}{Colors.RESET}")
+        print_image_summary(local_path, output_format, compression, tag)
         return True
     else:
-        print(f"{Colors.RED}[-] Extraction failed for {partition_name}.{Colors.RESET}")
+        print(f"{Colors.RED}[-] {tag}Extraction failed for {partition_name}.{Colors.RESET}")
         return False
 
-def interactive_menu():
-    partitions_ab = ["boot", "logo", "vbmeta", "init_boot", "lk", "tee", "scp", "dtbo"]
-    partitions_single = ["nvram", "nvdata", "persist", "proinfo", "seccfg", "super"]
+def run_extraction_jobs(jobs, method="stream", output_format="raw", compression=None, compression_level=None, max_workers=DEFAULT_MAX_WORKERS,
+                        per_device=DEFAULT_PER_DEVICE, budget=None):
+    """Dumps a list of (serial, partition) pairs concurrently, one output folder per serial.
+
+    Jobs are started largest first, so a big super dump is not left running
+    alone at the end while every other slot sits idle. With a DiskBudget, a
+    job only starts once its full size fits on the host disk.
+    """
+    jobs = [Job(serial, partition) for serial, partition in jobs]
+    for job in jobs:
+        index = get_partition_index(job.serial)
+        job.size = index.size(job.target) if index is not None else None
+    jobs.sort(key=lambda job: job.size or 0, reverse=True)
+    total = len(jobs)
+    total_bytes = sum(job.size or 0 for job in jobs)
+    finished_bytes = [0]
+    
+    def dump(job):
+        try:
+            return extract_single_partition(job.target, method=method, serial=job.serial,
+                                            output_dir=job.serial, show_progress=False, output_format=output_format,
+                                            compression=compression, compression_level=compression_level)
+        finally:
+            if budget is not None and job.size is not None:
+                budget.release(job.size)
+    
+    def report(job, finished):
+        if job.skipped:
+            print(f"{Colors.RED}[-] ({finished}/{total}) {job.serial}: {job.target} skipped, "
+                  f"{format_size(job.size)} will not fit on the host disk{Colors.RESET}")
+            return
+        finished_bytes[0] += job.size or 0
+        eta = ""
+        elapsed = time.monotonic() - start
+        if total_bytes and finished_bytes[0] and finished < total:
+            remaining = (total_bytes - finished_bytes[0]) * elapsed / finished_bytes[0]
+            eta = f", about {int(remaining // 60)}m{int(remaining % 60):02d}s left"
+        if job.ok:
+            print(f"{Colors.GREEN}[+] ({finished}/{total}) {job.serial}: {job.target} done in {job.duration:.1f}s{eta}{Colors.RESET}")
+        else:
+            reason = f" ({job.error})" if job.error else ""
+            print(f"{Colors.RED}[-] ({finished}/{total}) {job.serial}: {job.target} failed after {job.duration:.1f}s{reason}{eta}{Colors.RESET}")
+    
+    start = time.monotonic()
+    done = JobScheduler(max_workers, per_device).run(jobs, dump, on_complete=report,
+                                                     admit=budget.admit if budget is not None else None)
+    
+    succeeded = sum(1 for job in done if job.ok)
+    skipped = sum(1 for job in done if job.skipped)
+    print(f"\n{Colors.BOLD}[*] {succeeded}/{total} jobs succeeded in {time.monotonic() - start:.1f}s.{Colors.RESET}")
+    if skipped:
+        print(f"{Colors.RED}[!] {skipped} job(s) were not started because the host disk is too full. "
+              f"Free up space and rerun to dump them.{Colors.RESET}")
+    return done
+
+def full_backup_jobs(serials, include_userdata=False):
+    """Every by-name partition on every device, as (serial, partition) pairs."""
+    excluded = () if include_userdata else BATCH_EXCLUDE
+    jobs = []
+    for serial in serials:
+        index = get_partition_index(serial)
+        if index is None:
+            print(f"{Colors.RED}[-] [{serial}] Could not read the partition table, skipping this device.{Colors.RESET}")
+            continue
+        jobs += [(serial, name) for name in sorted(index.entries) if name not in excluded]
+    return jobs
+
+def run_full_backup(serials, include_userdata=False, method="stream", output_format="raw", compression=None, compression_level=None):
+    jobs = full_backup_jobs(serials, include_userdata)
+    if not jobs:
+        return []
+    
+    budget = DiskBudget(".")
+    total_bytes = sum(get_partition_index(serial).size(name) or 0 for serial, name in jobs)
+    free = budget.available()
+    print(f"{Colors.CYAN}[*] Full backup: {len(jobs)} partitions on {len(serials)} device(s), "
+          f"{format_size(total_bytes)} raw; {format_size(max(free, 0))} usable on the host disk.{Colors.RESET}")
+    if output_format == "raw" and not compression and total_bytes > free:
+        print(f"{Colors.YELLOW}[!] That will not all fit. Partitions that do not fit are skipped instead of "
+              f"being written halfway.{Colors.RESET}")
+    
+    return run_extraction_jobs(jobs, method=method, output_format=output_format, compression=compression,
+                               compression_level=compression_level, budget=budget)
+
+DEFAULT_PARTITIONS_AB = ["boot", "logo", "vbmeta", "init_boot", "lk", "tee", "scp", "dtbo"]
+DEFAULT_PARTITIONS_SINGLE = ["nvram", "nvdata", "persist", "proinfo", "seccfg", "super"]
+
+def interactive_menu(index=None, logical=None):
+    """Offers the partitions the device actually has, or the usual MTK set when no index could be read.
+
+    logical adds the non-empty logical partitions inside super, which are dumped extent by extent.
+    Returns (targets, full_backup); full_backup is set when every partition was chosen.
+    """
+    if index is not None:
+        partitions_ab = index.slotted()
+        partitions_single = index.unslotted()
+        ab_size = lambda p: f", {format_size(index.size(p + '_a'))}"
+        single_size = lambda p: f" ({format_size(index.size(p))})"
+    else:
+        partitions_ab = DEFAULT_PARTITIONS_AB
+        partitions_single = DEFAULT_PARTITIONS_SINGLE
+        ab_size = lambda p: ""
+        single_size = lambda p: ""
+    active_slot = index.slot.lstrip("_") if index is not None else ""
     
     print(f"{Colors.BOLD}--- Select Partition to Dump ---{Colors.RESET}")
     
-    print(f"{Colors.CYAN}A/B Partitions:{Colors.RESET}")
+    if partitions_ab:
+        header = f"A/B Partitions (active slot: {active_slot}):" if active_slot else "A/B Partitions:"
+        print(f"{Colors.CYAN}{header}{Colors.RESET}")
     for i, p in enumerate(partitions_ab, 1):
-        print(f"  [{i}] {p} (a/b)")
+        print(f"  [{i}] {p} (a/b{ab_size(p)})")
         
     offset = len(partitions_ab)
     print(f"\n{Colors.CYAN}Single Partitions:{Colors.RESET}")
     for i, p in enumerate(partitions_single, offset + 1):
-        print(f"  [{i}] {p}")
+        print(f"  [{i}] {p}{single_size(p)}")
+    
+    partitions_logical = logical.names() if logical is not None else []
+    logical_offset = offset + len(partitions_single)
+    if partitions_logical:
+        print(f"\n{Colors.CYAN}Logical Partitions (inside {SUPER_PARTITION}, only their extents are pulled):{Colors.RESET}")
+    for i, p in enumerate(partitions_logical, logical_offset + 1):
+        print(f"  [{i}] {p} ({format_size(logical.size(p))})")
         
     print(f"\n{Colors.CYAN}Other:{Colors.RESET}")
     print(f"  [0] Custom (Type manually)")
+    if index is not None:
+        print(f"  [A] Everything (full device backup, {format_size(index.total_size(index.entries))})")
     
+    answer = input(f"\n{Colors.YELLOW}Enter your choice (0-{logical_offset + len(partitions_logical)}): {Colors.RESET}").strip()
+    if index is not None and answer.lower() == 'a':
+        include = input(f"{Colors.YELLOW}Include userdata? [y/N]: {Colors.RESET}").strip().lower() == 'y'
+        excluded = () if include else BATCH_EXCLUDE
+        return [name for name in sorted(index.entries) if name not in excluded], True
     try:
-        choice = int(input(f"\n{Colors.YELLOW}Enter your choice (0-{len(partitions_ab) + len(partitions_single)}): {Colors.RESET}"))
+        choice = int(answer)
     except ValueError:
         print(f"{Colors.RED}[-] Invalid input.{Colors.RESET}")
-        return []
+        return [], False
 
     targets = []
 
@@ -122,7 +790,10 @@ def interactive_menu():
         
     elif 1 <= choice <= len(partitions_ab):
         base_name = partitions_ab[choice - 1]
-        slot = input(f"{Colors.YELLOW}Select slot for '{base_name}' [a / b / both]: {Colors.RESET}").strip().lower()
+        prompt = f"Select slot for '{base_name}' [a / b / both]"
+        if active_slot:
+            prompt += f" [{active_slot}]"
+        slot = input(f"{Colors.YELLOW}{prompt}: {Colors.RESET}").strip().lower() or active_slot
         
         if slot == 'a':
             targets.append(f"{base_name}_a")
@@ -134,13 +805,63 @@ def interactive_menu():
         else:
             print(f"{Colors.RED}[-] Invalid slot selected.{Colors.RESET}")
             
-    elif len(partitions_ab) < choice <= len(partitions_ab) + len(partitions_single):
+    elif len(partitions_ab) < choice <= logical_offset:
         targets.append(partitions_single[choice - offset - 1])
+    
+    elif logical_offset < choice <= logical_offset + len(partitions_logical):
+        targets.append(partitions_logical[choice - logical_offset - 1])
         
     else:
         print(f"{Colors.RED}[-] Choice out of range.{Colors.RESET}")
 
-    return targets
+    return targets, False
+
+def select_dump_method():
+    print(f"\n{Colors.BOLD}--- Dump Method ---{Colors.RESET}")
+    print("  [1] Stream directly to PC (Recommended, no /sdcard space needed)")
+    print("  [2] Stage on /sdcard, then adb pull (Legacy)")
+    print("  [3] Chunked & resumable, with per-chunk checksums (Flaky USB / huge partitions)")
+    print("  [4] Incremental, only blocks changed since the last visit (versioned nvdata/persist/proinfo history)")
+    
+    choice = input(f"\n{Colors.YELLOW}Select a method (1-4) [1]: {Colors.RESET}").strip()
+    return {'2': "staged", '3': "chunked", '4': "incremental"}.get(choice, "stream")
+
+def select_output_format():
+    print(f"\n{Colors.BOLD}--- Output Format ---{Colors.RESET}")
+    print("  [1] Raw image (Default)")
+    print("  [2] Sparse host file (zero blocks stored as holes)")
+    print("  [3] Android sparse image (.simg, flashable with fastboot)")
+    
+    choice = input(f"\n{Colors.YELLOW}Select a format (1-3) [1]: {Colors.RESET}").strip()
+    return {'2': "sparse", '3': "simg"}.get(choice, "raw")
+
+def select_compression():
+    print(f"\n{Colors.BOLD}--- Compression ---{Colors.RESET}")
+    print("  [1] None (Default)")
+    print(f"  [2] gzip (fast, link-bound on USB 2.0 at level {CODECS['gzip'][1]})")
+    print(f"  [3] xz (smallest, CPU-bound)")
+    
+    codec = {'2': "gzip", '3': "xz"}.get(input(f"\n{Colors.YELLOW}Select compression (1-3) [1]: {Colors.RESET}").strip())
+    if not codec:
+        return None, None
+        
+    default_level = CODECS[codec][1]
+    level = input(f"{Colors.YELLOW}Compression level (0-9) [{default_level}]: {Colors.RESET}").strip()
+    return codec, int(level) if level.isdigit() and int(level) <= 9 else default_level
+
+def select_devices(serials):
+    if len(serials) <= 1:
+        return serials
+        
+    print(f"\n{Colors.BOLD}--- Connected Devices ---{Colors.RESET}")
+    for i, serial in enumerate(serials, 1):
+        print(f"  [{i}] {serial}")
+    print(f"  [0] All devices (dumped in parallel into per-serial folders)")
+    
+    choice = input(f"\n{Colors.YELLOW}Select a device (0-{len(serials)}) [0]: {Colors.RESET}").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(serials):
+        return [serials[int(choice) - 1]]
+    return serials
 
 def main():
     print_banner()
@@ -150,27 +871,69 @@ def main():
     print("1. Ensure device is booted normally (with Root) or in TWRP Recovery.")
     print("2. Connect via USB and ensure USB Debugging is authorized.\n")
     
-    targets_to_dump = interactive_menu()
-    
-    if not targets_to_dump:
-        print(f"{Colors.RED}[!] No valid partitions selected. Exiting.{Colors.RESET}")
-        sys.exit(0)
-        
-    print(f"\n{Colors.CYAN}[*] Selected for extraction: {', '.join(targets_to_dump)}{Colors.RESET}\n")
-    
     run_command("adb start-server")
     
     try:
-        if wait_for_adb():
+        if not wait_for_adb():
+            return
+        serials = select_devices(list_adb_devices())
+        if not serials:
+            print(f"{Colors.RED}[-] Device disconnected before extraction could start.{Colors.RESET}")
+            get_client().kill_server()
+            return
+        
+        print(f"{Colors.CYAN}[*] Reading the partition table...{Colors.RESET}")
+        index = get_partition_index(serials[0])
+        if index is None:
+            print(f"{Colors.YELLOW}[!] Could not list /dev/block/by-name (no root yet?), showing the usual partitions.{Colors.RESET}")
+        else:
+            print(f"{Colors.GREEN}[+] {len(index)} partitions found.{Colors.RESET}")
+        logical = get_lp_metadata(serials[0])
+        if logical is not None:
+            print(f"{Colors.GREEN}[+] {len(logical.names())} logical partitions found in {SUPER_PARTITION} "
+                  f"(metadata slot {logical.slot}).{Colors.RESET}")
+        print()
+        
+        targets_to_dump, full_backup = interactive_menu(index, logical)
+        
+        if not targets_to_dump:
+            print(f"{Colors.RED}[!] No valid partitions selected. Exiting.{Colors.RESET}")
+            get_client().kill_server()
+            sys.exit(0)
+            
+        method = select_dump_method()
+        output_format = select_output_format() if method == "stream" else "raw"
+        compression, compression_level = select_compression() if method == "stream" and output_format == "raw" else (None, None)
+        
+        if full_backup:
+            print()
+            run_full_backup(serials, include_userdata="userdata" in targets_to_dump, method=method,
+                            output_format=output_format, compression=compression, compression_level=compression_level)
+            get_client().kill_server()
+            return
+        
+        selected = f"{Colors.CYAN}[*] Selected for extraction: {', '.join(targets_to_dump)}"
+        if index is not None:
+            total = index.total_size(targets_to_dump)
+            if logical is not None:
+                total += sum(logical.size(name) or 0 for name in targets_to_dump if name not in index)
+            selected += f" ({format_size(total)} per device)"
+        print(f"\n{selected}{Colors.RESET}\n")
+        
+        if len(serials) > 1:
+            jobs = [(serial, target) for serial in serials for target in targets_to_dump]
+            run_extraction_jobs(jobs, method=method, output_format=output_format,
+                                compression=compression, compression_level=compression_level)
+        else:
             for target in targets_to_dump:
-                extract_single_partition(target)
-                time.sleep(1)
+                extract_single_partition(target, method=method, serial=serials[0], output_format=output_format,
+                                         compression=compression, compression_level=compression_level)
                 
-        run_command("adb kill-server")
+        get_client().kill_server()
     except KeyboardInterrupt:
         print(f"\n\n{Colors.RED}[!] Process aborted by user.{Colors.RESET}")
-        run_command("adb kill-server")
+        get_client().kill_server()
         sys.exit(0)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
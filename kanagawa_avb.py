@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import struct
+
+from kanagawa_dump_cache import CACHE_DIR, file_sha256
+
+AVB_MAGIC = b"AVB0"
+AVB_VERSION_MAJOR = 1
+AVB_VERSION_MINOR = 0
+AVB_RELEASE_STRING = b"avbtool 1.2.0"
+AVB_FLAG_HASHTREE_DISABLED = 0x1
+AVB_FLAG_VERIFICATION_DISABLED = 0x2
+AVB_FLAGS_DISABLED = AVB_FLAG_HASHTREE_DISABLED | AVB_FLAG_VERIFICATION_DISABLED
+
+# AvbVBMetaImageHeader from libavb, big-endian, 256 bytes.
+AVB_HEADER = struct.Struct(">4s2L2QL10QQLL48s80x")
+AVB_HEADER_FIELDS = (
+    "magic", "version_major", "version_minor", "auth_size", "aux_size", "algorithm",
+    "hash_offset", "hash_size", "signature_offset", "signature_size",
+    "public_key_offset", "public_key_size", "public_key_metadata_offset", "public_key_metadata_size",
+    "descriptors_offset", "descriptors_size", "rollback_index", "flags", "rollback_index_location",
+    "release_string",
+)
+# Byte offset of the big-endian flags word in that header.
+AVB_FLAGS_OFFSET = 120
+
+VBMETA_CACHE_DIR = os.path.join(CACHE_DIR, "vbmeta")
+GENERATED_NAME = "disabled"
+
+class AvbError(Exception):
+    pass
+
+def build_vbmeta(flags=AVB_FLAGS_DISABLED, rollback_index=0):
+    """An unsigned vbmeta image with no descriptors, as avbtool make_vbmeta_image
+    --algorithm NONE would write it. With both disable flags set the bootloader
+    skips dm-verity and the verification of every chained partition.
+    """
+    return AVB_HEADER.pack(
+        AVB_MAGIC, AVB_VERSION_MAJOR, AVB_VERSION_MINOR,
+        0, 0,   # no authentication or auxiliary data blocks
+        0,      # AVB_ALGORITHM_TYPE_NONE
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+        rollback_index, flags, 0,
+        AVB_RELEASE_STRING,
+    )
+
+def parse_vbmeta_header(data):
+    if len(data) < AVB_HEADER.size:
+        raise AvbError(f"vbmeta image is only {len(data)} bytes")
+    header = dict(zip(AVB_HEADER_FIELDS, AVB_HEADER.unpack_from(data)))
+    if header["magic"] != AVB_MAGIC:
+        raise AvbError(f"bad vbmeta magic {header['magic']!r}")
+    header["release_string"] = header["release_string"].rstrip(b"\0").decode('utf-8', 'replace')
+    return header
+
+def check_vbmeta_file(path):
+    with open(path, 'rb') as f:
+        return parse_vbmeta_header(f.read(AVB_HEADER.size))
+
+class VbmetaCache:
+    """Keeps vbmeta images under ~/.cache/kanagawa/vbmeta, each next to its sha256.
+
+    An entry is re-hashed on every use and rebuilt (or re-fetched) when it no
+    longer matches, so a whole fleet is flashed from the same verified bytes.
+    """
+
+    def __init__(self, root=VBMETA_CACHE_DIR):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, f"{name}.img")
+
+    def verified(self, name):
+        """Returns the entry's path if it is intact, otherwise removes it and returns None."""
+        path = self.path(name)
+        try:
+            with open(path + ".sha256") as f:
+                expected = f.read().split()[0]
+            if file_sha256(path) == expected:
+                check_vbmeta_file(path)
+                return path
+        except (OSError, IndexError, AvbError):
+            pass
+        for stale in (path, path + ".sha256"):
+            if os.path.exists(stale):
+                os.unlink(stale)
+        return None
+
+    def store(self, name, source_path):
+        """Validates source_path as a vbmeta image and copies it into the cache."""
+        check_vbmeta_file(source_path)
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(name)
+        shutil.copyfile(source_path, path + ".tmp")
+        digest = file_sha256(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        with open(path + ".sha256", 'w') as f:
+            f.write(f"{digest}  {os.path.basename(path)}\n")
+        return path
+
+    def generated(self, flags=AVB_FLAGS_DISABLED):
+        name = GENERATED_NAME if flags == AVB_FLAGS_DISABLED else f"flags{flags}"
+        path = self.verified(name)
+        if path:
+            return path
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.path(name) + ".build"
+        with open(tmp_path, 'wb') as f:
+            f.write(build_vbmeta(flags))
+        try:
+            return self.store(name, tmp_path)
+        finally:
+            os.unlink(tmp_path)
+
+    def downloaded(self, url, name="gsi"):
+        path = self.verified(name)
+        if path:
+            return path
+        import urllib.request
+
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.path(name) + ".download"
+        try:
+            urllib.request.urlretrieve(url, tmp_path)
+            return self.store(name, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def local(self, source_path):
+        """Caches a user-supplied image under its own digest, so every device gets exactly those bytes."""
+        name = f"local-{file_sha256(source_path)[:16]}"
+        return self.verified(name) or self.store(name, source_path)
+
+_default_cache = VbmetaCache()
+
+def get_vbmeta_cache():
+    return _default_cache
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import json
+import os
+import glob
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from kanagawa_compress import CODECS, CompressedWriter
+from kanagawa_fakes import FakeDevice, FakeLab, FakePreloader
+from kanagawa_hotplug import UeventMonitor, HotplugUnavailable
+
+class Colors:
+    CYAN = '\033[96m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+
+CODEC_LEVELS = {
+    "gzip": [1, 6, 9],
+    "xz": [0, 1, 6],
+}
+FEED_CHUNK_SIZE = 1024 * 1024
+STARTUP_BUDGET_MS = 1000
+TOOL_MODULES = ["kanagawa_adb_partition_extractor", "kanagawa_force_fastboot", "kanagawa_vbmeta_disabler",
+                "kanagawa_force_shutdown", "kanagawa_inspect", "kanagawa_cli"]
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+LAB_SERIAL = "KANAGAWA0BENCH"
+LAB_PARTITION = "bench"
+DUMP_METHODS = ("stream", "staged", "chunked")
+APPEAR_MAX_DELAY = 0.2
+HANDSHAKE_GRACE = 0.5
+REGRESSION_TOLERANCE = 0.05
+
+def synthetic_partition(size, seed=0):
+    """Roughly partition-shaped data: random payload, zero padding and repetitive tables."""
+    rng = random.Random(seed)
+    chunk = FEED_CHUNK_SIZE
+    table = b"".join(f"key_{i}=value_{i * 7}\n".encode() for i in range(chunk // 24))[:chunk]
+    blocks = []
+    for i in range(size // chunk):
+        kind = i % 4
+        if kind == 0:
+            blocks.append(rng.randbytes(chunk))
+        elif kind == 1:
+            blocks.append(table)
+        else:
+            blocks.append(bytes(chunk))
+    return blocks
+
+def bench_codecs(size_mb=64):
+    blocks = synthetic_partition(size_mb * 1024 * 1024)
+    raw_size = len(blocks) * FEED_CHUNK_SIZE
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for codec, levels in CODEC_LEVELS.items():
+            for level in levels:
+                path = os.path.join(tmp, f"bench{CODECS[codec][0]}")
+                start = time.perf_counter()
+                with CompressedWriter(path, codec, level) as out:
+                    for block in blocks:
+                        out.write(block)
+                elapsed = time.perf_counter() - start
+                rows.append({
+                    "codec": codec,
+                    "level": level,
+                    "mb_per_s": raw_size / elapsed / (1024 * 1024),
+                    "ratio": raw_size / os.path.getsize(path),
+                })
+    return rows
+
+def print_codec_table(rows):
+    print(f"{Colors.BOLD}{'codec':<6} {'level':>5} {'MB/s':>9} {'ratio':>7}{Colors.RESET}")
+    for row in rows:
+        print(f"{row['codec']:<6} {row['level']:>5} {row['mb_per_s']:>9.1f} {row['ratio']:>6.1f}x")
+    print(f"\n{Colors.CYAN}[*] USB 2.0 adb dumps run at roughly 30-40 MB/s; any codec above that "
+          f"keeps the transfer link-bound.{Colors.RESET}")
+
+def latency_summary(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(samples) * 1000,
+        # Nearest rank: with few samples this is the max, never something below the median.
+        "p95_ms": samples[max(0, math.ceil(0.95 * len(samples)) - 1)] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+def bench_poll_detection(trials=30, interval=0.1):
+    """Replays the comports() poll loop against a device that appears at a random moment."""
+    import serial.tools.list_ports
+
+    samples = []
+    for _ in range(trials):
+        appeared = threading.Event()
+        appear_at = [None]
+
+        def plug_in():
+            time.sleep(random.uniform(0, interval * 2))
+            appear_at[0] = time.monotonic()
+            appeared.set()
+
+        t = threading.Thread(target=plug_in)
+        t.start()
+        while True:
+            serial.tools.list_ports.comports()
+            if appeared.is_set():
+                break
+            time.sleep(interval)
+        samples.append(time.monotonic() - appear_at[0])
+        t.join()
+    return latency_summary(samples)
+
+def bench_uevent_detection(trials=30):
+    """Times synthetic 'add' uevents (needs root) from the sysfs write to netlink delivery.
+
+    Writing 'add' to a uevent node makes udev re-run its rules for that
+    device on the host, so main() only calls this when asked to.
+    """
+    nodes = [n for n in glob.glob("/sys/class/tty/tty[0-9]*/uevent") if os.access(n, os.W_OK)]
+    if not nodes:
+        return None
+    samples = []
+    with UeventMonitor() as monitor:
+        for _ in range(trials):
+            with open(nodes[0], 'w') as f:
+                start = time.monotonic()
+                f.write("add")
+            while True:
+                event, received = monitor.receive(1.0)
+                if received is None:
+                    return None
+                if event and event.get("ACTION") == "add":
+                    break
+            samples.append(received - start)
+    return latency_summary(samples)
+
+def print_latency_table(rows):
+    print(f"{Colors.BOLD}{'detector':<22} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}{Colors.RESET}")
+    for name, row in rows:
+        if isinstance(row, str):
+            print(f"{name:<22} {row:>29}")
+        elif row is None:
+            print(f"{name:<22} {'unavailable (needs root + netlink)':>29}")
+        else:
+            print(f"{name:<22} {row['mean_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['max_ms']:>9.2f}")
+
+def time_python(code, trials):
+    """Median wall time in ms of a fresh interpreter running code."""
+    samples = []
+    for _ in range(trials):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def time_to_menu(trials):
+    """Median ms from launching kanagawa_main.py until its menu prompt is printed."""
+    samples = []
+    env = dict(os.environ, TERM=os.environ.get("TERM", "dumb"))
+    for _ in range(trials):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "kanagawa_main.py")], cwd=REPO_DIR, env=env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        seen = b""
+        while b"Enter your choice" not in seen:
+            chunk = proc.stdout.read1(4096)
+            if not chunk:
+                break
+            seen += chunk
+        samples.append((time.perf_counter() - start) * 1000)
+        proc.communicate(b"0\n")
+    return statistics.median(samples)
+
+def import_breakdown(module, top=10):
+    """The slowest imports under module according to -X importtime, as (name, self ms, cumulative ms)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_DIR,
+                          capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[0].split(":")[-1].strip().isdigit():
+            continue
+        rows.append((fields[2].rstrip(), int(fields[0].split(":")[-1]) / 1000, int(fields[1]) / 1000))
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+
+def bench_startup(trials=5, top=10):
+    return {
+        "interpreter": time_python("pass", trials),
+        "menu": time_to_menu(trials),
+        "main_import": time_python("import kanagawa_main", trials),
+        "eager_import": time_python("import " + ", ".join(TOOL_MODULES), trials),
+        "tools": [(module, time_python(f"import {module}", trials)) for module in TOOL_MODULES],
+        "breakdown": import_breakdown("kanagawa_main", top),
+    }
+
+def print_startup_report(result):
+    print(f"{Colors.BOLD}{'stage':<34} {'median ms':>10}{Colors.RESET}")
+    print(f"{'bare interpreter (python -c pass)':<34} {result['interpreter']:>10.1f}")
+    print(f"{'import kanagawa_main':<34} {result['main_import']:>10.1f}")
+    print(f"{'time to menu':<34} {result['menu']:>10.1f}")
+    print(f"{'import every tool up front':<34} {result['eager_import']:>10.1f}")
+    
+    print(f"\n{Colors.BOLD}{'tool (loaded when picked)':<34} {'median ms':>10}{Colors.RESET}")
+    for module, ms in result["tools"]:
+        print(f"{module:<34} {ms:>10.1f}")
+    
+    print(f"\n{Colors.BOLD}{'slowest imports under kanagawa_main':<34} {'self ms':>10} {'cumul. ms':>10}{Colors.RESET}")
+    for name, self_ms, cumulative_ms in result["breakdown"]:
+        print(f"{name[:34]:<34} {self_ms:>10.2f} {cumulative_ms:>10.2f}")
+    
+    if result["menu"] > STARTUP_BUDGET_MS:
+        print(f"\n{Colors.RED}[!] Time to menu is over the {STARTUP_BUDGET_MS} ms budget.{Colors.RESET}")
+    else:
+        print(f"\n{Colors.GREEN}[+] Time to menu is within the {STARTUP_BUDGET_MS} ms budget.{Colors.RESET}")
+    print(f"{Colors.CYAN}[*] The PyInstaller --onefile binary adds its own unpack time on top of these numbers.{Colors.RESET}")
+
+def quietly(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+def trigger_later(action, max_delay=APPEAR_MAX_DELAY):
+    """Runs action on a thread after a random delay; the list gets the monotonic time it fired."""
+    fired = []
+
+    def run():
+        time.sleep(random.uniform(0, max_delay))
+        fired.append(time.monotonic())
+        action()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, fired
+
+def bench_adb_detection(lab, device, trials):
+    """wait_for_adb() against the fake server, with the device plugged in at a random moment."""
+    from kanagawa_adb_client import get_tracker
+    from kanagawa_adb_partition_extractor import wait_for_adb
+
+    tracker = get_tracker()
+    samples = []
+    for _ in range(trials):
+        lab.adb.remove_device(device.serial)
+        tracker.wait_until_gone(device.serial, timeout=5)
+        thread, fired = trigger_later(lambda: lab.adb.add_device(device))
+        quietly(wait_for_adb)
+        samples.append(time.monotonic() - fired[0])
+        thread.join()
+    return latency_summary(samples)
+
+def bench_fastboot_detection(lab, trials, serial=LAB_SERIAL):
+    """wait_for_fastboot() polling until the fake fastboot-over-TCP device answers with the serial."""
+    from kanagawa_fastboot import wait_for_fastboot
+
+    samples = []
+    for _ in range(trials):
+        lab.fastboot.remove_device(serial)
+        thread, fired = trigger_later(lambda: lab.fastboot.add_device(serial))
+        if wait_for_fastboot(serial, timeout=5):
+            samples.append(time.monotonic() - fired[0])
+        thread.join()
+    lab.fastboot.remove_device(serial)
+    return latency_summary(samples)
+
+def bench_fastboot_commands(lab, trials, serial=LAB_SERIAL):
+    """Round-trip time of single fastboot commands through the in-process client, connection included."""
+    from kanagawa_avb import build_vbmeta
+    from kanagawa_fastboot import run_fastboot
+
+    image = lab.image("vbmeta", [build_vbmeta()])
+    lab.fastboot.add_device(serial)
+    commands = {"getvar": ("getvar", "product"),
+                "flash_vbmeta": ("--disable-verity", "--disable-verification", "flash", "vbmeta", image)}
+    results = {}
+    for name, args in commands.items():
+        samples = []
+        for _ in range(trials):
+            start = time.monotonic()
+            if run_fastboot(serial, *args)[0]:
+                samples.append(time.monotonic() - start)
+        results[name] = latency_summary(samples)
+    lab.fastboot.remove_device(serial)
+    return results
+
+def bench_preloader(window, jitter, trials):
+    """Port polling plus the force_fastboot handshake against a pty preloader that stays open for window seconds.
+
+    Returns (detection samples, hit rate, median ms from port appearance to READY on a hit).
+    """
+    from kanagawa_force_fastboot import poll_for_mtk_device, run_handshake
+
+    detections = []
+    acks = []
+    hits = 0
+    for _ in range(trials):
+        preloader = FakePreloader(window=window, jitter=jitter)
+        thread, _ = trigger_later(preloader.start)
+        try:
+            port = quietly(poll_for_mtk_device, finder=preloader.find_port)
+            detections.append(time.monotonic() - preloader.opened_at)
+            result = run_handshake(port, preloader.opened_at, timeout=window + HANDSHAKE_GRACE)
+            if result.success:
+                hits += 1
+                acks.append(result.offsets_ms()["ack"])
+        finally:
+            thread.join()
+            preloader.stop()
+    return detections, hits / trials, statistics.median(acks) if acks else None
+
+def bench_dump(device, size, trials):
+    """extract_single_partition() throughput per dump method, with the dump cache out of the way."""
+    from kanagawa_adb_partition_extractor import extract_single_partition
+
+    rows = {}
+    for method in DUMP_METHODS:
+        rates = []
+        ok = True
+        for _ in range(trials):
+            # A fresh directory each time, so chunked mode cannot resume from the previous trial.
+            with tempfile.TemporaryDirectory() as out:
+                start = time.perf_counter()
+                ok = quietly(extract_single_partition, LAB_PARTITION, method, device.serial, out,
+                             show_progress=False, use_cache=False) and ok
+                rates.append(size / (time.perf_counter() - start) / (1024 * 1024))
+        rows[method] = {"mib_per_s": statistics.median(rates), "ok": ok}
+    return rows
+
+def bench_devices(trials=10, size_mb=64, windows=(0.1, 0.3), jitter=0.02, dump_trials=3):
+    """Runs every device-facing measurement inside one FakeLab."""
+    size = size_mb * 1024 * 1024
+    with FakeLab() as lab:
+        device = FakeDevice(LAB_SERIAL, partitions={LAB_PARTITION: lab.image(LAB_PARTITION, synthetic_partition(size))})
+        try:
+            results = {"wait_for_adb": bench_adb_detection(lab, device, trials)}
+            results["dump"] = bench_dump(device, size, dump_trials)
+            results["wait_for_fastboot"] = bench_fastboot_detection(lab, trials)
+            results["fastboot"] = bench_fastboot_commands(lab, trials)
+            detections = []
+            results["handshake"] = {}
+            for window in windows:
+                samples, hit_rate, ack_ms = bench_preloader(window, jitter, trials)
+                detections += samples
+                results["handshake"][f"{window * 1000:.0f}ms"] = {"hit_rate": hit_rate, "ack_ms": ack_ms}
+            results["wait_for_mtk_device"] = latency_summary(detections)
+        finally:
+            device.cleanup()
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "kernel": platform.release(),
+        "python": platform.python_version(),
+        "params": {"trials": trials, "size_mb": size_mb, "windows": list(windows), "jitter": jitter,
+                   "dump_trials": dump_trials},
+        "results": results,
+    }
+
+def flatten_metrics(results, prefix=""):
+    """{"dump": {"stream": {"mib_per_s": 40}}} -> {"dump.stream.mib_per_s": 40}, numbers only."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_metrics(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def higher_is_better(metric):
+    return metric.endswith(("mib_per_s", "hit_rate"))
+
+def print_device_report(report, baseline=None):
+    current = flatten_metrics(report["results"])
+    previous = flatten_metrics(baseline["results"]) if baseline else {}
+    header = f"{'metric':<36} {'value':>10}"
+    if baseline:
+        header += f" {'baseline':>10} {'change':>8}"
+    print(f"{Colors.BOLD}{header}{Colors.RESET}")
+    
+    regressions = 0
+    for metric, value in current.items():
+        line = f"{metric:<36} {value:>10.2f}"
+        old = previous.get(metric)
+        if old is None:
+            print(line)
+            continue
+        change = (value - old) / old if old else 0.0
+        worse = -change if higher_is_better(metric) else change
+        color = Colors.RED if worse > REGRESSION_TOLERANCE else Colors.GREEN if worse < -REGRESSION_TOLERANCE else ""
+        regressions += worse > REGRESSION_TOLERANCE
+        print(f"{color}{line} {old:>10.2f} {change * 100:>+7.1f}%{Colors.RESET if color else ''}")
+    
+    missing = [name for name in ("wait_for_adb", "wait_for_fastboot", "wait_for_mtk_device") if report["results"].get(name) is None]
+    if missing:
+        print(f"\n{Colors.RED}[-] No detections recorded for: {', '.join(missing)}{Colors.RESET}")
+    failed = [method for method, row in report["results"]["dump"].items() if not row["ok"]]
+    if failed:
+        print(f"{Colors.RED}[-] Dumps failed for method(s): {', '.join(failed)}{Colors.RESET}")
+    if baseline:
+        params = " (different parameters)" if baseline.get("params") != report["params"] else ""
+        if regressions:
+            print(f"\n{Colors.RED}[!] {regressions} metric(s) worse than the baseline by more than "
+                  f"{REGRESSION_TOLERANCE * 100:.0f}%{params}.{Colors.RESET}")
+        else:
+            print(f"\n{Colors.GREEN}[+] No regressions against the baseline{params}.{Colors.RESET}")
+    print(f"{Colors.CYAN}[*] Latencies are ms from the fake device appearing to the wait returning; "
+          f"port detection uses the polling path.{Colors.RESET}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Kanagawa toolkit benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    codecs = sub.add_parser("codecs", help="Compression throughput per codec and level")
+    codecs.add_argument("--size", type=int, default=64, help="Synthetic image size in MiB")
+    hotplug = sub.add_parser("hotplug", help="Preloader port detection latency, polling vs uevents")
+    hotplug.add_argument("--trials", type=int, default=30)
+    hotplug.add_argument("--synthetic-uevents", action="store_true",
+                         help="Also time netlink delivery by writing 'add' to a virtual console's uevent node "
+                              "(needs root; udev re-runs its rules for that console)")
+    startup = sub.add_parser("startup", help="Cold-start time to the main menu, with an -X importtime breakdown")
+    startup.add_argument("--trials", type=int, default=5)
+    startup.add_argument("--top", type=int, default=10, help="Number of slow imports to list")
+    devices = sub.add_parser("devices", help="Detection latency, handshake hit rate and dump throughput against fake devices")
+    devices.add_argument("--trials", type=int, default=10)
+    devices.add_argument("--size", type=int, default=64, help="Synthetic partition size in MiB")
+    devices.add_argument("--dump-trials", type=int, default=3)
+    devices.add_argument("--window", type=float, nargs="+", default=[0.1, 0.3], help="Preloader window(s) in seconds")
+    devices.add_argument("--jitter", type=float, default=0.02, help="Longest preloader reply delay in seconds")
+    devices.add_argument("--json", help="Write the report to this file")
+    devices.add_argument("--compare", help="A previous --json report to compare against")
+    args = parser.parse_args()
+
+    if args.bench == "codecs":
+        print(f"{Colors.CYAN}[*] Compressing a {args.size} MiB synthetic partition...{Colors.RESET}\n")
+        print_codec_table(bench_codecs(args.size))
+    elif args.bench == "hotplug":
+        uevent = "skipped (--synthetic-uevents)"
+        if args.synthetic_uevents:
+            try:
+                uevent = bench_uevent_detection(args.trials)
+            except HotplugUnavailable:
+                uevent = None
+        print_latency_table([
+            ("comports() poll 100ms", bench_poll_detection(args.trials)),
+            ("netlink uevent", uevent),
+        ])
+    elif args.bench == "startup":
+        print(f"{Colors.CYAN}[*] Launching the toolkit {args.trials} time(s) per measurement...{Colors.RESET}\n")
+        print_startup_report(bench_startup(args.trials, args.top))
+    elif args.bench == "devices":
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        print(f"{Colors.CYAN}[*] Running against a fake adb server, fake fastboot and a pty preloader "
+              f"({args.trials} trial(s) each, {args.size} MiB partition)...{Colors.RESET}\n")
+        report = bench_devices(args.trials, args.size, args.window, args.jitter, args.dump_trials)
+        print_device_report(report, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"{Colors.GREEN}[+] Report written to {args.json}{Colors.RESET}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Non-interactive entry point: kanagawa_toolkit <command> [options].
+
+Every result is printed to stdout as one JSON object per line; the tools'
+own progress messages go to stderr (or nowhere with --quiet), so the output
+can be piped straight into jq or a fleet dashboard.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+from kanagawa_adb_client import AdbError, READY_STATES, get_client, get_tracker
+from kanagawa_fastboot import FASTBOOT_TIMEOUT, fastboot_devices, run_fastboot, wait_for_fastboot
+from kanagawa_scheduler import DiskBudget, Job, JobScheduler, DEFAULT_MAX_WORKERS, DEFAULT_PER_DEVICE
+
+DEVICE_WAIT = 10
+
+class ResultWriter:
+    """Writes JSON-lines records; safe to call from any worker thread."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        with self._lock:
+            if record.get("ok") is False:
+                self.failures += 1
+            self.stream.write(json.dumps(record) + "\n")
+            self.stream.flush()
+
+class StepTimer:
+    """Records how long each named step of one job took, in seconds."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.steps = {}
+
+    @contextlib.contextmanager
+    def step(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.steps[name] = round(time.monotonic() - start, 4)
+
+    def record(self, command, serial, ok, **fields):
+        record = {"command": command, "serial": serial, "ok": bool(ok)}
+        record.update(fields)
+        record["steps"] = self.steps
+        record["duration"] = round(time.monotonic() - self.started, 4)
+        return record
+
+def adb_serials(requested, wait=DEVICE_WAIT):
+    """The requested serials once they are all ready, or every ready device when none were named."""
+    tracker = get_tracker()
+    if requested:
+        tracker.wait_for(lambda table: all(table.get(s) in READY_STATES for s in requested), timeout=wait)
+        return list(requested)
+    return sorted(tracker.wait_for_ready(timeout=wait) or [])
+
+def cmd_extract(args, writer):
+    from kanagawa_adb_partition_extractor import BATCH_EXCLUDE, extract_single_partition
+    from kanagawa_lp_metadata import get_lp_metadata
+    from kanagawa_partition_index import get_partition_index
+
+    serials = adb_serials(args.serial, args.wait)
+    if not serials:
+        writer.emit({"command": "extract", "serial": None, "ok": False, "error": "no ADB device found"})
+        return
+
+    jobs = []
+    for serial in serials:
+        index = get_partition_index(serial)
+        if args.all:
+            if index is None:
+                writer.emit({"command": "extract", "serial": serial, "ok": False, "error": "could not read the partition table"})
+                continue
+            excluded = () if args.include_userdata else BATCH_EXCLUDE
+            targets = [name for name in sorted(index.entries) if name not in excluded]
+        else:
+            targets = args.partition
+        for target in targets:
+            logical = get_lp_metadata(serial) if index is not None and target not in index else None
+            if index is not None and target not in index and (logical is None or target not in logical):
+                writer.emit({"command": "extract", "serial": serial, "ok": False, "partition": target,
+                             "error": "no such partition on this device"})
+                continue
+            job = Job(serial, target)
+            job.size = logical.size(target) if logical is not None else index.size(target) if index is not None else None
+            jobs.append(job)
+    jobs.sort(key=lambda job: job.size or 0, reverse=True)
+    os.makedirs(args.output_dir, exist_ok=True)
+    budget = DiskBudget(args.output_dir)
+
+    def dump(job):
+        timer = StepTimer()
+        job.timer = timer
+        try:
+            with timer.step("dump"):
+                return extract_single_partition(job.target, method=args.method, serial=job.serial,
+                                                output_dir=os.path.join(args.output_dir, job.serial),
+                                                show_progress=False, output_format=args.format,
+                                                compression=args.compression, compression_level=args.level,
+                                                use_cache=not args.no_cache, verify=not args.no_verify,
+                                                digests=args.digest)
+        finally:
+            if job.size is not None:
+                budget.release(job.size)
+
+    def report(job, finished):
+        timer = getattr(job, "timer", None) or StepTimer()
+        if job.skipped:
+            error = "not enough free disk space"
+        elif job.error:
+            error = str(job.error)
+        else:
+            error = None if job.ok else "extraction failed"
+        writer.emit(timer.record("extract", job.serial, job.ok, partition=job.target, size=job.size,
+                                 skipped=job.skipped, error=error))
+
+    JobScheduler(args.workers, args.per_device).run(jobs, dump, on_complete=report, admit=budget.admit)
+
+def cmd_inspect(args, writer):
+    from kanagawa_inspect import describe, inspect_image
+
+    for path in args.images:
+        try:
+            info = inspect_image(path)
+        except OSError as e:
+            writer.emit({"command": "inspect", "path": path, "ok": False, "error": str(e)})
+            continue
+        writer.emit(dict(info, command="inspect", ok="error" not in info, summary=describe(info)))
+
+def cmd_history(args, writer):
+    from kanagawa_history import HistoryError, PartitionHistory, list_histories
+    from kanagawa_integrity import write_digest_manifest
+
+    histories = [PartitionHistory(args.serial, args.partition)] if args.partition else list_histories(args.serial)
+    if not histories:
+        writer.emit({"command": "history", "serial": args.serial, "ok": False, "error": "no recorded history"})
+        return
+    if args.rebuild is None:
+        for history in histories:
+            for record in history.versions:
+                writer.emit({"command": "history", "serial": args.serial, "ok": True, "partition": history.partition,
+                             "version": record["version"], "created": record["created"], "kind": record["kind"],
+                             "size": record["size"], "changed_blocks": len(record["blocks"] or record["hashes"]),
+                             "stored": record["stored"]})
+        return
+
+    history = histories[0]
+    try:
+        version = None if args.rebuild == "latest" else int(args.rebuild)
+        record = history.version(version)
+        output = args.output or f"{history.partition}_v{record['version']}.img"
+        record, hasher = history.rebuild(record["version"], output, args.digest)
+    except (HistoryError, OSError, ValueError) as e:
+        writer.emit({"command": "history", "serial": args.serial, "ok": False, "partition": history.partition,
+                     "error": str(e)})
+        return
+    write_digest_manifest(output, digests=hasher.hexdigests(), partition=history.partition, serial=args.serial,
+                          version=record["version"], length=hasher.length, method="history")
+    writer.emit({"command": "history", "serial": args.serial, "ok": True, "partition": history.partition,
+                 "version": record["version"], "path": output, "size": hasher.length, "sha256": hasher.hexdigest()})
+
+def fetch_vbmeta(args):
+    from kanagawa_avb import get_vbmeta_cache
+    cache = get_vbmeta_cache()
+    if args.image:
+        return cache.local(args.image)
+    if args.download:
+        from kanagawa_vbmeta_disabler import VBMETA_URL
+        return cache.downloaded(VBMETA_URL)
+    return cache.generated()
+
+def cmd_vbmeta(args, writer):
+    from kanagawa_avb import AvbError
+    from kanagawa_vbmeta_disabler import flash_sequence
+    try:
+        image = fetch_vbmeta(args)
+    except (OSError, AvbError) as e:
+        writer.emit({"command": "vbmeta", "serial": None, "ok": False, "error": f"no usable vbmeta image: {e}"})
+        return
+
+    tracker = get_tracker()
+    tracker.wait_for(lambda states: tracker.updated_at, timeout=1)
+    serials = list(args.serial) or sorted(set(fastboot_devices()) | set(tracker.ready_serials(("device",))))
+
+    def flash(serial):
+        timer = StepTimer()
+        flashed = []
+        if tracker.snapshot().get(serial) == "device":
+            with timer.step("reboot_bootloader"):
+                if not get_client().reboot("bootloader", serial):
+                    return timer.record("vbmeta", serial, False, error="adb reboot bootloader was refused")
+                tracker.wait_until_gone(serial, timeout=3)
+        with timer.step("wait_fastboot"):
+            found = wait_for_fastboot(serial, args.timeout)
+        if not found:
+            return timer.record("vbmeta", serial, False, error="device never showed up in fastboot")
+        report = flash_sequence(serial, args.partition, image)
+        for partition, ok, seconds, output in report["partitions"]:
+            timer.steps[f"flash_{partition}"] = round(seconds, 4)
+            if not ok:
+                error = output.splitlines()[-1] if output else f"flashing {partition} failed"
+                return timer.record("vbmeta", serial, False, flashed=flashed, error=error)
+            flashed.append(partition)
+        if args.reboot:
+            with timer.step("reboot"):
+                run_fastboot(serial, "reboot")
+        return timer.record("vbmeta", serial, True, flashed=flashed)
+
+    run_per_device(serials, flash, writer, "vbmeta")
+
+def cmd_shutdown(args, writer):
+    tracker = get_tracker()
+    tracker.wait_for(lambda states: tracker.updated_at, timeout=1)
+    serials = list(args.serial) or sorted(set(tracker.ready_serials()) | set(fastboot_devices()))
+
+    def power_off(serial):
+        timer = StepTimer()
+        deadline = time.monotonic() + args.timeout
+        transport = None
+        with timer.step("detect"):
+            while transport is None and time.monotonic() < deadline:
+                if tracker.snapshot().get(serial) in READY_STATES:
+                    transport = "adb"
+                elif serial in fastboot_devices():
+                    transport = "fastboot"
+                else:
+                    tracker.wait_for(lambda table: table.get(serial) in READY_STATES, timeout=0.1)
+        if transport is None:
+            return timer.record("shutdown", serial, False, error="device not found on ADB or fastboot")
+        with timer.step("poweroff"):
+            if transport == "adb":
+                try:
+                    get_client().shell("reboot -p", serial)
+                    ok, error = True, None
+                except (AdbError, OSError) as e:
+                    ok, error = False, str(e)
+            else:
+                ok, output = run_fastboot(serial, "oem", "poweroff")
+                error = None if ok else output
+        return timer.record("shutdown", serial, ok, transport=transport, error=error)
+
+    run_per_device(serials, power_off, writer, "shutdown")
+
+def cmd_force_fastboot(args, writer):
+    import kanagawa_force_fastboot
+    from kanagawa_force_fastboot import PYSERIAL_MISSING, TrayCatcher, catch_tray, describe_result
+
+    if kanagawa_force_fastboot.serial is None:
+        writer.emit({"command": "force-fastboot", "serial": None, "ok": False, "error": PYSERIAL_MISSING})
+        return
+
+    def report(usb_path, port_event, result):
+        offsets = {phase: round(ms / 1000, 4) for phase, ms in result.offsets_ms().items()}
+        writer.emit({"command": "force-fastboot", "serial": usb_path, "ok": result.success,
+                     "port": port_event.device, "writes": result.writes, "steps": offsets,
+                     "error": None if result.success else describe_result(result)})
+
+    catcher = TrayCatcher(timeout=args.handshake_timeout, count=args.count, on_result=report)
+    catch_tray(catcher, timeout=args.timeout)
+    catcher.join()
+    if len(catcher.switched) < args.count:
+        writer.emit({"command": "force-fastboot", "serial": None, "ok": False,
+                     "error": f"only {len(catcher.switched)} of {args.count} device(s) switched to fastboot"})
+
+def run_per_device(serials, func, writer, command):
+    """Runs func(serial) for every serial at once and emits each returned record."""
+    if not serials:
+        writer.emit({"command": command, "serial": None, "ok": False, "error": "no devices"})
+        return
+
+    def work(job):
+        return func(job.serial)
+
+    def report(job, finished):
+        writer.emit(job.result or {"command": command, "serial": job.serial, "ok": False, "error": str(job.error)})
+
+    JobScheduler(len(serials), 1).run([Job(serial, command) for serial in serials], work, on_complete=report)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="kanagawa_toolkit", description="Headless Kanagawa toolkit runner (JSON-lines output).")
+    parser.add_argument("--quiet", action="store_true", help="drop tool progress messages instead of sending them to stderr")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("extract", help="dump partitions from rooted ADB devices")
+    p.add_argument("-s", "--serial", action="append", default=[], help="ADB serial (repeatable, default: every ready device)")
+    p.add_argument("-p", "--partition", action="append", default=[], help="by-name partition (repeatable)")
+    p.add_argument("--all", action="store_true", help="dump every partition (userdata only with --include-userdata)")
+    p.add_argument("--include-userdata", action="store_true")
+    p.add_argument("--method", choices=("stream", "staged", "chunked", "incremental"), default="stream",
+                   help="incremental pulls only blocks changed since the last recorded version (see history)")
+    p.add_argument("--format", choices=("raw", "sparse", "simg"), default="raw")
+    p.add_argument("--compression", choices=("gzip", "xz"))
+    p.add_argument("--level", type=int)
+    p.add_argument("--no-cache", action="store_true", help="always pull, even if the dump cache has the image")
+    p.add_argument("--no-verify", action="store_true", help="skip the on-device sha256 comparison")
+    p.add_argument("--digest", action="append", default=[], choices=("md5", "sha1", "sha256", "sha512", "blake2b"),
+                   help="extra digest for the .digests.json manifest (repeatable, sha256 is always computed)")
+    p.add_argument("-o", "--output-dir", default=".")
+    p.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    p.add_argument("--per-device", type=int, default=DEFAULT_PER_DEVICE)
+    p.add_argument("--wait", type=float, default=DEVICE_WAIT, help="seconds to wait for devices to come up")
+
+    p = sub.add_parser("vbmeta", help="flash a verity-disabled vbmeta on every device")
+    p.add_argument("-s", "--serial", action="append", default=[], help="serial (repeatable, default: every ADB and fastboot device)")
+    p.add_argument("--image", help="vbmeta image to flash (default: an empty, verity-disabled vbmeta built locally)")
+    p.add_argument("--download", action="store_true", help="flash Google's empty GSI vbmeta instead")
+    p.add_argument("-p", "--partition", action="append", help="partition to flash (repeatable, default: vbmeta)")
+    p.add_argument("--reboot", action="store_true")
+    p.add_argument("--timeout", type=float, default=FASTBOOT_TIMEOUT)
+
+    p = sub.add_parser("shutdown", help="power devices off over ADB or fastboot")
+    p.add_argument("-s", "--serial", action="append", default=[], help="serial (repeatable, default: every device)")
+    p.add_argument("--timeout", type=float, default=DEVICE_WAIT)
+
+    p = sub.add_parser("force-fastboot", help="catch MTK preloader ports and send them into fastboot")
+    p.add_argument("-n", "--count", type=int, default=1, help="number of devices to catch")
+    p.add_argument("--timeout", type=float, default=120, help="seconds to wait for the ports")
+    p.add_argument("--handshake-timeout", type=float, default=5.0)
+
+    p = sub.add_parser("history", help="list or rebuild versions recorded by extract --method incremental")
+    p.add_argument("serial")
+    p.add_argument("partition", nargs="?", help="default: list every partition with a history")
+    p.add_argument("--rebuild", metavar="VERSION", help="write VERSION (a number or 'latest') out as a full image")
+    p.add_argument("-o", "--output", help="rebuilt image path (default: <partition>_v<N>.img)")
+    p.add_argument("--digest", action="append", default=[], choices=("md5", "sha1", "sha256", "sha512", "blake2b"),
+                   help="extra digest for the rebuilt image's .digests.json (repeatable)")
+
+    p = sub.add_parser("inspect", help="identify dumped boot/vendor_boot/vbmeta/super images from their headers")
+    p.add_argument("images", nargs="+")
+    return parser
+
+COMMANDS = {
+    "extract": cmd_extract,
+    "vbmeta": cmd_vbmeta,
+    "shutdown": cmd_shutdown,
+    "force-fastboot": cmd_force_fastboot,
+    "inspect": cmd_inspect,
+    "history": cmd_history,
+}
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "extract" and not (args.all or args.partition):
+        build_parser().error("extract needs --partition or --all")
+    if args.command == "history" and args.rebuild is not None and not args.partition:
+        build_parser().error("history --rebuild needs a partition")
+    if args.command == "vbmeta" and not args.partition:
+        args.partition = ["vbmeta"]
+
+    writer = ResultWriter(sys.stdout)
+    chatter = open(os.devnull, 'w') if args.quiet else sys.stderr
+    try:
+        with contextlib.redirect_stdout(chatter):
+            COMMANDS[args.command](args, writer)
+    except KeyboardInterrupt:
+        writer.emit({"command": args.command, "serial": None, "ok": False, "error": "interrupted"})
+    finally:
+        if args.quiet:
+            chatter.close()
+    return 1 if writer.failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import gzip
+import lzma
+import queue
+import threading
+
+CODECS = {
+    "gzip": (".gz", 1),
+    "xz": (".xz", 0),
+}
+QUEUE_DEPTH = 8
+ZERO_FEED_SIZE = 1024 * 1024
+
+def compressed_path(path, codec):
+    return path + CODECS[codec][0]
+
+def open_codec(path, codec, level):
+    if codec == "gzip":
+        return gzip.open(path, 'wb', compresslevel=level)
+    if codec == "xz":
+        return lzma.open(path, 'wb', preset=level)
+    raise ValueError(f"Unknown codec: {codec}")
+
+class CompressedWriter:
+    """Compresses on a background thread fed through a bounded queue.
+
+    write() only blocks when the compressor has fallen QUEUE_DEPTH chunks
+    behind, so the USB read keeps going while the CPU is busy compressing.
+    zlib and lzma release the GIL, so a thread is enough to overlap the two.
+    """
+
+    def __init__(self, path, codec="gzip", level=None, depth=QUEUE_DEPTH):
+        self.path = path
+        self.codec = codec
+        self.level = CODECS[codec][1] if level is None else level
+        self.position = 0
+        self.skipped = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=depth)
+        self._out = open_codec(path, codec, self.level)
+        self._thread = threading.Thread(target=self._compress_loop, daemon=True)
+        self._thread.start()
+
+    def _compress_loop(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self.error is None:
+                try:
+                    self._out.write(data)
+                except Exception as e:
+                    self.error = e
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(data)
+        self.position += len(data)
+        return len(data)
+
+    def skip(self, length):
+        """Zero runs still have to be in the compressed stream, but cost almost nothing there."""
+        zeros = bytes(min(length, ZERO_FEED_SIZE))
+        remaining = length
+        while remaining:
+            self.write(zeros[:remaining])
+            remaining -= min(remaining, len(zeros))
+        return length
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._out.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+CACHE_DIR = os.environ.get("KANAGAWA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kanagawa"))
+FICLONE = 0x40049409
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def reflink(src, dest):
+    """Copy-on-write clone (btrfs, XFS, bcachefs). Raises OSError where unsupported."""
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dest)
+            raise
+
+class DumpCache:
+    """Content-addressed store of partition images, keyed by sha256.
+
+    Objects live under objects/<aa>/<rest> and are read-only; index.json
+    remembers which digest each (serial, partition) had on its last dump. The
+    same image pulled from several devices or visits is stored only once.
+    Dumps never share an inode with an object, so they stay writable.
+    """
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def has(self, digest):
+        return bool(digest) and os.path.exists(self.object_path(digest))
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def record(self, serial, partition, digest, size):
+        with self._lock:
+            index = self._load_index()
+            index.setdefault(serial, {})[partition] = {"sha256": digest, "size": size, "updated": int(time.time())}
+            self._save_index(index)
+
+    def lookup(self, serial, partition):
+        return self._load_index().get(serial, {}).get(partition)
+
+    def materialize(self, digest, dest):
+        """Places the cached object at dest by reflink, else plain copy. Returns the method used."""
+        src = self.object_path(digest)
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        try:
+            reflink(src, dest)
+            return "reflink"
+        except OSError:
+            shutil.copyfile(src, dest)
+            return "copy"
+
+    def evict(self, digest):
+        try:
+            os.unlink(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def ingest(self, path, serial, partition, digest=None):
+        """Adds a finished dump to the store and records it in the index; returns the digest."""
+        digest = digest or file_sha256(path)
+        obj = self.object_path(digest)
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            # Never hardlink the dump itself: the user's file must stay writable and edits to it must not
+            # reach the store. A unique temp name keeps two devices storing the same image from colliding.
+            fd, tmp_path = tempfile.mkstemp(prefix=".ingest-", dir=os.path.dirname(obj))
+            os.close(fd)
+            try:
+                try:
+                    reflink(path, tmp_path)
+                except OSError:
+                    shutil.copyfile(path, tmp_path)
+                os.chmod(tmp_path, 0o444)
+                # Another dump may have stored the same content meanwhile; its copy is just as good.
+                if not os.path.exists(obj):
+                    os.replace(tmp_path, obj)
+            finally:
+                if os.path.lexists(tmp_path):
+                    os.unlink(tmp_path)
+        self.record(serial, partition, digest, os.path.getsize(obj))
+        return digest
+
+_default_cache = DumpCache()
+
+def get_cache():
+    return _default_cache
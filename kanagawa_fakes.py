@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""Stand-ins for real hardware, so the tools can be exercised on a plain Linux box."""
+import collections
+import os
+import random
+import re
+import select
+import shlex
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import tty
+
+class FakeDevice:
+    def __init__(self, serial, state="device", partitions=None, props=None, usb="1-1"):
+        self.serial = serial
+        self.state = state
+        self.usb = usb
+        self.partitions = dict(partitions or {})
+        self.props = dict(props or {})
+        self.sdcard = tempfile.mkdtemp(prefix=f"fake_sdcard_{serial}_")
+        self.by_name = tempfile.mkdtemp(prefix=f"fake_by_name_{serial}_")
+        for name, path in self.partitions.items():
+            os.symlink(os.path.abspath(path), os.path.join(self.by_name, name))
+        self.commands = []
+
+    def translate(self, command):
+        """Maps device paths onto the backing files and unwraps su -c."""
+        tokens = shlex.split(command)
+        if len(tokens) == 3 and tokens[:2] == ["su", "-c"]:
+            command = tokens[2]
+        command = command.replace("/dev/block/by-name", self.by_name)
+        command = command.replace("/sdcard", self.sdcard)
+        command = re.sub(r"blockdev --getsize64 (\S+)", r"stat -L -c %s \1", command)
+        if "getprop" in command:
+            cases = "".join(f"{shlex.quote(k)}) echo {shlex.quote(v)};; " for k, v in self.props.items())
+            command = f"getprop() {{ case \"$1\" in {cases}esac; }}; {command}"
+        return command
+
+    def cleanup(self):
+        for directory in (self.sdcard, self.by_name):
+            shutil.rmtree(directory, ignore_errors=True)
+
+class FakeAdbServer:
+    """A minimal adb server on localhost that serves FakeDevice objects.
+
+    Supports host:version/devices/devices-l/kill/transport, and the shell:, exec:,
+    reboot: and sync: (STAT/RECV/QUIT) services. Shell commands run in a
+    local sh with /dev/block/by-name paths pointing at the backing images.
+    """
+
+    def __init__(self, devices=(), port=0):
+        self.devices = {d.serial: d for d in devices}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._generation = 0
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server._handle(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _notify(self):
+        self._generation += 1
+        self._changed.notify_all()
+
+    def add_device(self, device):
+        with self._lock:
+            self.devices[device.serial] = device
+            self._notify()
+
+    def remove_device(self, serial):
+        with self._lock:
+            self.devices.pop(serial, None)
+            self._notify()
+
+    def set_state(self, serial, state):
+        with self._lock:
+            self.devices[serial].state = state
+            self._notify()
+
+    def _device_list_locked(self):
+        return "".join(f"{d.serial}\t{d.state}\n" for d in self.devices.values())
+
+    def device_list(self):
+        with self._lock:
+            return self._device_list_locked()
+
+    def _track_devices(self, sock):
+        self._okay(sock)
+        seen = None
+        while True:
+            with self._lock:
+                self._changed.wait_for(lambda: self._generation != seen, timeout=0.5)
+                if self._generation == seen:
+                    continue
+                seen = self._generation
+                data = self._device_list_locked().encode('utf-8')
+            sock.sendall(b"%04x" % len(data) + data)
+
+    @staticmethod
+    def _read_request(sock):
+        header = FakeAdbServer._recv_exact(sock, 4)
+        return FakeAdbServer._recv_exact(sock, int(header, 16)).decode('utf-8')
+
+    @staticmethod
+    def _recv_exact(sock, length):
+        data = b""
+        while len(data) < length:
+            chunk = sock.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("client went away")
+            data += chunk
+        return data
+
+    @staticmethod
+    def _okay(sock, payload=None):
+        sock.sendall(b"OKAY")
+        if payload is not None:
+            data = payload.encode('utf-8')
+            sock.sendall(b"%04x" % len(data) + data)
+
+    @staticmethod
+    def _fail(sock, message):
+        data = message.encode('utf-8')
+        sock.sendall(b"FAIL" + b"%04x" % len(data) + data)
+
+    def _handle(self, sock):
+        try:
+            request = self._read_request(sock)
+            self.requests.append(request)
+            if request == "host:version":
+                self._okay(sock, "0029")
+            elif request == "host:devices":
+                self._okay(sock, self.device_list())
+            elif request == "host:devices-l":
+                with self._lock:
+                    listing = "".join(f"{d.serial:<22} {d.state} usb:{d.usb} product:fake model:Fake device:fake\n"
+                                      for d in self.devices.values())
+                self._okay(sock, listing)
+            elif request == "host:track-devices":
+                self._track_devices(sock)
+            elif request == "host:kill":
+                self._okay(sock)
+            elif request.startswith("host:transport"):
+                self._transport(sock, request)
+            else:
+                self._fail(sock, f"unknown host service '{request}'")
+        except (ConnectionError, OSError):
+            pass
+
+    def _transport(self, sock, request):
+        with self._lock:
+            if request == "host:transport-any":
+                ready = [d for d in self.devices.values() if d.state == "device"]
+                device = ready[0] if len(ready) == 1 else None
+                error = "more than one device" if ready else "no devices/emulators found"
+            else:
+                device = self.devices.get(request.split(":", 2)[2])
+                error = "device not found"
+        if device is None or device.state != "device":
+            return self._fail(sock, error if device is None else f"device {device.state}")
+        self._okay(sock)
+
+        service = self._read_request(sock)
+        self.requests.append(service)
+        if service.startswith(("shell:", "exec:")):
+            self._okay(sock)
+            command = service.split(":", 1)[1]
+            device.commands.append(command)
+            proc = subprocess.Popen(["sh", "-c", device.translate(command)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            for chunk in iter(lambda: proc.stdout.read(64 * 1024), b""):
+                sock.sendall(chunk)
+            proc.wait()
+        elif service.startswith("reboot:"):
+            self._okay(sock)
+            device.commands.append(service)
+        elif service == "sync:":
+            self._okay(sock)
+            self._sync(sock, device)
+        else:
+            self._fail(sock, f"unknown service '{service}'")
+
+    def _sync(self, sock, device):
+        while True:
+            header = self._recv_exact(sock, 8)
+            ident, length = header[:4], struct.unpack("<I", header[4:])[0]
+            if ident == b"QUIT":
+                return
+            path = device.translate(self._recv_exact(sock, length).decode('utf-8'))
+            if ident == b"STAT":
+                try:
+                    st = os.stat(path)
+                    sock.sendall(b"STAT" + struct.pack("<III", st.st_mode, st.st_size & 0xFFFFFFFF, int(st.st_mtime)))
+                except OSError:
+                    sock.sendall(b"STAT" + struct.pack("<III", 0, 0, 0))
+            elif ident == b"RECV":
+                try:
+                    with open(path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(64 * 1024), b""):
+                            sock.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+                    sock.sendall(b"DONE" + struct.pack("<I", 0))
+                except OSError as e:
+                    message = str(e).encode('utf-8')
+                    sock.sendall(b"FAIL" + struct.pack("<I", len(message)) + message)
+                    return
+            else:
+                return
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def build_super_image(path, partitions, slot_count=2, metadata_max_size=65536, split=True):
+    """Writes a dynamic-partition super image: liblp geometry, metadata and data.
+
+    partitions maps a logical name to its contents (bytes, or None for an empty
+    partition). With split, each non-empty partition gets two extents laid out
+    interleaved with the others, so readers cannot assume one contiguous run.
+    Every metadata slot, primary and backup, gets the same tables.
+    """
+    import hashlib
+    from kanagawa_lp_metadata import (LP_BLOCK_DEVICE, LP_EXTENT, LP_GEOMETRY, LP_GROUP, LP_HEADER, LP_METADATA_GEOMETRY_MAGIC,
+                                      LP_METADATA_GEOMETRY_SIZE, LP_METADATA_HEADER_MAGIC, LP_METADATA_MAJOR_VERSION,
+                                      LP_PARTITION, LP_PARTITION_RESERVED_BYTES, LP_SECTOR_SIZE, LP_TARGET_TYPE_LINEAR,
+                                      metadata_offset)
+
+    align = 1024 * 1024
+    geometry = {"metadata_max_size": metadata_max_size, "metadata_slot_count": slot_count}
+    cursor = metadata_offset(geometry, slot_count, backup=True)
+    cursor = data_start = (cursor + align - 1) // align * align
+    pieces = [[] for _ in partitions]
+    for half in ((0, 2), (1, 2)) if split else ((0, 1),):
+        for i, data in enumerate(partitions.values()):
+            if not data:
+                continue
+            sectors = len(data) // LP_SECTOR_SIZE
+            start = sectors * half[0] // half[1] * LP_SECTOR_SIZE
+            end = sectors * (half[0] + 1) // half[1] * LP_SECTOR_SIZE
+            if end > start:
+                pieces[i].append((cursor, data[start:end]))
+                cursor = (cursor + end - start + align - 1) // align * align
+
+    extents = b""
+    entries = b""
+    extent_index = 0
+    for (name, data), runs in zip(partitions.items(), pieces):
+        if data and len(data) % LP_SECTOR_SIZE:
+            raise ValueError(f"{name} is not a whole number of sectors")
+        for offset, chunk in runs:
+            extents += LP_EXTENT.pack(len(chunk) // LP_SECTOR_SIZE, LP_TARGET_TYPE_LINEAR, offset // LP_SECTOR_SIZE, 0)
+        entries += LP_PARTITION.pack(name.encode(), 0x1, extent_index, len(runs), 1)
+        extent_index += len(runs)
+    groups = LP_GROUP.pack(b"default", 0, 0) + LP_GROUP.pack(b"main", 0, 0)
+    devices = LP_BLOCK_DEVICE.pack(data_start // LP_SECTOR_SIZE, 0, 0, cursor, b"super", 0)
+    tables = entries + extents + groups + devices
+    descriptors = (0, len(partitions), LP_PARTITION.size,
+                   len(entries), extent_index, LP_EXTENT.size,
+                   len(entries) + len(extents), 2, LP_GROUP.size,
+                   len(entries) + len(extents) + len(groups), 1, LP_BLOCK_DEVICE.size)
+    header = LP_HEADER.pack(LP_METADATA_HEADER_MAGIC, LP_METADATA_MAJOR_VERSION, 0, LP_HEADER.size, bytes(32),
+                            len(tables), hashlib.sha256(tables).digest(), *descriptors)
+    header = header[:12] + hashlib.sha256(header).digest() + header[44:]
+    metadata = header + tables
+    if len(metadata) > metadata_max_size:
+        raise ValueError("too many partitions for metadata_max_size")
+
+    geometry_block = LP_GEOMETRY.pack(LP_METADATA_GEOMETRY_MAGIC, LP_GEOMETRY.size, bytes(32), metadata_max_size, slot_count, 4096)
+    geometry_block = geometry_block[:8] + hashlib.sha256(geometry_block).digest() + geometry_block[40:]
+    with open(path, 'wb') as f:
+        f.truncate(cursor)
+        for offset in (LP_PARTITION_RESERVED_BYTES, LP_PARTITION_RESERVED_BYTES + LP_METADATA_GEOMETRY_SIZE):
+            f.seek(offset)
+            f.write(geometry_block)
+        for slot in range(slot_count):
+            for backup in (False, True):
+                f.seek(metadata_offset(geometry, slot, backup))
+                f.write(metadata)
+        for runs in pieces:
+            for offset, chunk in runs:
+                f.seek(offset)
+                f.write(chunk)
+    return path
+
+FAKE_ADB_SCRIPT = """#!/bin/sh
+case "$1" in
+    version|--version) echo "Android Debug Bridge version 1.0.41 (fake)" ;;
+    devices) echo "List of devices attached" ;;
+esac
+exit 0
+"""
+
+class FakeFastboot:
+    """fastboot-over-TCP stand-ins, one listening socket per device, published through KANAGAWA_FASTBOOT_TCP.
+
+    Each device answers getvar (serialno, product, max-download-size), download,
+    flash, oem and reboot. Flashes take flash_delay seconds and fail for the
+    serial:partition pairs given to fail(); the bytes each flash received are
+    kept in flashed. Every command is appended to calls() as "serial command".
+    """
+
+    def __init__(self, flash_delay=0.0, max_download_size=256 * 1024 * 1024):
+        self.flash_delay = flash_delay
+        self.max_download_size = max_download_size
+        self.flashed = {}
+        self._servers = {}
+        self._failures = set()
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def _publish(self):
+        from kanagawa_fastboot import FASTBOOT_TCP_ENV
+        os.environ[FASTBOOT_TCP_ENV] = ",".join(f"127.0.0.1:{server.server_address[1]}" for server in self._servers.values())
+
+    def add_device(self, serial):
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    fake._session(serial, self.request)
+                except (ConnectionError, OSError):
+                    pass
+
+        with self._lock:
+            if serial in self._servers:
+                return
+            server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.02}, daemon=True).start()
+            self._servers[serial] = server
+            self._publish()
+
+    def remove_device(self, serial):
+        with self._lock:
+            server = self._servers.pop(serial, None)
+            self._publish()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def stop(self):
+        for serial in list(self._servers):
+            self.remove_device(serial)
+
+    def fail(self, serial, partition):
+        with self._lock:
+            self._failures.add(f"{serial}:{partition}")
+
+    def calls(self):
+        with self._lock:
+            return list(self._calls)
+
+    @staticmethod
+    def _read_message(sock):
+        length = struct.unpack(">Q", FakeAdbServer._recv_exact(sock, 8))[0]
+        return FakeAdbServer._recv_exact(sock, length)
+
+    @staticmethod
+    def _reply(sock, kind, payload=""):
+        data = kind + payload.encode('utf-8')
+        sock.sendall(struct.pack(">Q", len(data)) + data)
+
+    def _session(self, serial, sock):
+        # INFO and OKAY go out back to back; without NODELAY the second waits on a delayed ACK.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if FakeAdbServer._recv_exact(sock, 4) != b"FB01":
+            return
+        sock.sendall(b"FB01")
+        variables = {"serialno": serial, "product": "fake", "max-download-size": hex(self.max_download_size)}
+        downloaded = b""
+        while True:
+            command = self._read_message(sock).decode('utf-8')
+            with self._lock:
+                self._calls.append(f"{serial} {command}")
+            verb, _, argument = command.partition(":")
+            if verb == "getvar":
+                if argument in variables:
+                    self._reply(sock, b"OKAY", variables[argument])
+                else:
+                    self._reply(sock, b"FAIL", "GetVar Variable Not found")
+            elif verb == "download":
+                size = int(argument, 16)
+                if size > self.max_download_size:
+                    self._reply(sock, b"FAIL", "data too large")
+                    continue
+                self._reply(sock, b"DATA", f"{size:08x}")
+                received = bytearray()
+                while len(received) < size:
+                    received += self._read_message(sock)
+                downloaded = bytes(received)
+                self._reply(sock, b"OKAY")
+            elif verb == "flash":
+                time.sleep(self.flash_delay)
+                if f"{serial}:{argument}" in self._failures:
+                    self._reply(sock, b"FAIL", "partition not found")
+                    continue
+                with self._lock:
+                    self.flashed[(serial, argument)] = downloaded
+                self._reply(sock, b"INFO", f"Writing '{argument}'")
+                self._reply(sock, b"OKAY")
+            elif command.startswith(("oem ", "reboot")):
+                self._reply(sock, b"OKAY")
+            else:
+                self._reply(sock, b"FAIL", f"unknown command {command}")
+
+class FakeLab:
+    """A fake adb server, fake fastboot devices, a fake adb binary and a scratch cache, wired in through the environment.
+
+    Enter it before importing any toolkit module: ANDROID_ADB_SERVER_PORT and
+    KANAGAWA_CACHE_DIR are read at import time, KANAGAWA_FASTBOOT_TCP on every
+    fastboot scan and PATH whenever a tool spawns adb.
+    """
+
+    ENV = ("PATH", "ANDROID_ADB_SERVER_PORT", "KANAGAWA_CACHE_DIR", "KANAGAWA_FASTBOOT_TCP")
+
+    def __init__(self, flash_delay=0.0):
+        self.root = tempfile.mkdtemp(prefix="kanagawa_lab_")
+        self.bin_dir = os.path.join(self.root, "bin")
+        os.makedirs(self.bin_dir)
+        adb_path = os.path.join(self.bin_dir, "adb")
+        with open(adb_path, 'w') as f:
+            f.write(FAKE_ADB_SCRIPT)
+        os.chmod(adb_path, 0o755)
+        self.adb = FakeAdbServer(port=free_port())
+        self.fastboot = FakeFastboot(flash_delay)
+        self._saved = {}
+
+    def image(self, name, blocks):
+        """Writes a synthetic block device image from an iterable of byte blocks."""
+        directory = os.path.join(self.root, "images")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}.img")
+        with open(path, 'wb') as f:
+            for block in blocks:
+                f.write(block)
+        return path
+
+    def __enter__(self):
+        self._saved = {key: os.environ.get(key) for key in self.ENV}
+        os.environ["PATH"] = self.bin_dir + os.pathsep + os.environ.get("PATH", "")
+        os.environ["ANDROID_ADB_SERVER_PORT"] = str(self.adb.port)
+        os.environ["KANAGAWA_CACHE_DIR"] = os.path.join(self.root, "cache")
+        self.adb.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.adb.stop()
+        self.fastboot.stop()
+        for key, value in self._saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(self.root, ignore_errors=True)
+
+FakePort = collections.namedtuple("FakePort", "device vid pid")
+
+class FakePreloader:
+    """A pty that behaves like an MTK preloader VCOM port during its short boot window.
+
+    The window opens when start() is called and lasts window seconds. A full
+    boot-mode command received inside it is answered after a random delay of up
+    to jitter seconds, with the reply split over two writes the way USB packets
+    can split it. Commands after the window closes are ignored, as the device
+    has moved on to booting.
+    """
+
+    def __init__(self, window=0.3, jitter=0.0, command=b"FASTBOOT", reply=b"READYTOOB", split=True,
+                 vid=0x0E8D, pid=0x2000):
+        self.window = window
+        self.jitter = jitter
+        self.command = command
+        self.reply = reply
+        self.split = split
+        self.vid = vid
+        self.pid = pid
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.opened_at = None
+        self.acked_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.opened_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def find_port(self, vid=0x0E8D):
+        """Stands in for find_mtk_port: the pty only shows up once the window has opened."""
+        if self.opened_at is not None and vid == self.vid:
+            return FakePort(self.port, self.vid, self.pid)
+        return None
+
+    def _run(self):
+        received = b""
+        closes_at = self.opened_at + self.window
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.01)
+            if not ready:
+                continue
+            try:
+                received += os.read(self.master, 1024)
+            except OSError:
+                return
+            if self.acked_at is None and self.command in received and time.monotonic() < closes_at:
+                time.sleep(random.uniform(0, self.jitter))
+                half = len(self.reply) // 2 if self.split else len(self.reply)
+                os.write(self.master, self.reply[:half])
+                if half < len(self.reply):
+                    time.sleep(0.002)
+                    os.write(self.master, self.reply[half:])
+                self.acked_at = time.monotonic()
+            received = received[-len(self.command):]
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""In-process fastboot client, so polling and flashing never spawn the fastboot binary.
+
+Speaks the fastboot protocol (getvar, download, flash, oem, reboot) over a
+transport: USB bulk endpoints through usbdevfs, or fastboot-over-TCP for
+network fastbootd and for local stand-ins. Devices are found through sysfs,
+plus any host:port targets listed in KANAGAWA_FASTBOOT_TCP.
+"""
+import fcntl
+import os
+import socket
+import struct
+import threading
+import time
+
+from kanagawa_avb import (AVB_FLAG_HASHTREE_DISABLED, AVB_FLAG_VERIFICATION_DISABLED, AVB_FLAGS_OFFSET, AVB_HEADER,
+                          AVB_MAGIC)
+from kanagawa_hotplug import FASTBOOT_INTERFACE, read_sysfs, scan_usb_interfaces, usb_device_dir
+from kanagawa_metrics import increment, span
+
+FASTBOOT_TIMEOUT = 60
+FASTBOOT_TCP_PORT = 5554
+FASTBOOT_TCP_ENV = "KANAGAWA_FASTBOOT_TCP"
+PROBE_TIMEOUT = 0.5
+# A TCP target that did not answer is not probed again for this long, so one dead entry
+# cannot stretch every 0.1 s poll to PROBE_TIMEOUT.
+PROBE_RETRY_INTERVAL = 1.0
+MAX_COMMAND_SIZE = 4096
+RESPONSE_SIZE = 256
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# usbfs caps a single bulk URB; bigger writes are split, as the fastboot binary does.
+USB_BULK_WRITE_SIZE = 256 * 1024
+
+def _usbdevfs_ioctl(direction, number, size):
+    return (direction << 30) | (size << 16) | (ord('U') << 8) | number
+
+USBDEVFS_BULK_STRUCT = "IIIP"
+USBDEVFS_BULK = _usbdevfs_ioctl(3, 2, struct.calcsize(USBDEVFS_BULK_STRUCT))
+USBDEVFS_CLAIMINTERFACE = _usbdevfs_ioctl(2, 15, 4)
+USBDEVFS_RELEASEINTERFACE = _usbdevfs_ioctl(2, 16, 4)
+
+class FastbootError(Exception):
+    pass
+
+class TcpTransport:
+    """fastboot-over-TCP: an FB01 handshake, then every message in either direction carries an 8-byte length."""
+
+    def __init__(self, host, port=FASTBOOT_TCP_PORT, timeout=FASTBOOT_TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self.sock.sendall(b"FB01")
+            reply = self._recv_exact(4)
+            if not reply.startswith(b"FB") or not reply[2:].isdigit() or int(reply[2:]) < 1:
+                raise FastbootError(f"{host}:{port} is not a fastboot device (handshake {reply!r})")
+        except BaseException:
+            self.sock.close()
+            raise
+
+    def _recv_exact(self, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                raise FastbootError(f"connection closed after {len(data)}/{length} bytes")
+            data += chunk
+        return bytes(data)
+
+    def write(self, data):
+        header = struct.pack(">Q", len(data))
+        if len(data) <= MAX_COMMAND_SIZE:
+            self.sock.sendall(header + data)
+        else:
+            self.sock.sendall(header)
+            self.sock.sendall(data)
+
+    def read(self):
+        length = struct.unpack(">Q", self._recv_exact(8))[0]
+        return self._recv_exact(length)
+
+    def close(self):
+        self.sock.close()
+
+class UsbTransport:
+    """The fastboot interface's bulk endpoints, driven straight through /dev/bus/usb with usbdevfs ioctls."""
+
+    def __init__(self, target, timeout=FASTBOOT_TIMEOUT):
+        self.target = target
+        self.timeout_ms = int(timeout * 1000)
+        try:
+            self.fd = os.open(target.node, os.O_RDWR)
+        except PermissionError:
+            raise FastbootError(f"no permission to open {target.node} (add a udev rule for {target.usb_path})")
+        try:
+            fcntl.ioctl(self.fd, USBDEVFS_CLAIMINTERFACE, struct.pack("I", target.interface))
+        except OSError as e:
+            os.close(self.fd)
+            raise FastbootError(f"cannot claim the fastboot interface on {target.usb_path}: {e}")
+
+    def _bulk(self, endpoint, data=b"", length=None):
+        """One USBDEVFS_BULK transfer: writes data, or reads up to length bytes. Returns (transferred, buffer)."""
+        import ctypes
+        length = len(data) if length is None else length
+        buffer = ctypes.create_string_buffer(bytes(data), max(length, 1)) if data else ctypes.create_string_buffer(max(length, 1))
+        request = bytearray(struct.pack(USBDEVFS_BULK_STRUCT, endpoint, length, self.timeout_ms, ctypes.addressof(buffer)))
+        return fcntl.ioctl(self.fd, USBDEVFS_BULK, request, True), buffer
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            piece = view[:USB_BULK_WRITE_SIZE]
+            written, _ = self._bulk(self.target.ep_out, piece)
+            if written != len(piece):
+                raise FastbootError(f"short USB write ({written}/{len(piece)} bytes)")
+            view = view[len(piece):]
+        # A transfer that ends on a packet boundary needs a zero-length packet to mark its end.
+        if data and self.target.max_packet and len(data) % self.target.max_packet == 0:
+            self._bulk(self.target.ep_out)
+
+    def read(self):
+        length, buffer = self._bulk(self.target.ep_in, length=RESPONSE_SIZE)
+        return buffer.raw[:length]
+
+    def close(self):
+        try:
+            fcntl.ioctl(self.fd, USBDEVFS_RELEASEINTERFACE, struct.pack("I", self.target.interface))
+        except OSError:
+            pass
+        os.close(self.fd)
+
+class UsbTarget:
+    def __init__(self, node, interface, ep_in, ep_out, max_packet, usb_path):
+        self.node = node
+        self.interface = interface
+        self.ep_in = ep_in
+        self.ep_out = ep_out
+        self.max_packet = max_packet
+        self.usb_path = usb_path
+
+    def open(self, timeout=FASTBOOT_TIMEOUT):
+        return UsbTransport(self, timeout)
+
+class TcpTarget:
+    def __init__(self, host, port=FASTBOOT_TCP_PORT):
+        self.host = host
+        self.port = port
+
+    def open(self, timeout=FASTBOOT_TIMEOUT):
+        return TcpTransport(self.host, self.port, timeout)
+
+def usb_target(interface_dir, usb_path, sysfs_root="/sys"):
+    """Reads the device node and bulk endpoints of one fastboot interface from sysfs."""
+    device_dir = usb_device_dir(os.path.realpath(interface_dir), sysfs_root)
+    try:
+        busnum = int(read_sysfs(os.path.join(device_dir, "busnum")))
+        devnum = int(read_sysfs(os.path.join(device_dir, "devnum")))
+        interface = int(read_sysfs(os.path.join(interface_dir, "bInterfaceNumber")), 16)
+    except (TypeError, ValueError):
+        return None
+    endpoints = {}
+    for name in sorted(os.listdir(interface_dir)):
+        ep_dir = os.path.join(interface_dir, name)
+        if not name.startswith("ep_") or read_sysfs(os.path.join(ep_dir, "type")) != "Bulk":
+            continue
+        try:
+            address = int(read_sysfs(os.path.join(ep_dir, "bEndpointAddress")), 16)
+            max_packet = int(read_sysfs(os.path.join(ep_dir, "wMaxPacketSize")), 16)
+        except (TypeError, ValueError):
+            continue
+        endpoints.setdefault("in" if address & 0x80 else "out", (address, max_packet))
+    if len(endpoints) != 2:
+        return None
+    return UsbTarget(f"/dev/bus/usb/{busnum:03d}/{devnum:03d}", interface, endpoints["in"][0], endpoints["out"][0],
+                     endpoints["out"][1], usb_path)
+
+def usb_targets(sysfs_root="/sys"):
+    targets = {}
+    for event in scan_usb_interfaces(FASTBOOT_INTERFACE, sysfs_root):
+        target = usb_target(event.device, event.usb_path, sysfs_root)
+        if target is not None:
+            targets[event.serial or event.usb_path] = target
+    return targets
+
+def parse_tcp_target(text):
+    """'tcp:host:port', 'host:port' or 'host' -> (host, port)."""
+    if text.startswith("tcp:"):
+        text = text[4:]
+    host, sep, port = text.rpartition(":")
+    if not sep or not port.isdigit():
+        return text, FASTBOOT_TCP_PORT
+    return host, int(port)
+
+def tcp_targets():
+    """Network fastboot targets from KANAGAWA_FASTBOOT_TCP (comma-separated host[:port]), read on every scan."""
+    return [parse_tcp_target(entry.strip()) for entry in os.environ.get(FASTBOOT_TCP_ENV, "").split(",") if entry.strip()]
+
+class FastbootClient:
+    """One fastboot session over an open transport; every command is timed as a metrics span."""
+
+    def __init__(self, transport, serial=None):
+        self.transport = transport
+        self.serial = serial
+        self.info = []
+        self._max_download_size = None
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _response(self):
+        while True:
+            packet = self.transport.read()
+            kind, payload = packet[:4], packet[4:].decode('utf-8', 'replace')
+            if kind in (b"INFO", b"TEXT"):
+                self.info.append(payload)
+            elif kind == b"OKAY":
+                return payload
+            elif kind == b"FAIL":
+                raise FastbootError(f"remote: '{payload}'")
+            elif kind == b"DATA":
+                return int(payload, 16)
+            else:
+                raise FastbootError(f"unexpected reply {packet[:64]!r}")
+
+    def command(self, command):
+        if len(command) > MAX_COMMAND_SIZE:
+            raise FastbootError(f"command is longer than {MAX_COMMAND_SIZE} bytes")
+        self.info = []
+        verb = command.split(":", 1)[0].split(" ", 1)[0]
+        with span("fastboot_command", tool="fastboot", serial=self.serial, command=verb):
+            self.transport.write(command.encode('utf-8'))
+            return self._response()
+
+    def getvar(self, name):
+        return self.command(f"getvar:{name}")
+
+    def max_download_size(self):
+        """The device's max-download-size, or None when it does not report one."""
+        if self._max_download_size is None:
+            try:
+                self._max_download_size = int(self.getvar("max-download-size"), 0)
+            except (FastbootError, ValueError):
+                self._max_download_size = 0
+        return self._max_download_size or None
+
+    def download(self, path, patch=None, progress=None):
+        """Streams path to the device in DOWNLOAD_CHUNK_SIZE pieces, never holding the whole image in memory.
+
+        patch is an optional (offset, bytes) overlay applied to the first chunk.
+        """
+        size = os.path.getsize(path)
+        limit = self.max_download_size()
+        if limit and size > limit:
+            raise FastbootError(f"{os.path.basename(path)} is {size} bytes, over the device's max-download-size of {limit}")
+        with span("fastboot_download", tool="fastboot", serial=self.serial, bytes=size):
+            accepted = self.command(f"download:{size:08x}")
+            if accepted != size:
+                raise FastbootError(f"device accepted {accepted} of {size} bytes")
+            sent = 0
+            with open(path, 'rb') as f:
+                while sent < size:
+                    chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, size - sent))
+                    if not chunk:
+                        raise FastbootError(f"{path} shrank while it was being sent")
+                    if patch is not None and sent == 0:
+                        offset, data = patch
+                        chunk = chunk[:offset] + data + chunk[offset + len(data):]
+                    self.transport.write(chunk)
+                    sent += len(chunk)
+                    if progress:
+                        progress(len(chunk))
+            return self._response()
+
+    def flash(self, partition, path, avb_flags=0, progress=None):
+        """Downloads and flashes path. avb_flags are OR'd into a vbmeta image on the way, like --disable-verity."""
+        patch = vbmeta_flags_patch(path, avb_flags) if avb_flags and partition.startswith("vbmeta") else None
+        self.download(path, patch, progress)
+        return self.command(f"flash:{partition}")
+
+    def oem(self, *args):
+        return self.command("oem " + " ".join(args))
+
+    def reboot(self, target=None):
+        return self.command(f"reboot-{target}" if target else "reboot")
+
+def vbmeta_flags_patch(path, flags):
+    with open(path, 'rb') as f:
+        header = f.read(AVB_HEADER.size)
+    if len(header) < AVB_HEADER.size or header[:4] != AVB_MAGIC:
+        return None
+    current = struct.unpack_from(">L", header, AVB_FLAGS_OFFSET)[0]
+    return AVB_FLAGS_OFFSET, struct.pack(">L", current | flags)
+
+_targets = {}
+_targets_lock = threading.Lock()
+_unreachable = {}
+
+def scan_fastboot(refresh=False):
+    """serial -> target for every fastboot device reachable right now.
+
+    USB devices come from sysfs without opening them. Each configured TCP
+    target is asked for its serialno, so it is listed under the same serial
+    it has on USB; one that does not answer is left out, and skipped for
+    PROBE_RETRY_INTERVAL unless refresh is set.
+    """
+    targets = usb_targets()
+    for host, port in tcp_targets():
+        now = time.monotonic()
+        with _targets_lock:
+            failed_at = _unreachable.get((host, port))
+        if not refresh and failed_at is not None and now - failed_at < PROBE_RETRY_INTERVAL:
+            continue
+        try:
+            with FastbootClient(TcpTransport(host, port, PROBE_TIMEOUT)) as client:
+                serial = client.getvar("serialno") or f"tcp:{host}:{port}"
+        except (FastbootError, OSError):
+            increment("fastboot_probe_failures")
+            with _targets_lock:
+                _unreachable[(host, port)] = now
+            continue
+        with _targets_lock:
+            _unreachable.pop((host, port), None)
+        targets[serial] = TcpTarget(host, port)
+    with _targets_lock:
+        _targets.clear()
+        _targets.update(targets)
+    return targets
+
+def fastboot_devices():
+    """Serials of every device in fastboot mode: USB first, then network targets."""
+    return list(scan_fastboot())
+
+def open_fastboot(serial=None, timeout=FASTBOOT_TIMEOUT):
+    """A connected FastbootClient for serial ('tcp:host[:port]' also works), or the only device when serial is None."""
+    if serial and serial.startswith("tcp:"):
+        return FastbootClient(TcpTarget(*parse_tcp_target(serial)).open(timeout), serial)
+    with _targets_lock:
+        targets = dict(_targets)
+    cached = serial is not None and serial in targets
+    if not cached:
+        targets = scan_fastboot(refresh=True)
+    if serial is None:
+        if len(targets) != 1:
+            raise FastbootError("no fastboot devices found" if not targets else "more than one fastboot device, pick a serial")
+        serial = next(iter(targets))
+    if serial not in targets:
+        raise FastbootError(f"fastboot device {serial} not found")
+    try:
+        return FastbootClient(targets[serial].open(timeout), serial)
+    except (FastbootError, OSError):
+        if not cached:
+            raise
+    # The device re-enumerated (new USB address or port) since the last scan.
+    targets = scan_fastboot(refresh=True)
+    if serial not in targets:
+        raise FastbootError(f"fastboot device {serial} not found")
+    return FastbootClient(targets[serial].open(timeout), serial)
+
+def run_fastboot(serial, *args, timeout=120):
+    """Runs one fastboot command line in-process and returns (ok, output), worded like the fastboot binary.
+
+    Covers what the toolkit uses: [--disable-verity] [--disable-verification]
+    flash PARTITION IMAGE, getvar NAME, oem ... and reboot [TARGET].
+    """
+    avb_flags = 0
+    words = []
+    for arg in args:
+        if arg == "--disable-verity":
+            avb_flags |= AVB_FLAG_HASHTREE_DISABLED
+        elif arg == "--disable-verification":
+            avb_flags |= AVB_FLAG_VERIFICATION_DISABLED
+        else:
+            words.append(arg)
+    verb = words[0] if words else ""
+    lines = []
+    try:
+        with open_fastboot(serial, timeout) as client:
+            start = time.monotonic()
+            if verb == "flash" and len(words) == 3:
+                client.flash(words[1], words[2], avb_flags)
+                lines.append(f"Sending '{words[1]}' ({os.path.getsize(words[2]) // 1024} KB)  OKAY")
+                lines.append(f"Writing '{words[1]}'  OKAY [{time.monotonic() - start:.3f}s]")
+            elif verb == "getvar" and len(words) == 2:
+                lines.append(f"{words[1]}: {client.getvar(words[1])}")
+            elif verb == "oem" and len(words) > 1:
+                client.oem(*words[1:])
+                lines.append("OKAY")
+            elif verb == "reboot" and len(words) <= 2:
+                client.reboot(words[1] if len(words) == 2 else None)
+                lines.append("Rebooting")
+            else:
+                raise FastbootError(f"unsupported command: {' '.join(args)}")
+            lines += [f"(bootloader) {line}" for line in client.info]
+            lines.append("Finished.")
+        return True, "\n".join(lines)
+    except (FastbootError, OSError) as e:
+        lines.append(f"FAILED ({e})")
+        return False, "\n".join(lines)
+
+def wait_for_fastboot(serial, timeout=FASTBOOT_TIMEOUT, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        increment("fastboot_polls", serial=serial)
+        if serial in fastboot_devices():
+            return True
+        time.sleep(interval)
+    return False
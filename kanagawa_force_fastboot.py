@@ -2,7 +2,18 @@
 import time
 import sys
 import itertools
-import serial.tools.list_ports
+import os
+import selectors
+import threading
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+from kanagawa_hotplug import (MTK_VID, HotplugEvent, UeventMonitor, HotplugUnavailable, scan_ttys, watch_events,
+                              watch_tty_adds)
+from kanagawa_metrics import event, increment, span
 
 class Colors:
     CYAN = '\033[96m'
@@ -12,6 +23,12 @@ class Colors:
     RESET = '\033[0m'
     BOLD = '\033[1m'
 
+BOOT_MODE_CMD = b"FASTBOOT"
+ACK_TOKEN = b"READY"
+HANDSHAKE_TIMEOUT = 5.0
+HANDSHAKE_WRITE_INTERVAL = 0.02
+PYSERIAL_MISSING = "pyserial is not installed (pip install pyserial)"
+
 def print_banner():
     banner = fr"""{Colors.CYAN}{Colors.BOLD}
   _  __                                             
@@ -24,69 +41,379 @@ def print_banner():
 {Colors.RESET}"""
     print(banner)
 
-def wait_for_mtk_device(vid=0x0E8D):
-    print(f"{Colors.YELLOW}[*] Waiting for MediaTek Preloader VCOM port to appear...{Colors.RESET}")
-    print(f"{Colors.YELLOW}[*] Tip: If the phone is bootlooping, just leave it plugged in.{Colors.RESET}")
+def find_mtk_port(vid=0x0E8D):
+    # list_ports walks sysfs and pulls in a fair amount of code; only load it when scanning.
+    import serial.tools.list_ports
+    
+    for p in serial.tools.list_ports.comports():
+        if p.vid == vid:
+            return p
+    return None
+
+def find_mtk_ports(vid=0x0E8D):
+    import serial.tools.list_ports
     
+    return [p for p in serial.tools.list_ports.comports() if p.vid == vid]
+
+def poll_tty_adds(vid=0x0E8D, timeout=None, on_idle=None, interval=0.1, stop=None, finder=find_mtk_ports):
+    """Polling stand-in for watch_tty_adds: yields a HotplugEvent whenever a matching port newly shows up."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    present = set()
+    while (stop is None or not stop.is_set()) and (deadline is None or time.monotonic() < deadline):
+        increment("port_polls")
+        ports = {p.device: p for p in finder(vid)}
+        for device in sorted(ports.keys() - present):
+            p = ports[device]
+            # pyserial's location is "bus-port.port:config.interface"; the part before ':' is the physical path.
+            location = getattr(p, "location", None) or device
+            yield HotplugEvent("preloader", device, p.vid, p.pid, location.split(":")[0], time.monotonic())
+        present = set(ports)
+        if on_idle:
+            on_idle()
+        time.sleep(interval)
+
+def poll_for_mtk_device(vid=0x0E8D, interval=0.1, finder=find_mtk_port):
     spinner = itertools.cycle(['|', '/', '-', '\\'])
     
     while True:
-        ports = serial.tools.list_ports.comports()
-        for p in ports:
-            if p.vid == vid:
-                sys.stdout.write('\r' + ' ' * 20 + '\r')
-                print(f"{Colors.GREEN}[+] Detected MTK Device at {p.device} (VID: {hex(p.vid)} PID: {hex(p.pid)}){Colors.RESET}")
-                return p.device
+        increment("port_polls")
+        p = finder(vid)
+        if p:
+            sys.stdout.write('\r' + ' ' * 20 + '\r')
+            print(f"{Colors.GREEN}[+] Detected MTK Device at {p.device} (VID: {hex(p.vid)} PID: {hex(p.pid)}){Colors.RESET}")
+            return p.device
                 
         sys.stdout.write(f'\r{Colors.CYAN}[{next(spinner)}] Scanning USB ports...{Colors.RESET}')
         sys.stdout.flush()
-        time.sleep(0.1)
+        time.sleep(interval)
 
-def force_fastboot(port_name):
-    boot_mode_cmd = b"FASTBOOT"
-    expected_ack = b"READY" + boot_mode_cmd[:-4:-1]
+def detect_mtk_port(vid=0x0E8D):
+    """Returns (device path, monotonic time the port was seen)."""
+    try:
+        monitor = UeventMonitor()
+    except HotplugUnavailable as e:
+        print(f"{Colors.YELLOW}[!] Hotplug events unavailable ({e}), falling back to polling.{Colors.RESET}")
+        return poll_for_mtk_device(vid), time.monotonic()
+    
+    spinner = itertools.cycle(['|', '/', '-', '\\'])
+    
+    def spin():
+        sys.stdout.write(f'\r{Colors.CYAN}[{next(spinner)}] Listening for USB hotplug events...{Colors.RESET}')
+        sys.stdout.flush()
+    
+    with monitor:
+        # The monitor is already bound, so a port that shows up during this scan is not lost.
+        p = find_mtk_port(vid)
+        if p:
+            print(f"{Colors.GREEN}[+] Detected MTK Device at {p.device} (VID: {hex(p.vid)} PID: {hex(p.pid)}){Colors.RESET}")
+            return p.device, time.monotonic()
+            
+        for event in watch_tty_adds(monitor, vid, on_idle=spin):
+            latency_ms = (time.monotonic() - event.detected_at) * 1000
+            sys.stdout.write('\r' + ' ' * 50 + '\r')
+            print(f"{Colors.GREEN}[+] Detected MTK Device at {event.device} (VID: {hex(event.vid)} PID: {hex(event.pid)}, "
+                  f"USB {event.usb_path}, {latency_ms:.2f} ms host processing since the uevent was received){Colors.RESET}")
+            return event.device, event.detected_at
 
-    print(f"{Colors.CYAN}[*] Opening {port_name} at 115200 baud...{Colors.RESET}")
+def detect_mtk_port_timed(vid=0x0E8D):
+    with span("wait_port", tool="force_fastboot") as fields:
+        port, appeared_at = detect_mtk_port(vid)
+        fields["port"] = port
+    return port, appeared_at
+
+def wait_for_mtk_device(vid=0x0E8D):
+    print(f"{Colors.YELLOW}[*] Waiting for MediaTek Preloader VCOM port to appear...{Colors.RESET}")
+    print(f"{Colors.YELLOW}[*] Tip: If the phone is bootlooping, just leave it plugged in.{Colors.RESET}")
+    return detect_mtk_port_timed(vid)[0]
+
+class HandshakeResult:
+    """Outcome of one handshake attempt, with monotonic timestamps for each phase."""
+
+    PHASES = ("port_appear", "open", "first_write", "first_byte", "ack")
+
+    def __init__(self, port_name, port_appear=None):
+        self.port_name = port_name
+        self.success = False
+        self.error = None
+        self.pyserial_missing = False
+        self.response = b""
+        self.writes = 0
+        self.port_appear = port_appear
+        self.open = None
+        self.first_write = None
+        self.first_byte = None
+        self.ack = None
+
+    def offsets_ms(self):
+        """Milliseconds from port appearance (or open) to every phase that was reached."""
+        origin = self.port_appear if self.port_appear is not None else self.open
+        return {phase: (getattr(self, phase) - origin) * 1000
+                for phase in self.PHASES if getattr(self, phase) is not None and origin is not None}
+
+def open_port_when_ready(port_name, deadline):
+    """Opens the port the moment the node exists and is accessible, retrying every millisecond."""
+    last_error = None
+    while time.monotonic() < deadline:
+        try:
+            return serial.Serial(port_name, 115200, timeout=0, write_timeout=0)
+        except (serial.SerialException, OSError) as e:
+            last_error = e
+            time.sleep(0.001)
+    raise serial.SerialException(f"could not open {port_name}: {last_error}")
+
+def run_handshake(port_name, port_appear=None, timeout=HANDSHAKE_TIMEOUT, interval=HANDSHAKE_WRITE_INTERVAL,
+                  boot_mode_cmd=BOOT_MODE_CMD):
+    """Floods boot_mode_cmd on a fixed cadence and watches the reply stream with selectors.
+
+    Replies are accumulated across reads, so a READY split over several USB
+    packets is still recognised. Nothing here blocks for longer than the
+    time left until the next scheduled write.
+    """
+    result = HandshakeResult(port_name, port_appear)
+    if serial is None:
+        result.pyserial_missing = True
+        result.error = PYSERIAL_MISSING
+        return result
+    deadline = time.monotonic() + timeout
     
     try:
-        s = serial.Serial(port_name, 115200, timeout=0.5)
-    except Exception as e:
-        print(f"\n{Colors.RED}[-] Failed to open port. Are you running with sudo/admin?{Colors.RESET}")
-        print(f"{Colors.RED}[-] Error: {e}{Colors.RESET}")
-        return False
-
-    print(f"{Colors.CYAN}[*] Flooding port with {boot_mode_cmd.decode()} command...{Colors.RESET}")
+        s = open_port_when_ready(port_name, deadline)
+    except serial.SerialException as e:
+        result.error = e
+        return result
+    result.open = time.monotonic()
     
-    start_time = time.time()
-    success = False
+    fd = s.fileno()
+    sel = selectors.DefaultSelector()
+    sel.register(fd, selectors.EVENT_READ)
+    buffer = bytearray()
+    next_write = result.open
     
-    while time.time() - start_time < 5:
-        try:
-            s.write(boot_mode_cmd)
-            resp = s.read(8)
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
             
-            if resp:
-                print(f"{Colors.YELLOW}[>] Preloader responded: {resp}{Colors.RESET}")
+            if now >= next_write:
+                try:
+                    os.write(fd, boot_mode_cmd)
+                    result.writes += 1
+                    if result.first_write is None:
+                        result.first_write = time.monotonic()
+                except BlockingIOError:
+                    pass
+                next_write = now + interval
             
-            if resp == expected_ack or b"READY" in resp:
-                print(f"\n{Colors.GREEN}{Colors.BOLD}[+] Handshake successful! The device should now boot into Fastboot Mode.{Colors.RESET}")
-                success = True
-                break
-        except Exception as e:
-            print(f"\n{Colors.RED}[-] Serial connection lost or error: {e}{Colors.RESET}")
-            break
+            if not sel.select(max(0.0, min(next_write, deadline) - time.monotonic())):
+                continue
+            
+            data = os.read(fd, 256)
+            if not data:
+                continue
+            if result.first_byte is None:
+                result.first_byte = time.monotonic()
+            buffer += data
             
-    s.close()
+            index = buffer.find(ACK_TOKEN)
+            if index >= 0:
+                result.ack = time.monotonic()
+                result.success = True
+                result.response = bytes(buffer[index:])
+                break
+            del buffer[:-len(ACK_TOKEN)]
+    except OSError as e:
+        result.error = e
+    finally:
+        sel.close()
+        s.close()
+        
+    if not result.success:
+        result.response = bytes(buffer)
+    return result
+
+def print_handshake_timings(result):
+    offsets = result.offsets_ms()
+    if not offsets:
+        return
+    origin = "port appeared" if result.port_appear is not None else "port opened"
+    steps = ", ".join(f"{phase} +{ms:.1f}" for phase, ms in offsets.items())
+    print(f"{Colors.CYAN}[*] Timings (ms since {origin}): {steps} [{result.writes} writes]{Colors.RESET}")
+
+def force_fastboot(port_name, port_appear=None):
+    print(f"{Colors.CYAN}[*] Opening {port_name} at 115200 baud...{Colors.RESET}")
+    print(f"{Colors.CYAN}[*] Flooding port with {BOOT_MODE_CMD.decode()} command every "
+          f"{HANDSHAKE_WRITE_INTERVAL * 1000:.0f} ms...{Colors.RESET}")
     
-    if not success:
+    with span("handshake", tool="force_fastboot", port=port_name) as fields:
+        result = run_handshake(port_name, port_appear)
+        fields.update(ok=result.success, writes=result.writes)
+    event("handshake", tool="force_fastboot", port=port_name, ok=result.success, writes=result.writes,
+          error=str(result.error) if result.error else None,
+          phases_ms={phase: round(ms, 3) for phase, ms in result.offsets_ms().items()})
+    
+    if result.response:
+        print(f"{Colors.YELLOW}[>] Preloader responded: {result.response}{Colors.RESET}")
+    
+    if result.success:
+        print(f"\n{Colors.GREEN}{Colors.BOLD}[+] Handshake successful! The device should now boot into Fastboot Mode.{Colors.RESET}")
+    elif result.open is None:
+        print(f"\n{Colors.RED}[-] Failed to open port. Are you running with sudo/admin?{Colors.RESET}")
+        print(f"{Colors.RED}[-] Error: {result.error}{Colors.RESET}")
+    elif result.error is not None:
+        print(f"\n{Colors.RED}[-] Serial connection lost or error: {result.error}{Colors.RESET}")
+    else:
         print(f"\n{Colors.RED}[-] Timeout: Preloader window missed or device rejected the command.{Colors.RESET}")
-        
-    return success
+    
+    print_handshake_timings(result)
+    return result.success
 
-def main():
+class TrayCatcher:
+    """Handshakes every preloader port it is offered, each on its own thread, so a whole tray is caught at once.
+
+    Ports are tracked by their physical USB path: a phone that has been
+    switched is left alone when its preloader shows up again on a later
+    boot, and a path with a handshake still running is not started twice.
+    A failed attempt is not counted as switched, so a bootlooping phone is
+    retried on its next appearance.
+    """
+
+    def __init__(self, timeout=HANDSHAKE_TIMEOUT, count=None, on_result=None):
+        self.timeout = timeout
+        self.count = count
+        self.on_result = on_result
+        self.results = []
+        self.switched = {}
+        self.attempts = {}
+        self.done = threading.Event()
+        self._in_flight = set()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def offer(self, port_event):
+        """Starts a handshake for port_event unless its USB path is switched or already in flight."""
+        usb_path = port_event.usb_path or port_event.device
+        with self._lock:
+            if self.done.is_set() or usb_path in self.switched or usb_path in self._in_flight:
+                increment("ports_skipped")
+                return False
+            self._in_flight.add(usb_path)
+            self.attempts[usb_path] = self.attempts.get(usb_path, 0) + 1
+            t = threading.Thread(target=self._handshake, args=(usb_path, port_event), daemon=True)
+            self._threads.append(t)
+        t.start()
+        return True
+
+    def _handshake(self, usb_path, port_event):
+        with span("handshake", tool="force_fastboot", port=port_event.device, usb_path=usb_path) as fields:
+            result = run_handshake(port_event.device, port_event.detected_at, self.timeout)
+            fields.update(ok=result.success, writes=result.writes)
+        event("handshake", tool="force_fastboot", port=port_event.device, usb_path=usb_path, ok=result.success,
+              writes=result.writes, error=str(result.error) if result.error else None,
+              phases_ms={phase: round(ms, 3) for phase, ms in result.offsets_ms().items()})
+        with self._lock:
+            self._in_flight.discard(usb_path)
+            self.results.append((usb_path, port_event, result))
+            if result.success:
+                self.switched[usb_path] = result
+                if self.count is not None and len(self.switched) >= self.count:
+                    self.done.set()
+        if self.on_result:
+            self.on_result(usb_path, port_event, result)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def join(self, timeout=None):
+        with self._lock:
+            threads = list(self._threads)
+        for t in threads:
+            t.join(timeout)
+
+    def outcomes(self):
+        """Per USB path: (port, result) of the switching attempt, or of the last one if none succeeded."""
+        with self._lock:
+            outcomes = {}
+            for usb_path, port_event, result in self.results:
+                if usb_path not in self.switched or result is self.switched[usb_path]:
+                    outcomes[usb_path] = (port_event.device, result)
+            return outcomes
+
+def catch_tray(catcher, vid=MTK_VID, timeout=None, on_idle=None):
+    """Offers every preloader port already present or added later to catcher, until catcher.done is set
+    or timeout expires. Falls back to polling the serial ports when hotplug events are unavailable.
+    """
+    try:
+        monitor = UeventMonitor()
+    except HotplugUnavailable as e:
+        print(f"{Colors.YELLOW}[!] Hotplug events unavailable ({e}), falling back to polling.{Colors.RESET}")
+        for port_event in poll_tty_adds(vid, timeout, on_idle, stop=catcher.done):
+            catcher.offer(port_event)
+        return
+    
+    with monitor:
+        for port_event in scan_ttys(vid):
+            catcher.offer(port_event)
+        for port_event in watch_events(monitor, vid, None, timeout, on_idle, stop=catcher.done):
+            catcher.offer(port_event)
+
+def describe_result(result):
+    if result.success:
+        return "switched"
+    if result.pyserial_missing:
+        return PYSERIAL_MISSING
+    if result.open is None:
+        return f"open failed: {result.error}"
+    if result.error is not None:
+        return f"error: {result.error}"
+    return "no ACK"
+
+def print_tray_result(usb_path, port, result):
+    ack_ms = result.offsets_ms().get("ack")
+    if result.success:
+        print(f"{Colors.GREEN}[+] USB {usb_path} ({port}): ACK {ack_ms:.1f} ms after the port appeared "
+              f"[{result.writes} writes]{Colors.RESET}")
+    else:
+        print(f"{Colors.RED}[-] USB {usb_path} ({port}): {describe_result(result)} [{result.writes} writes]{Colors.RESET}")
+
+def print_tray_summary(catcher):
+    outcomes = catcher.outcomes()
+    if not outcomes:
+        print(f"{Colors.YELLOW}[!] No preloader ports were caught.{Colors.RESET}")
+        return
+    print(f"\n{Colors.BOLD}{'USB path':<14} {'Port':<16} {'Tries':>5} {'ACK ms':>9}  Result{Colors.RESET}")
+    for usb_path, (port, result) in sorted(outcomes.items()):
+        ack_ms = result.offsets_ms().get("ack")
+        color = Colors.GREEN if result.success else Colors.RED
+        ack = f"{ack_ms:.1f}" if ack_ms is not None else "-"
+        print(f"{color}{usb_path:<14} {port:<16} {catcher.attempts[usb_path]:>5} {ack:>9}  {describe_result(result)}{Colors.RESET}")
+    print(f"{Colors.CYAN}[*] {len(catcher.switched)} of {len(outcomes)} device(s) switched to fastboot.{Colors.RESET}")
+
+def tray_mode():
+    print(f"{Colors.YELLOW}[*] Catching every MediaTek preloader port that appears. Plug phones in as you go;{Colors.RESET}")
+    print(f"{Colors.YELLOW}[*] each one is handshaked the moment it shows up. Press Ctrl+C when the tray is done.{Colors.RESET}")
+    lock = threading.Lock()
+    
+    def report(usb_path, port_event, result):
+        with lock:
+            print_tray_result(usb_path, port_event.device, result)
+    
+    catcher = TrayCatcher(on_result=report)
     try:
-        import serial
-    except ImportError:
+        catch_tray(catcher)
+    except KeyboardInterrupt:
+        catcher.done.set()
+        if catcher.in_flight():
+            print(f"\n{Colors.YELLOW}[*] Letting {catcher.in_flight()} running handshake(s) finish...{Colors.RESET}")
+    try:
+        catcher.join()
+    except KeyboardInterrupt:
+        pass
+    print_tray_summary(catcher)
+
+def main():
+    if serial is None:
         print(f"{Colors.RED}[-] Missing dependency. Please run: pip install pyserial{Colors.RESET}")
         sys.exit(1)
         
@@ -96,10 +423,23 @@ def main():
     print("1. Power off your phone (or let it bootloop).")
     print("2. Connect it to your PC via USB.\n")
     
+    print(f"{Colors.BOLD}Modes:{Colors.RESET}")
+    print("1. Single device")
+    print("2. Whole tray (keep catching new devices until Ctrl+C)")
+    try:
+        mode = input(f"\n{Colors.YELLOW}Select a mode (1-2) [1]: {Colors.RESET}").strip()
+    except (KeyboardInterrupt, EOFError):
+        print(f"\n\n{Colors.RED}[!] Process aborted by user.{Colors.RESET}")
+        sys.exit(0)
+    if mode == "2":
+        tray_mode()
+        return
+    
     try:
-        port = wait_for_mtk_device()
-        time.sleep(0.3) 
-        force_fastboot(port)
+        print(f"{Colors.YELLOW}[*] Waiting for MediaTek Preloader VCOM port to appear...{Colors.RESET}")
+        print(f"{Colors.YELLOW}[*] Tip: If the phone is bootlooping, just leave it plugged in.{Colors.RESET}")
+        port, appeared_at = detect_mtk_port_timed()
+        force_fastboot(port, appeared_at)
     except KeyboardInterrupt:
         print(f"\n\n{Colors.RED}[!] Process aborted by user.{Colors.RESET}")
         sys.exit(0)
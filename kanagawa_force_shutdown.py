@@ -3,6 +3,13 @@ import time
 import sys
 import subprocess
 import itertools
+import threading
+
+from kanagawa_adb_client import AdbError, get_client, get_tracker
+from kanagawa_fastboot import fastboot_devices, run_fastboot, tcp_targets
+from kanagawa_metrics import count_spawn, increment, span
+from kanagawa_hotplug import (UeventMonitor, HotplugUnavailable, FASTBOOT_INTERFACE, MTK_VID,
+                              scan_ttys, scan_usb_interfaces, watch_events)
 
 class Colors:
     CYAN = '\033[96m'
@@ -12,6 +19,8 @@ class Colors:
     RESET = '\033[0m'
     BOLD = '\033[1m'
 
+FASTBOOT_REENUMERATE_TIMEOUT = 15
+
 def print_banner():
     banner = fr"""{Colors.RED}{Colors.BOLD}
   _  __                                             
@@ -25,6 +34,7 @@ def print_banner():
     print(banner)
 
 def run_command(cmd):
+    count_spawn(cmd)
     try:
         result = subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL)
         return result.decode('utf-8').strip()
@@ -39,43 +49,160 @@ def check_dependencies():
         print(f"{Colors.RED}[-] ADB not found in system PATH. Please install Android Platform Tools.{Colors.RESET}")
         sys.exit(1)
         
-    fastboot_check = run_command("fastboot --version")
-    if not fastboot_check:
-        print(f"{Colors.YELLOW}[!] Fastboot not found. Script will only check for ADB.{Colors.RESET}")
-    
     print(f"{Colors.GREEN}[+] Dependencies verified.{Colors.RESET}\n")
 
+class TransportRace:
+    """Collects detections from the parallel watchers and keeps only the first one."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.done = threading.Event()
+        self.kind = None
+        self.target = None
+        self.detected_at = None
+        self._lock = threading.Lock()
+
+    def offer(self, kind, target, detected_at):
+        with self._lock:
+            if self.kind is None:
+                self.kind, self.target, self.detected_at = kind, target, detected_at
+                self.done.set()
+
+    def give_up(self):
+        with self._lock:
+            self.done.set()
+
+def watch_adb(race):
+    tracker = get_tracker()
+    while not race.done.is_set():
+        ready = tracker.wait_for(lambda states: [s for s, st in states.items() if st == "device"], timeout=0.1)
+        if ready:
+            race.offer("adb", ready[0], time.monotonic())
+
+def poll_usb(race, want, interval=0.1):
+    while not race.done.is_set():
+        increment("usb_polls")
+        if "preloader" in want:
+            for event in scan_ttys(MTK_VID):
+                race.offer(event.kind, event, event.detected_at)
+        if "fastboot" in want:
+            serials = fastboot_devices()
+            if serials:
+                race.offer("fastboot", serials[0], time.monotonic())
+        race.done.wait(interval)
+
+def watch_usb(race, want=("fastboot", "preloader")):
+    """Watches fastboot interfaces and MTK VCOM ports on one uevent socket."""
+    try:
+        monitor = UeventMonitor()
+    except HotplugUnavailable:
+        return poll_usb(race, want)
+        
+    with monitor:
+        present = []
+        if "fastboot" in want:
+            present += scan_usb_interfaces(FASTBOOT_INTERFACE)
+        if "preloader" in want:
+            present += scan_ttys(MTK_VID)
+        for event in present:
+            race.offer(event.kind, event, event.detected_at)
+            
+        vid = MTK_VID if "preloader" in want else None
+        triplet = FASTBOOT_INTERFACE if "fastboot" in want else None
+        for event in watch_events(monitor, vid, triplet, stop=race.done):
+            race.offer(event.kind, event, event.detected_at)
+
+def poll_fastboot_tcp(race, interval=0.1):
+    """Network fastboot targets send no uevents, so they are probed on a timer."""
+    while not race.done.is_set():
+        serials = fastboot_devices()
+        if serials:
+            race.offer("fastboot", serials[0], time.monotonic())
+        race.done.wait(interval)
+
+def race_transports(want=("adb", "fastboot", "preloader"), on_idle=None, timeout=None):
+    """Runs the watchers in parallel and returns the race; race.kind stays None on timeout."""
+    race = TransportRace()
+    watchers = []
+    if "adb" in want:
+        watchers.append(threading.Thread(target=watch_adb, args=(race,), daemon=True))
+    if "fastboot" in want or "preloader" in want:
+        watchers.append(threading.Thread(target=watch_usb, args=(race, want), daemon=True))
+    if "fastboot" in want and tcp_targets():
+        watchers.append(threading.Thread(target=poll_fastboot_tcp, args=(race,), daemon=True))
+    for t in watchers:
+        t.start()
+        
+    while not race.done.wait(0.1):
+        if timeout is not None and time.monotonic() - race.started > timeout:
+            race.give_up()
+            break
+        if on_idle:
+            on_idle()
+    return race
+
+def fastboot_poweroff(serial=None):
+    ok, output = run_fastboot(serial, "oem", "poweroff", timeout=10)
+    if ok:
+        print(f"{Colors.GREEN}{Colors.BOLD}[+] 'fastboot oem poweroff' sent. Device should power down.{Colors.RESET}")
+    else:
+        print(f"{Colors.RED}[-] 'fastboot oem poweroff' failed: {output.splitlines()[-1]}{Colors.RESET}")
+    return ok
+
+def preloader_poweroff(event):
+    """The preloader has no power-off command, so steer it into fastboot and power off from there."""
+    from kanagawa_force_fastboot import run_handshake
+    
+    result = run_handshake(event.device, event.detected_at)
+    if not result.success:
+        print(f"{Colors.RED}[-] Preloader handshake failed ({result.error or 'no ACK'}).{Colors.RESET}")
+        return False
+    print(f"{Colors.GREEN}[+] Preloader ACKed FASTBOOT. Waiting for the fastboot interface...{Colors.RESET}")
+    
+    race = race_transports(want=("fastboot",), timeout=FASTBOOT_REENUMERATE_TIMEOUT)
+    if race.kind is None:
+        print(f"{Colors.RED}[-] Fastboot interface never appeared after the handshake.{Colors.RESET}")
+        return False
+    return fastboot_poweroff(getattr(race.target, "serial", race.target))
+
 def aggressive_poll_and_shutdown():
-    print(f"{Colors.YELLOW}[*] Aggressively polling for ADB or Fastboot interfaces...{Colors.RESET}")
+    print(f"{Colors.YELLOW}[*] Watching ADB, Fastboot and MTK Preloader transports in parallel...{Colors.RESET}")
     print(f"{Colors.YELLOW}[*] Tip: If the phone is bootlooping, leave it plugged in. The script will catch it.{Colors.RESET}")
     
     spinner = itertools.cycle(['|', '/', '-', '\\'])
     
-    while True:
-        adb_output = run_command("adb devices")
-        if "device" in adb_output and len(adb_output.split('\n')) > 1:
-            lines = adb_output.split('\n')[1:]
-            for line in lines:
-                if "device" in line and "unauthorized" not in line and "offline" not in line:
-                    sys.stdout.write('\r' + ' ' * 50 + '\r')
-                    print(f"\n{Colors.GREEN}[+] ADB Device Detected! Executing shutdown...{Colors.RESET}")
-                    
-                    run_command("adb shell reboot -p")
-                    print(f"{Colors.GREEN}{Colors.BOLD}[+] 'adb shell reboot -p' sent. Device should power off.{Colors.RESET}")
-                    return True
-
-        fastboot_output = run_command("fastboot devices")
-        if fastboot_output:
-            sys.stdout.write('\r' + ' ' * 50 + '\r')
-            print(f"\n{Colors.GREEN}[+] Fastboot Device Detected! Executing shutdown...{Colors.RESET}")
-            
-            run_command("fastboot oem poweroff")
-            print(f"{Colors.GREEN}{Colors.BOLD}[+] 'fastboot oem poweroff' sent. Device should power down.{Colors.RESET}")
-            return True
-                
+    def spin():
         sys.stdout.write(f'\r{Colors.CYAN}[{next(spinner)}] Hunting for active connection window...{Colors.RESET}')
         sys.stdout.flush()
-        time.sleep(0.1)
+    
+    # Both the fastboot and the preloader routes end in 'fastboot oem poweroff'.
+    with span("hunt", tool="shutdown") as fields:
+        race = race_transports(on_idle=spin)
+        fields["winner"] = race.kind
+    sys.stdout.write('\r' + ' ' * 50 + '\r')
+    
+    hunt_s = race.detected_at - race.started
+    print(f"\n{Colors.GREEN}[+] {race.kind.upper()} won the race after {hunt_s:.2f}s. Executing shutdown...{Colors.RESET}")
+    
+    with span("poweroff", tool="shutdown", transport=race.kind, usb=getattr(race.target, "usb_path", None)) as fields:
+        if race.kind == "adb":
+            try:
+                get_client().shell("reboot -p", race.target)
+                print(f"{Colors.GREEN}{Colors.BOLD}[+] 'adb shell reboot -p' sent. Device should power off.{Colors.RESET}")
+                ok = True
+            except (AdbError, OSError) as e:
+                print(f"{Colors.RED}[-] 'adb shell reboot -p' failed: {e}{Colors.RESET}")
+                ok = False
+        elif race.kind == "fastboot":
+            ok = fastboot_poweroff(getattr(race.target, "serial", race.target))
+        else:
+            ok = preloader_poweroff(race.target)
+        fields["ok"] = ok
+    
+    action_ms = (time.monotonic() - race.detected_at) * 1000
+    print(f"{Colors.CYAN}[*] Winner: {race.kind}, detected {hunt_s:.2f}s into the hunt, "
+          f"power-off issued {action_ms:.0f} ms after detection.{Colors.RESET}")
+    return ok
 
 def main():
     print_banner()
@@ -89,10 +216,10 @@ def main():
     
     try:
         aggressive_poll_and_shutdown()
-        run_command("adb kill-server")
+        get_client().kill_server()
     except KeyboardInterrupt:
         print(f"\n\n{Colors.RED}[!] Process aborted by user.{Colors.RESET}")
-        run_command("adb kill-server")
+        get_client().kill_server()
         sys.exit(0)
 
 if __name__ == "__main__":
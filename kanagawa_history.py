@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Versioned partition history stored as block deltas.
+
+Each (serial, partition) gets a folder under the cache directory holding one
+full base image and, per later visit, a delta file with only the blocks that
+changed since the previous version. versions.json lists the per-block sha256
+of every version, so the next visit can tell which blocks to pull and any
+version can be rebuilt by replaying the deltas on top of its base.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from kanagawa_dump_cache import CACHE_DIR
+from kanagawa_integrity import MultiHasher
+
+HISTORY_DIR = os.path.join(CACHE_DIR, "history")
+DELTA_BLOCK_SIZE = 128 * 1024
+# A visit that changed more than this share of the partition is stored as a new base.
+REBASE_RATIO = 0.5
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class HistoryError(Exception):
+    pass
+
+def block_lengths(size, block_size, blocks=None):
+    """Byte length of each listed block (every block when blocks is None); only the last one can be short."""
+    if blocks is None:
+        blocks = range((size + block_size - 1) // block_size)
+    return [min(block_size, size - index * block_size) for index in blocks]
+
+class PendingVersion:
+    """A version being written: pulled blocks go to a temporary file and are hashed as each one completes."""
+
+    def __init__(self, history, number, size, block_size, blocks):
+        self.history = history
+        self.number = number
+        self.size = size
+        self.block_size = block_size
+        self.blocks = blocks
+        self.kind = "base" if blocks is None else "delta"
+        self.file = f"v{number:04d}.{'img' if blocks is None else 'delta'}"
+        self.lengths = block_lengths(size, block_size, blocks)
+        self.hashes = []
+        self.length = 0
+        self._current = hashlib.sha256()
+        self._filled = 0
+        os.makedirs(history.path, exist_ok=True)
+        # Unique per dump: two concurrent visits may both be writing the next version number.
+        fd, self._tmp_path = tempfile.mkstemp(prefix=f".{self.file}.", dir=history.path)
+        self._out = os.fdopen(fd, 'wb')
+
+    @property
+    def expected(self):
+        return sum(self.lengths)
+
+    def write(self, data):
+        self._out.write(data)
+        self.length += len(data)
+        view = memoryview(data)
+        while view and len(self.hashes) < len(self.lengths):
+            piece = view[:self.lengths[len(self.hashes)] - self._filled]
+            self._current.update(piece)
+            self._filled += len(piece)
+            view = view[len(piece):]
+            if self._filled == self.lengths[len(self.hashes)]:
+                self.hashes.append(self._current.hexdigest())
+                self._current = hashlib.sha256()
+                self._filled = 0
+        return len(data)
+
+    def discard(self):
+        self._out.close()
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def publish(self):
+        os.replace(self._tmp_path, os.path.join(self.history.path, self.file))
+
+    def finish(self):
+        self._out.close()
+        if self.length != self.expected:
+            self.discard()
+            raise HistoryError(f"version {self.number} got {self.length} of {self.expected} bytes")
+        return {"version": self.number, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "kind": self.kind,
+                "file": self.file, "size": self.size, "block_size": self.block_size, "blocks": self.blocks,
+                "hashes": self.hashes, "stored": self.length}
+
+class PartitionHistory:
+    """Every recorded version of one partition on one device."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, serial, partition, root=HISTORY_DIR):
+        self.serial = serial or "default"
+        self.partition = partition
+        self.path = os.path.join(root, self.serial, partition)
+        self.versions_path = os.path.join(self.path, "versions.json")
+
+    @property
+    def versions(self):
+        try:
+            with open(self.versions_path) as f:
+                return json.load(f).get("versions", [])
+        except (OSError, ValueError):
+            return []
+
+    def latest(self):
+        versions = self.versions
+        return versions[-1] if versions else None
+
+    def version(self, number=None):
+        versions = self.versions
+        if number is None:
+            if not versions:
+                raise HistoryError(f"no history for {self.partition} on {self.serial}")
+            return versions[-1]
+        for record in versions:
+            if record["version"] == number:
+                return record
+        raise HistoryError(f"{self.partition} on {self.serial} has no version {number}")
+
+    def chain(self, number=None):
+        """The base record the version builds on, followed by every delta up to and including it."""
+        target = self.version(number)["version"]
+        chain = []
+        for record in self.versions:
+            if record["version"] > target:
+                break
+            chain = [record] if record["kind"] == "base" else chain + [record]
+        if not chain or chain[0]["kind"] != "base":
+            raise HistoryError(f"version {target} of {self.partition} has no base image")
+        return chain
+
+    def block_hashes(self, number=None):
+        chain = self.chain(number)
+        hashes = list(chain[0]["hashes"])
+        for record in chain[1:]:
+            for index, digest in zip(record["blocks"], record["hashes"]):
+                hashes[index] = digest
+        return hashes
+
+    def compatible(self, size, block_size):
+        latest = self.latest()
+        return latest is not None and latest["size"] == size and latest["block_size"] == block_size
+
+    def begin(self, size, block_size, blocks=None):
+        """Starts the next version: the full image when blocks is None, else just those block indices in order."""
+        latest = self.latest()
+        return PendingVersion(self, latest["version"] + 1 if latest else 1, size, block_size, blocks)
+
+    def commit(self, pending):
+        """Records pending as the next version, unless another dump recorded one since it began."""
+        record = pending.finish()
+        with self._lock:
+            versions = self.versions
+            if (versions[-1]["version"] if versions else 0) != pending.number - 1:
+                pending.discard()
+                raise HistoryError(f"version {pending.number} of {self.partition} on {self.serial} "
+                                   f"was recorded by another dump meanwhile")
+            pending.publish()
+            versions.append(record)
+            tmp_path = self.versions_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"serial": self.serial, "partition": self.partition, "versions": versions}, f, indent=2)
+            os.replace(tmp_path, self.versions_path)
+        return record
+
+    def stored_bytes(self):
+        return sum(record["stored"] for record in self.versions)
+
+    def rebuild(self, number, dest, digests=("sha256",)):
+        """Writes version number (latest when None) to dest, checking every block against its recorded hash.
+
+        Returns (record, MultiHasher over the rebuilt image).
+        """
+        chain = self.chain(number)
+        record = chain[-1]
+        block_size = record["block_size"]
+        tmp_path = dest + ".tmp"
+        with open(tmp_path, 'wb') as out:
+            with open(os.path.join(self.path, chain[0]["file"]), 'rb') as base:
+                shutil.copyfileobj(base, out, COPY_CHUNK_SIZE)
+            for delta in chain[1:]:
+                with open(os.path.join(self.path, delta["file"]), 'rb') as f:
+                    for index, length in zip(delta["blocks"], block_lengths(delta["size"], block_size, delta["blocks"])):
+                        out.seek(index * block_size)
+                        out.write(f.read(length))
+
+        expected = self.block_hashes(record["version"])
+        hasher = MultiHasher(digests)
+        with open(tmp_path, 'rb') as f:
+            for index, length in enumerate(block_lengths(record["size"], block_size)):
+                data = f.read(length)
+                hasher.update(data)
+                if hashlib.sha256(data).hexdigest() != expected[index]:
+                    os.unlink(tmp_path)
+                    raise HistoryError(f"block {index} of version {record['version']} does not match its recorded hash")
+            if f.read(1):
+                os.unlink(tmp_path)
+                raise HistoryError(f"version {record['version']} rebuilt larger than {record['size']} bytes")
+        os.replace(tmp_path, dest)
+        return record, hasher
+
+def list_histories(serial, root=HISTORY_DIR):
+    """Partitions with a recorded history for serial."""
+    directory = os.path.join(root, serial or "default")
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    return [PartitionHistory(serial, name, root) for name in names
+            if os.path.exists(os.path.join(directory, name, "versions.json"))]
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import glob
+import os
+import select
+import socket
+import time
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_EVENT_GROUP = 1
+MTK_VID = 0x0E8D
+FASTBOOT_INTERFACE = (0xFF, 0x42, 0x03)
+
+class HotplugUnavailable(Exception):
+    pass
+
+def parse_uevent(data):
+    """Turns a raw kernel uevent datagram into a dict; udev re-broadcasts return None."""
+    if data.startswith(b"libudev"):
+        return None
+    fields = data.split(b"\0")
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            event[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+    return event
+
+def read_sysfs(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def usb_device_dir(path, sysfs_root="/sys"):
+    """Walks up from any sysfs path to the USB device directory that owns it."""
+    while path and path != sysfs_root and path != "/":
+        if os.path.exists(os.path.join(path, "idVendor")):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+def usb_info_for_devpath(devpath, sysfs_root="/sys"):
+    """Walks up from a sysfs devpath to the USB device node and returns (vid, pid, usb_path).
+
+    usb_path is the kernel's port path (e.g. '1-2.3'), which stays the same for a
+    physical socket across re-enumerations.
+    """
+    path = usb_device_dir(os.path.join(sysfs_root, devpath.lstrip("/")), sysfs_root)
+    if path is None:
+        return None
+    try:
+        vid = int(read_sysfs(os.path.join(path, "idVendor")), 16)
+        pid = int(read_sysfs(os.path.join(path, "idProduct")), 16)
+    except (TypeError, ValueError):
+        return None
+    return vid, pid, os.path.basename(path)
+
+def usb_serial_for_devpath(devpath, sysfs_root="/sys"):
+    path = usb_device_dir(os.path.join(sysfs_root, devpath.lstrip("/")), sysfs_root)
+    return read_sysfs(os.path.join(path, "serial")) if path else None
+
+def interface_triplet(interface_dir):
+    try:
+        return tuple(int(read_sysfs(os.path.join(interface_dir, name)), 16)
+                     for name in ("bInterfaceClass", "bInterfaceSubClass", "bInterfaceProtocol"))
+    except (TypeError, ValueError):
+        return None
+
+def scan_usb_interfaces(triplet=FASTBOOT_INTERFACE, sysfs_root="/sys"):
+    """Returns a HotplugEvent for every interface already present that matches triplet."""
+    found = []
+    for interface_dir in sorted(glob.glob(os.path.join(sysfs_root, "bus/usb/devices/*:*"))):
+        if interface_triplet(interface_dir) != triplet:
+            continue
+        devpath = os.path.realpath(interface_dir)[len(os.path.realpath(sysfs_root)):]
+        info = usb_info_for_devpath(devpath, sysfs_root)
+        if info:
+            found.append(HotplugEvent("fastboot", interface_dir, info[0], info[1], info[2], time.monotonic(),
+                                      serial=usb_serial_for_devpath(devpath, sysfs_root)))
+    return found
+
+def scan_ttys(vid=MTK_VID, sysfs_root="/sys"):
+    """Returns a HotplugEvent for every USB tty already present whose device has the given VID."""
+    found = []
+    for tty_dir in sorted(glob.glob(os.path.join(sysfs_root, "class/tty/*"))):
+        devpath = os.path.realpath(tty_dir)[len(os.path.realpath(sysfs_root)):]
+        info = usb_info_for_devpath(devpath, sysfs_root)
+        if info and info[0] == vid:
+            found.append(HotplugEvent("preloader", f"/dev/{os.path.basename(tty_dir)}", info[0], info[1], info[2],
+                                      time.monotonic()))
+    return found
+
+class UeventMonitor:
+    """Listens on the kernel uevent netlink socket, so new ttys and USB interfaces are seen the instant they appear."""
+
+    def __init__(self):
+        if not hasattr(socket, "AF_NETLINK"):
+            raise HotplugUnavailable("netlink sockets are Linux-only")
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+            self.sock.bind((0, KERNEL_EVENT_GROUP))
+        except OSError as e:
+            raise HotplugUnavailable(f"cannot open uevent socket: {e}")
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def receive(self, timeout=None):
+        """Returns (event, monotonic receive time), or (None, None) on timeout."""
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return None, None
+        data = self.sock.recv(64 * 1024)
+        return parse_uevent(data), time.monotonic()
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HotplugEvent:
+    def __init__(self, kind, device, vid, pid, usb_path, detected_at, serial=None):
+        self.kind = kind
+        self.device = device
+        self.vid = vid
+        self.pid = pid
+        self.usb_path = usb_path
+        self.detected_at = detected_at
+        self.serial = serial
+
+def match_tty_add(event, vid=MTK_VID, sysfs_root="/sys"):
+    if not event or event.get("ACTION") != "add" or event.get("SUBSYSTEM") != "tty":
+        return None
+    info = usb_info_for_devpath(event.get("DEVPATH", ""), sysfs_root)
+    if info is None or (vid is not None and info[0] != vid):
+        return None
+    return info
+
+def match_interface_add(event, triplet=FASTBOOT_INTERFACE, sysfs_root="/sys"):
+    """Matches a USB interface 'add' by its INTERFACE=class/subclass/protocol key (decimal)."""
+    if not event or event.get("ACTION") != "add" or event.get("DEVTYPE") != "usb_interface":
+        return None
+    if event.get("INTERFACE") != "/".join(str(v) for v in triplet):
+        return None
+    return usb_info_for_devpath(event.get("DEVPATH", ""), sysfs_root)
+
+def watch_events(monitor, vid=MTK_VID, triplet=None, timeout=None, on_idle=None, idle_interval=0.1, stop=None):
+    """Yields HotplugEvents for MTK ttys (kind 'preloader') and, if triplet is given,
+    matching USB interfaces (kind 'fastboot') until timeout expires or stop is set.
+
+    on_idle() is called roughly every idle_interval seconds so callers can
+    draw a spinner without adding latency to the event path.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while stop is None or not stop.is_set():
+        wait = idle_interval
+        if deadline is not None:
+            wait = min(wait, deadline - time.monotonic())
+            if wait <= 0:
+                return
+        event, received = monitor.receive(wait)
+        if event is None:
+            if on_idle:
+                on_idle()
+            continue
+        if vid is not None or triplet is None:
+            info = match_tty_add(event, vid)
+            if info:
+                yield HotplugEvent("preloader", f"/dev/{event.get('DEVNAME', '')}", info[0], info[1], info[2], received)
+                continue
+        if triplet is not None:
+            info = match_interface_add(event, triplet)
+            if info:
+                yield HotplugEvent("fastboot", event.get("DEVPATH", ""), info[0], info[1], info[2], received,
+                                   serial=usb_serial_for_devpath(event.get("DEVPATH", "")))
+
+def watch_tty_adds(monitor, vid=MTK_VID, timeout=None, on_idle=None, idle_interval=0.1):
+    """Yields a HotplugEvent for every matching tty added until timeout expires."""
+    return watch_events(monitor, vid, None, timeout, on_idle, idle_interval)
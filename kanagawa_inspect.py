@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""Says what a dumped image is without reading it: boot, vendor_boot, vbmeta, super or sparse.
+
+Images are mmap'd and every structure is unpacked in place, so only the
+pages holding headers (and the AVB footer at the very end) are ever touched.
+A 9 GB super costs the same few page faults as a 64 KiB vbmeta.
+"""
+import mmap
+import os
+import shlex
+import struct
+import sys
+
+from kanagawa_avb import (AVB_FLAG_HASHTREE_DISABLED, AVB_FLAG_VERIFICATION_DISABLED, AVB_HEADER, AVB_MAGIC, AvbError,
+                          parse_vbmeta_header)
+from kanagawa_lp_metadata import LP_METADATA_GEOMETRY_SIZE, LpError, LpMetadata, geometry_offsets, metadata_offset, parse_geometry
+from kanagawa_partition_index import format_size
+from kanagawa_sparse import SPARSE_HEADER_FORMAT, SPARSE_HEADER_MAGIC
+
+class Colors:
+    CYAN = '\033[96m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+
+BOOT_MAGIC = b"ANDROID!"
+VENDOR_BOOT_MAGIC = b"VNDRBOOT"
+AVB_FOOTER_MAGIC = b"AVBf"
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+
+# boot_img_hdr_v0..v2 (v1/v2 append fields), boot_img_hdr_v3/v4 and vendor_boot_img_hdr_v3/v4, all little-endian.
+BOOT_HEADER_V0 = struct.Struct("<8s10I16s512s32s1024s")
+BOOT_HEADER_V1_EXTRA = struct.Struct("<IQI")
+BOOT_HEADER_V2_EXTRA = struct.Struct("<IQ")
+BOOT_HEADER_V3 = struct.Struct("<8s4I4II1536s")
+BOOT_HEADER_V4_EXTRA = struct.Struct("<I")
+BOOT_HEADER_VERSION_OFFSET = 40
+VENDOR_BOOT_HEADER_V3 = struct.Struct("<8s5I2048sI16s2IQ")
+VENDOR_BOOT_HEADER_V4_EXTRA = struct.Struct("<4I")
+AVB_FOOTER = struct.Struct(">4s2L3Q28x")
+AVB_DESCRIPTOR = struct.Struct(">2Q")
+AVB_HASH_DESCRIPTOR = struct.Struct(">Q32s4L60x")
+AVB_HASHTREE_DESCRIPTOR = struct.Struct(">L3Q3L2Q32s4L60x")
+AVB_CHAIN_DESCRIPTOR = struct.Struct(">4L60x")
+AVB_DESCRIPTOR_TAGS = {0: "property", 1: "hashtree", 2: "hash", 3: "kernel_cmdline", 4: "chain_partition"}
+
+def _text(raw):
+    return bytes(raw).split(b"\0", 1)[0].decode('utf-8', 'replace')
+
+def decode_os_version(value):
+    """(version, security patch level) from the packed os_version field, e.g. ("14.0.0", "2024-05")."""
+    if not value:
+        return None, None
+    version = value >> 11
+    patch = value & 0x7FF
+    return (f"{version >> 14 & 0x7F}.{version >> 7 & 0x7F}.{version & 0x7F}",
+            f"{2000 + (patch >> 4)}-{patch & 0xF:02d}" if patch else None)
+
+def parse_boot_header(data):
+    version = struct.unpack_from("<I", data, BOOT_HEADER_VERSION_OFFSET)[0]
+    if version >= 3:
+        fields = BOOT_HEADER_V3.unpack_from(data)
+        os_version, patch = decode_os_version(fields[3])
+        info = {"kind": "boot", "header_version": version, "kernel_size": fields[1], "ramdisk_size": fields[2],
+                "os_version": os_version, "patch_level": patch, "header_size": fields[4], "page_size": 4096,
+                "cmdline": _text(fields[10])}
+        if version >= 4:
+            info["signature_size"] = BOOT_HEADER_V4_EXTRA.unpack_from(data, BOOT_HEADER_V3.size)[0]
+        return info
+
+    fields = BOOT_HEADER_V0.unpack_from(data)
+    os_version, patch = decode_os_version(fields[10])
+    info = {"kind": "boot", "header_version": version, "kernel_size": fields[1], "ramdisk_size": fields[3],
+            "second_size": fields[5], "page_size": fields[8], "os_version": os_version, "patch_level": patch,
+            "name": _text(fields[11]), "cmdline": _text(fields[12]) + _text(fields[14])}
+    if version >= 1:
+        info["recovery_dtbo_size"], _, info["header_size"] = BOOT_HEADER_V1_EXTRA.unpack_from(data, BOOT_HEADER_V0.size)
+    if version >= 2:
+        info["dtb_size"] = BOOT_HEADER_V2_EXTRA.unpack_from(data, BOOT_HEADER_V0.size + BOOT_HEADER_V1_EXTRA.size)[0]
+    return info
+
+def parse_vendor_boot_header(data):
+    fields = VENDOR_BOOT_HEADER_V3.unpack_from(data)
+    info = {"kind": "vendor_boot", "header_version": fields[1], "page_size": fields[2], "vendor_ramdisk_size": fields[5],
+            "cmdline": _text(fields[6]), "name": _text(fields[8]), "header_size": fields[9], "dtb_size": fields[10]}
+    if fields[1] >= 4:
+        table_size, entries, _, bootconfig_size = VENDOR_BOOT_HEADER_V4_EXTRA.unpack_from(data, VENDOR_BOOT_HEADER_V3.size)
+        info.update(vendor_ramdisk_table_size=table_size, vendor_ramdisk_entries=entries, bootconfig_size=bootconfig_size)
+    return info
+
+def avb_flags_text(flags):
+    names = []
+    if flags & AVB_FLAG_HASHTREE_DISABLED:
+        names.append("hashtree disabled")
+    if flags & AVB_FLAG_VERIFICATION_DISABLED:
+        names.append("verification disabled")
+    return ", ".join(names) or "enforcing"
+
+def parse_avb_descriptors(data, offset, header):
+    """Descriptor tags plus the partition each hash/hashtree/chain descriptor covers."""
+    start = offset + AVB_HEADER.size + header["auth_size"] + header["descriptors_offset"]
+    end = start + header["descriptors_size"]
+    if end > len(data):
+        return None
+    descriptors = []
+    position = start
+    while position + AVB_DESCRIPTOR.size <= end:
+        tag, length = AVB_DESCRIPTOR.unpack_from(data, position)
+        body = position + AVB_DESCRIPTOR.size
+        entry = {"type": AVB_DESCRIPTOR_TAGS.get(tag, f"tag{tag}")}
+        name_at = name_len = None
+        if tag == 2:
+            image_size, algorithm, name_len = AVB_HASH_DESCRIPTOR.unpack_from(data, body)[:3]
+            entry.update(image_size=image_size, algorithm=_text(algorithm))
+            name_at = body + AVB_HASH_DESCRIPTOR.size
+        elif tag == 1:
+            fields = AVB_HASHTREE_DESCRIPTOR.unpack_from(data, body)
+            entry.update(image_size=fields[1], algorithm=_text(fields[9]))
+            name_len = fields[10]
+            name_at = body + AVB_HASHTREE_DESCRIPTOR.size
+        elif tag == 4:
+            entry["rollback_index_location"], name_len = AVB_CHAIN_DESCRIPTOR.unpack_from(data, body)[:2]
+            name_at = body + AVB_CHAIN_DESCRIPTOR.size
+        if name_at is not None and name_at + name_len <= end:
+            entry["partition"] = _text(data[name_at:name_at + name_len])
+        descriptors.append(entry)
+        position = body + length
+    return descriptors
+
+def parse_vbmeta(data, offset=0):
+    header = parse_vbmeta_header(data[offset:offset + AVB_HEADER.size])
+    return {"version": f"{header['version_major']}.{header['version_minor']}", "algorithm": header["algorithm"],
+            "flags": header["flags"], "flags_text": avb_flags_text(header["flags"]),
+            "rollback_index": header["rollback_index"], "release_string": header["release_string"],
+            "signed": bool(header["auth_size"]), "descriptors": parse_avb_descriptors(data, offset, header)}
+
+def parse_avb_footer(data):
+    """The AVB footer in the last 64 bytes of a partition image, with the vbmeta it points at."""
+    if len(data) < AVB_FOOTER.size:
+        return None
+    magic, major, minor, original_size, vbmeta_offset, vbmeta_size = AVB_FOOTER.unpack_from(data, len(data) - AVB_FOOTER.size)
+    if magic != AVB_FOOTER_MAGIC:
+        return None
+    footer = {"version": f"{major}.{minor}", "original_image_size": original_size, "vbmeta_offset": vbmeta_offset,
+              "vbmeta_size": vbmeta_size}
+    try:
+        footer["vbmeta"] = parse_vbmeta(data, vbmeta_offset)
+    except AvbError as e:
+        footer["error"] = str(e)
+    return footer
+
+def parse_super(data):
+    errors = []
+    for offset in geometry_offsets():
+        try:
+            geometry = parse_geometry(data[offset:offset + LP_METADATA_GEOMETRY_SIZE])
+            break
+        except LpError as e:
+            errors.append(str(e))
+    else:
+        raise LpError(errors[0])
+
+    for backup in (False, True):
+        start = metadata_offset(geometry, 0, backup)
+        try:
+            metadata = LpMetadata.parse(geometry, data[start:start + geometry["metadata_max_size"]])
+            break
+        except LpError as e:
+            errors.append(str(e))
+    else:
+        raise LpError(errors[-1])
+
+    partitions = []
+    for name in metadata.names(include_empty=True):
+        ranges = metadata.ranges(name)
+        end = max((offset + length for source, offset, length in ranges if source), default=0)
+        partitions.append({"name": name, "size": metadata.size(name), "group": metadata.partition(name).group,
+                           "extents": len(ranges), "in_image": end <= len(data)})
+    return {"kind": "super", "metadata_version": metadata.version, "metadata_slots": geometry["metadata_slot_count"],
+            "metadata_max_size": geometry["metadata_max_size"], "groups": metadata.groups,
+            "block_devices": [device["name"] for device in metadata.block_devices], "partitions": partitions}
+
+def parse_sparse(data):
+    magic, major, minor, _, _, block_size, total_blocks, total_chunks, _ = struct.unpack_from(SPARSE_HEADER_FORMAT, data)
+    return {"kind": "sparse", "version": f"{major}.{minor}", "block_size": block_size,
+            "expanded_size": block_size * total_blocks, "chunks": total_chunks}
+
+def inspect_view(data):
+    """Identifies and parses an image from any buffer (bytes, mmap or memoryview)."""
+    head = bytes(data[:8])
+    if head.startswith(BOOT_MAGIC):
+        info = parse_boot_header(data)
+    elif head.startswith(VENDOR_BOOT_MAGIC):
+        info = parse_vendor_boot_header(data)
+    elif head.startswith(AVB_MAGIC):
+        info = dict(parse_vbmeta(data), kind="vbmeta")
+    elif len(head) >= 4 and struct.unpack_from("<I", head)[0] == SPARSE_HEADER_MAGIC:
+        return parse_sparse(data)
+    elif head.startswith(GZIP_MAGIC) or head.startswith(XZ_MAGIC):
+        return {"kind": "gzip" if head.startswith(GZIP_MAGIC) else "xz", "error": "compressed; decompress it to inspect"}
+    else:
+        try:
+            return parse_super(data)
+        except LpError:
+            info = {"kind": "unknown"}
+
+    footer = parse_avb_footer(data)
+    if footer:
+        info["avb_footer"] = footer
+    return info
+
+def inspect_image(path):
+    info = {"path": path, "size": os.path.getsize(path)}
+    if not info["size"]:
+        info.update(kind="empty")
+        return info
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            info.update(inspect_view(view))
+        except (struct.error, AvbError, LpError) as e:
+            info.update(kind=info.get("kind", "unknown"), error=str(e))
+        finally:
+            view.release()
+    return info
+
+def describe(info):
+    """One line summary, e.g. for printing right after a dump."""
+    kind = info.get("kind")
+    if info.get("error"):
+        return f"{kind}: {info['error']}"
+    if kind in ("boot", "vendor_boot"):
+        parts = [f"{kind} image v{info['header_version']}"]
+        if info.get("kernel_size"):
+            parts.append(f"kernel {format_size(info['kernel_size'])}")
+        ramdisk = info.get("ramdisk_size", info.get("vendor_ramdisk_size"))
+        if ramdisk:
+            parts.append(f"ramdisk {format_size(ramdisk)}")
+        if info.get("os_version"):
+            parts.append(f"Android {info['os_version']}" + (f" ({info['patch_level']})" if info.get("patch_level") else ""))
+        footer = info.get("avb_footer")
+        if footer:
+            parts.append("AVB footer" + (f", {footer['vbmeta']['flags_text']}" if "vbmeta" in footer else ""))
+        return ", ".join(parts)
+    if kind == "vbmeta":
+        signed = "signed" if info["signed"] else "unsigned"
+        return f"vbmeta {info['version']}, {signed}, flags {info['flags']} ({info['flags_text']})"
+    if kind == "super":
+        used = [p for p in info["partitions"] if p["size"]]
+        missing = [p["name"] for p in used if not p["in_image"]]
+        line = f"super (LP {info['metadata_version']}, {info['metadata_slots']} slot(s)): " + \
+               ", ".join(f"{p['name']} {format_size(p['size'])}" for p in used)
+        return line + (f"; truncated, missing {', '.join(missing)}" if missing else "")
+    if kind == "sparse":
+        return f"Android sparse image, {format_size(info['expanded_size'])} expanded, {info['chunks']} chunks"
+    if info.get("avb_footer"):
+        return f"raw image with an AVB footer ({info['avb_footer'].get('vbmeta', {}).get('flags_text', 'unreadable vbmeta')})"
+    return kind
+
+def print_report(info):
+    color = Colors.RED if info.get("error") else Colors.GREEN
+    print(f"{Colors.BOLD}{info['path']}{Colors.RESET} ({format_size(info['size'])})")
+    print(f"  {color}{describe(info)}{Colors.RESET}")
+    if info.get("cmdline"):
+        print(f"  cmdline: {info['cmdline']}")
+    vbmeta = info if info.get("kind") == "vbmeta" else info.get("avb_footer", {}).get("vbmeta")
+    for descriptor in (vbmeta or {}).get("descriptors") or []:
+        target = f" {descriptor['partition']}" if "partition" in descriptor else ""
+        print(f"  {Colors.CYAN}descriptor: {descriptor['type']}{target}{Colors.RESET}")
+    if info.get("kind") == "super":
+        for p in info["partitions"]:
+            state = "" if p["in_image"] else f" {Colors.RED}(past the end of this dump){Colors.RESET}"
+            print(f"  {p['name']:<24} {format_size(p['size']):>10}  {p['extents']} extent(s)  group {p['group']}{state}")
+
+def main(argv=None):
+    paths = sys.argv[1:] if argv is None else argv
+    if not paths:
+        print(f"{Colors.BOLD}--- Inspect Dumped Images ---{Colors.RESET}")
+        answer = input(f"{Colors.YELLOW}Image path(s), space separated (e.g. boot_a_dump.img vbmeta_a_dump.img): {Colors.RESET}")
+        paths = shlex.split(answer)
+        print()
+    failed = 0
+    for path in paths:
+        try:
+            info = inspect_image(path)
+        except OSError as e:
+            print(f"{Colors.RED}[-] {path}: {e}{Colors.RESET}")
+            failed += 1
+            continue
+        print_report(info)
+        failed += bool(info.get("error"))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_DIGESTS = ("sha256",)
+ZERO_FEED_SIZE = 1024 * 1024
+
+def zero_blocks(length):
+    zeros = bytes(min(length, ZERO_FEED_SIZE))
+    remaining = length
+    while remaining:
+        yield zeros[:remaining]
+        remaining -= min(remaining, len(zeros))
+
+class MultiHasher:
+    """Feeds the same bytes to several hashlib digests at once, counting them as it goes."""
+
+    def __init__(self, algorithms=DEFAULT_DIGESTS):
+        algorithms = list(dict.fromkeys(("sha256",) + tuple(algorithms)))
+        self.hashes = {name: hashlib.new(name) for name in algorithms}
+        self.length = 0
+
+    def update(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+        self.length += len(data)
+
+    def update_zeros(self, length):
+        for zeros in zero_blocks(length):
+            self.update(zeros)
+
+    def hexdigest(self, name="sha256"):
+        return self.hashes[name].hexdigest()
+
+    def hexdigests(self):
+        return {name: h.hexdigest() for name, h in self.hashes.items()}
+
+class HashingWriter:
+    """Wraps an output writer so the raw partition bytes are hashed on their way in.
+
+    Zero runs handed to skip() are hashed too, so the digest always covers the
+    device's byte range, whatever sparse or compressed form ends up on disk.
+    """
+
+    def __init__(self, out, hasher):
+        self.out = out
+        self.hasher = hasher
+
+    @property
+    def position(self):
+        return self.hasher.length
+
+    @property
+    def skipped(self):
+        return getattr(self.out, "skipped", 0)
+
+    def write(self, data):
+        written = self.out.write(data)
+        self.hasher.update(data)
+        return written
+
+    def skip(self, length):
+        self.hasher.update_zeros(length)
+        if hasattr(self.out, "skip"):
+            return self.out.skip(length)
+        # A plain image file has no notion of holes, so the zeros are written out.
+        for zeros in zero_blocks(length):
+            self.out.write(zeros)
+        return length
+
+def manifest_path(image_path):
+    return image_path + ".digests.json"
+
+def write_digest_manifest(image_path, **record):
+    """Writes <image>.digests.json next to the image and returns its path."""
+    path = manifest_path(image_path)
+    record.setdefault("image", os.path.basename(image_path))
+    record.setdefault("created", time.strftime("%Y-%m-%dT%H:%M:%S"))
+    with open(path + ".tmp", 'w') as f:
+        json.dump(record, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+    return path
+
+def read_digest_manifest(image_path):
+    try:
+        with open(manifest_path(image_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Reads the dynamic-partition (liblp) metadata at the start of super.
+
+Only the geometry block and one metadata slot are fetched from the device
+(a few KiB to 64 KiB), which is enough to find every logical partition's
+extents, so vendor_a or system_a can be pulled without the rest of super.
+"""
+import hashlib
+import struct
+import threading
+
+from kanagawa_adb_client import AdbError, get_client, su_command
+from kanagawa_metrics import span
+from kanagawa_partition_index import BY_NAME_DIR, get_partition_index
+
+LP_SECTOR_SIZE = 512
+LP_PARTITION_RESERVED_BYTES = 4096
+LP_METADATA_GEOMETRY_SIZE = 4096
+LP_METADATA_GEOMETRY_MAGIC = 0x616C4467
+LP_METADATA_HEADER_MAGIC = 0x414C5030
+LP_METADATA_MAJOR_VERSION = 10
+LP_TARGET_TYPE_LINEAR = 0
+LP_TARGET_TYPE_ZERO = 1
+LP_PARTITION_ATTR_READONLY = 0x1
+SUPER_PARTITION = "super"
+
+LP_GEOMETRY = struct.Struct("<II32sIII")
+LP_HEADER = struct.Struct("<IHHI32sI32sIIIIIIIIIIII")
+LP_PARTITION = struct.Struct("<36sIIII")
+LP_EXTENT = struct.Struct("<QIQI")
+LP_GROUP = struct.Struct("<36sIQ")
+LP_BLOCK_DEVICE = struct.Struct("<QIIQ36sI")
+
+class LpError(Exception):
+    pass
+
+def _name(raw):
+    return raw.rstrip(b"\0").decode('utf-8', 'replace')
+
+def _checksum_ok(data, start, expected):
+    """sha256 of data with the 32-byte checksum field at start zeroed, as liblp computes it.
+
+    Hashed piecewise, so data can be a memoryview over an mmap'd image.
+    """
+    digest = hashlib.sha256(data[:start])
+    digest.update(bytes(32))
+    digest.update(data[start + 32:])
+    return digest.digest() == expected
+
+def geometry_offsets():
+    """Primary and backup geometry copies, right after the reserved first 4 KiB."""
+    return (LP_PARTITION_RESERVED_BYTES, LP_PARTITION_RESERVED_BYTES + LP_METADATA_GEOMETRY_SIZE)
+
+def metadata_offset(geometry, slot, backup=False):
+    base = LP_PARTITION_RESERVED_BYTES + 2 * LP_METADATA_GEOMETRY_SIZE
+    if backup:
+        base += geometry["metadata_slot_count"] * geometry["metadata_max_size"]
+    return base + slot * geometry["metadata_max_size"]
+
+def parse_geometry(data):
+    if len(data) < LP_GEOMETRY.size:
+        raise LpError(f"geometry is only {len(data)} bytes")
+    magic, struct_size, checksum, max_size, slot_count, block_size = LP_GEOMETRY.unpack_from(data)
+    if magic != LP_METADATA_GEOMETRY_MAGIC:
+        raise LpError(f"bad geometry magic {magic:#x} (not a dynamic-partition super)")
+    if not _checksum_ok(data[:struct_size], 4 + 4, checksum):
+        raise LpError("geometry checksum mismatch")
+    if not max_size or max_size % LP_SECTOR_SIZE or not slot_count:
+        raise LpError(f"implausible geometry: {max_size} bytes x {slot_count} slots")
+    return {"metadata_max_size": max_size, "metadata_slot_count": slot_count, "logical_block_size": block_size}
+
+class LpExtent:
+    def __init__(self, num_sectors, target_type, target_data, target_source):
+        self.num_sectors = num_sectors
+        self.target_type = target_type
+        self.target_data = target_data
+        self.target_source = target_source
+
+    @property
+    def size(self):
+        return self.num_sectors * LP_SECTOR_SIZE
+
+class LpPartition:
+    def __init__(self, name, attributes, group, extents):
+        self.name = name
+        self.attributes = attributes
+        self.group = group
+        self.extents = extents
+
+    @property
+    def size(self):
+        return sum(extent.size for extent in self.extents)
+
+class LpMetadata:
+    """One slot's logical partitions, groups and the block devices their extents point into."""
+
+    def __init__(self, geometry, version, partitions, groups, block_devices, slot=0):
+        self.geometry = geometry
+        self.version = version
+        self.partitions = partitions
+        self.groups = groups
+        self.block_devices = block_devices
+        self.slot = slot
+
+    @classmethod
+    def parse(cls, geometry, data, slot=0):
+        if len(data) < LP_HEADER.size:
+            raise LpError(f"metadata is only {len(data)} bytes")
+        fields = LP_HEADER.unpack_from(data)
+        magic, major, minor, header_size, header_checksum, tables_size, tables_checksum = fields[:7]
+        descriptors = [fields[7 + i * 3:10 + i * 3] for i in range(4)]
+        if magic != LP_METADATA_HEADER_MAGIC:
+            raise LpError(f"bad metadata magic {magic:#x}")
+        if major != LP_METADATA_MAJOR_VERSION:
+            raise LpError(f"unsupported metadata version {major}.{minor}")
+        if header_size < LP_HEADER.size or header_size + tables_size > len(data):
+            raise LpError(f"metadata header/tables ({header_size}+{tables_size} bytes) overrun the slot")
+        if not _checksum_ok(data[:header_size], 4 + 2 + 2 + 4, header_checksum):
+            raise LpError("metadata header checksum mismatch")
+        tables = data[header_size:header_size + tables_size]
+        if hashlib.sha256(tables).digest() != tables_checksum:
+            raise LpError("metadata tables checksum mismatch")
+
+        def table(descriptor, layout):
+            offset, count, entry_size = descriptor
+            if entry_size < layout.size or offset + count * entry_size > len(tables):
+                raise LpError("metadata table descriptor out of range")
+            return [layout.unpack_from(tables, offset + i * entry_size) for i in range(count)]
+
+        partitions_raw, extents_raw, groups_raw, devices_raw = (
+            table(descriptor, layout) for descriptor, layout in zip(descriptors, (LP_PARTITION, LP_EXTENT, LP_GROUP, LP_BLOCK_DEVICE)))
+        extents = [LpExtent(*entry) for entry in extents_raw]
+        groups = [_name(entry[0]) for entry in groups_raw]
+        block_devices = [{"name": _name(entry[4]), "first_logical_sector": entry[0], "size": entry[3]}
+                         for entry in devices_raw]
+        partitions = {}
+        for name, attributes, first_extent, num_extents, group_index in partitions_raw:
+            if first_extent + num_extents > len(extents):
+                raise LpError(f"partition {_name(name)} points past the extent table")
+            group = groups[group_index] if group_index < len(groups) else None
+            partitions[_name(name)] = LpPartition(_name(name), attributes, group,
+                                                  extents[first_extent:first_extent + num_extents])
+        return cls(geometry, f"{major}.{minor}", partitions, groups, block_devices, slot)
+
+    def __contains__(self, name):
+        return name in self.partitions
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def partition(self, name):
+        return self.partitions.get(name)
+
+    def size(self, name):
+        partition = self.partitions.get(name)
+        return partition.size if partition else None
+
+    def names(self, include_empty=False):
+        return sorted(name for name, partition in self.partitions.items() if include_empty or partition.size)
+
+    def ranges(self, name):
+        """(by-name block device or None for a zero fill, byte offset, byte length) per extent, in order."""
+        result = []
+        for extent in self.partitions[name].extents:
+            if extent.target_type == LP_TARGET_TYPE_ZERO:
+                result.append((None, 0, extent.size))
+            elif extent.target_type == LP_TARGET_TYPE_LINEAR:
+                if extent.target_source >= len(self.block_devices):
+                    raise LpError(f"{name} points at block device #{extent.target_source}, which is not listed")
+                device = self.block_devices[extent.target_source]["name"]
+                result.append((device, extent.target_data * LP_SECTOR_SIZE, extent.size))
+            else:
+                raise LpError(f"{name} has an extent of unknown type {extent.target_type}")
+        return result
+
+def slot_number(slot_suffix, slot_count):
+    if slot_count < 2:
+        return 0
+    return {"_b": 1, "b": 1}.get(slot_suffix, 0)
+
+def read_device_range(path, offset, length, serial=None):
+    dd_cmd = (f"dd if={path} bs={LP_SECTOR_SIZE} skip={offset // LP_SECTOR_SIZE} "
+              f"count={length // LP_SECTOR_SIZE} 2>/dev/null")
+    try:
+        return get_client().exec_bytes(su_command(dd_cmd), serial)
+    except (AdbError, OSError):
+        return b""
+
+def fetch_lp_metadata(serial=None, slot_suffix="", super_path=f"{BY_NAME_DIR}/{SUPER_PARTITION}"):
+    """Reads the geometry and one metadata slot from super, falling back to the backup copies."""
+    with span("lp_metadata", tool="extract", serial=serial) as fields:
+        geometry = None
+        errors = []
+        for offset in geometry_offsets():
+            try:
+                geometry = parse_geometry(read_device_range(super_path, offset, LP_METADATA_GEOMETRY_SIZE, serial))
+                break
+            except LpError as e:
+                errors.append(str(e))
+        if geometry is None:
+            raise LpError(errors[0])
+        slot = slot_number(slot_suffix, geometry["metadata_slot_count"])
+        for backup in (False, True):
+            data = read_device_range(super_path, metadata_offset(geometry, slot, backup), geometry["metadata_max_size"], serial)
+            try:
+                metadata = LpMetadata.parse(geometry, data, slot)
+                break
+            except LpError as e:
+                errors.append(str(e))
+        else:
+            raise LpError(errors[-1])
+        fields.update(partitions=len(metadata), slot=slot)
+    return metadata
+
+_metadata = {}
+_metadata_lock = threading.Lock()
+
+def get_lp_metadata(serial=None, refresh=False):
+    """The device's logical partitions for its active slot, or None when it has no readable super."""
+    with _metadata_lock:
+        if not refresh and serial in _metadata:
+            return _metadata[serial]
+    index = get_partition_index(serial)
+    if index is not None and SUPER_PARTITION not in index:
+        metadata = None
+    else:
+        try:
+            metadata = fetch_lp_metadata(serial, index.slot if index is not None else "")
+        except LpError:
+            metadata = None
+    with _metadata_lock:
+        _metadata[serial] = metadata
+    return metadata
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
+import importlib
 import os
 import sys
 import time
 
-# Import your modules directly
-import kanagawa_adb_partition_extractor
-import kanagawa_force_fastboot
-import kanagawa_vbmeta_disabler
-import kanagawa_force_shutdown
+# Menu key, label and module of every tool. A module is only imported once its
+# entry is picked, so the menu does not wait on pyserial, urllib or the ADB
+# client. Build.sh lists the same modules as PyInstaller hidden imports.
+TOOLS = [
+    ('1', "Extract Partitions (Root/TWRP ADB)", "kanagawa_adb_partition_extractor"),
+    ('2', "Force Fastboot Mode (MTK Preloader)", "kanagawa_force_fastboot"),
+    ('3', "Disable VBMeta / AVB Patcher", "kanagawa_vbmeta_disabler"),
+    ('4', "Force Shutdown (ADB/Fastboot)", "kanagawa_force_shutdown"),
+    ('5', "Inspect Dumped Images (boot/vbmeta/super)", "kanagawa_inspect"),
+]
 
 # ANSI Color Codes for Terminal UI
 class Colors:
@@ -33,11 +39,14 @@ def print_main_banner():
 {Colors.RESET}"""
     print(banner)
 
-def run_module(module_main_func):
-    """Executes the imported module's main function and pauses when done."""
+def load_tool(module_name):
+    return importlib.import_module(module_name).main
+
+def run_module(module_name):
+    """Imports the tool, executes its main function and pauses when done."""
     clear_screen()
     try:
-        module_main_func()
+        load_tool(module_name)()
     except KeyboardInterrupt:
         print(f"\n{Colors.RED}[!] Execution aborted by user.{Colors.RESET}")
     except SystemExit:
@@ -45,6 +54,12 @@ def run_module(module_main_func):
         pass
     except Exception as e:
         print(f"\n{Colors.RED}[-] An error occurred: {e}{Colors.RESET}")
+    
+    # Tools that report metrics have imported kanagawa_metrics by now; the others have nothing to flush.
+    metrics = sys.modules.get("kanagawa_metrics")
+    log_path = metrics.end_session() if metrics else None
+    if log_path:
+        print(f"{Colors.CYAN}[*] Timings and transfer stats logged to {log_path}{Colors.RESET}")
         
     input(f"\n{Colors.YELLOW}Press Enter to return to the main menu...{Colors.RESET}")
 
@@ -54,23 +69,17 @@ def main_menu():
         print_main_banner()
         
         print(f"{Colors.BOLD}--- Select an Operation ---{Colors.RESET}\n")
-        print(f"  {Colors.GREEN}[1]{Colors.RESET} Extract Partitions (Root/TWRP ADB)")
-        print(f"  {Colors.GREEN}[2]{Colors.RESET} Force Fastboot Mode (MTK Preloader)")
-        print(f"  {Colors.GREEN}[3]{Colors.RESET} Disable VBMeta / AVB Patcher")
-        print(f"  {Colors.GREEN}[4]{Colors.RESET} Force Shutdown (ADB/Fastboot)")
+        for key, label, _ in TOOLS:
+            print(f"  {Colors.GREEN}[{key}]{Colors.RESET} {label}")
         print(f"\n  {Colors.RED}[0]{Colors.RESET} Exit Toolkit")
         
         try:
-            choice = input(f"\n{Colors.CYAN}Enter your choice (0-4): {Colors.RESET}").strip()
+            choice = input(f"\n{Colors.CYAN}Enter your choice (0-{len(TOOLS)}): {Colors.RESET}").strip()
+            
+            tool = next((module for key, _, module in TOOLS if key == choice), None)
             
-            if choice == '1':
-                run_module(kanagawa_adb_partition_extractor.main)
-            elif choice == '2':
-                run_module(kanagawa_force_fastboot.main)
-            elif choice == '3':
-                run_module(kanagawa_vbmeta_disabler.main)
-            elif choice == '4':
-                run_module(kanagawa_force_shutdown.main)
+            if tool:
+                run_module(tool)
             elif choice == '0':
                 clear_screen()
                 print(f"{Colors.GREEN}[+] Exiting Kanagawa MediaTek Toolkit. Goodbye!{Colors.RESET}")
@@ -85,4 +94,7 @@ def main_menu():
             sys.exit(0)
 
 if __name__ == "__main__":
+    # Any arguments select the headless runner, e.g. 'kanagawa_toolkit extract --all'.
+    if len(sys.argv) > 1:
+        sys.exit(load_tool("kanagawa_cli")(sys.argv[1:]))
     main_menu()
\ No newline at end of file
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Shared instrumentation: phase spans, counters, live transfer progress and a JSONL log.
+
+Every tool reports into the same session. Each event is one JSON line with a
+monotonic offset from the session start, so logs from a whole bench can be
+lined up to find the hub, cable or device that is slowing things down.
+"""
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+from kanagawa_dump_cache import CACHE_DIR
+
+METRICS_DIR = os.environ.get("KANAGAWA_METRICS_DIR", os.path.join(CACHE_DIR, "metrics"))
+METRICS_ENABLED = os.environ.get("KANAGAWA_METRICS", "1") != "0"
+PROGRESS_INTERVAL = 0.25
+
+class Session:
+    def __init__(self, directory=METRICS_DIR, enabled=METRICS_ENABLED):
+        self.id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.started = time.monotonic()
+        self.enabled = enabled
+        self.path = os.path.join(directory, f"{self.id}.jsonl") if enabled else None
+        self.counters = {}
+        self.spans = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _write(self, event):
+        if not self.enabled:
+            return
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+        except OSError:
+            # Metrics must never take a dump or a flash down with them.
+            self.enabled = False
+
+    def event(self, kind, **fields):
+        event = {"type": kind, "session": self.id, "t": round(time.monotonic() - self.started, 6)}
+        event.update({key: value for key, value in fields.items() if value is not None})
+        with self._lock:
+            self._write(event)
+        return event
+
+    def increment(self, name, n=1, **tags):
+        key = (name,) + tuple(sorted(tags.items()))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def add_span_total(self, name, duration):
+        with self._lock:
+            count, total = self.spans.get(name, (0, 0.0))
+            self.spans[name] = (count + 1, total + duration)
+
+    def close(self):
+        with self._lock:
+            counters = [dict(key[1:], name=key[0], value=value) for key, value in self.counters.items()]
+            spans = {name: {"count": count, "seconds": round(total, 6)} for name, (count, total) in self.spans.items()}
+        if counters or spans:
+            self.event("summary", counters=counters, spans=spans,
+                       duration=round(time.monotonic() - self.started, 6))
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
+
+def end_session():
+    """Writes the counter/span summary and starts a fresh session on next use; returns the log path."""
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is None:
+        return None
+    session.close()
+    return session.path if session.enabled and os.path.exists(session.path) else None
+
+atexit.register(end_session)
+
+def event(kind, **fields):
+    return get_session().event(kind, **fields)
+
+def increment(name, n=1, **tags):
+    get_session().increment(name, n, **tags)
+
+@contextlib.contextmanager
+def span(name, **tags):
+    """Times a phase. The yielded dict can collect extra fields to log with it."""
+    session = get_session()
+    start = time.monotonic()
+    extra = {}
+    ok = True
+    try:
+        yield extra
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        duration = time.monotonic() - start
+        session.add_span_total(name, duration)
+        fields = dict(tags)
+        fields.update(extra)
+        fields.setdefault("ok", ok)
+        session.event("span", name=name, start=round(start - session.started, 6), duration=round(duration, 6), **fields)
+
+def format_rate(bytes_per_s):
+    return f"{bytes_per_s / (1024 * 1024):.1f} MiB/s"
+
+def format_eta(seconds):
+    return f"{int(seconds // 60)}m{int(seconds % 60):02d}s"
+
+class Progress:
+    """Live bytes / rate / ETA line for one transfer, logged as a 'transfer' event when finished."""
+
+    def __init__(self, label, total=None, show=True, color="", reset="", stream=None, **tags):
+        self.label = label
+        self.total = total
+        self.show = show
+        self.color = color
+        self.reset = reset
+        self.stream = stream or sys.stdout
+        self.tags = tags
+        self.done = 0
+        self.started = time.monotonic()
+        self._last_draw = 0.0
+        self._width = 0
+
+    def update(self, n):
+        self.done += n
+        if self.show:
+            now = time.monotonic()
+            if now - self._last_draw >= PROGRESS_INTERVAL or (self.total and self.done >= self.total):
+                self._last_draw = now
+                self.draw(now)
+
+    def rate(self, now=None):
+        elapsed = (now or time.monotonic()) - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def draw(self, now=None):
+        rate = self.rate(now)
+        line = f"[*] {self.label} {self.done / (1024 * 1024):.1f}"
+        if self.total:
+            line += f"/{self.total / (1024 * 1024):.1f} MiB ({self.done * 100 // self.total}%)"
+        else:
+            line += " MiB"
+        line += f"  {format_rate(rate)}"
+        if self.total and rate > 0 and self.done < self.total:
+            line += f"  ETA {format_eta((self.total - self.done) / rate)}"
+        self._width = max(self._width, len(line))
+        self.stream.write(f"\r{self.color}{line.ljust(self._width)}{self.reset}")
+        self.stream.flush()
+
+    def finish(self, ok=True):
+        duration = time.monotonic() - self.started
+        if self.show and self._width:
+            self.stream.write('\r' + ' ' * self._width + '\r')
+            self.stream.flush()
+        event("transfer", label=self.label, bytes=self.done, total=self.total, duration=round(duration, 6),
+              mib_per_s=round(self.done / duration / (1024 * 1024), 3) if duration > 0 else None, ok=ok, **self.tags)
+        return duration
+
+def count_spawn(cmd):
+    """Counts one subprocess spawn, keyed by the program name (adb, fastboot, ...)."""
+    program = cmd[0] if isinstance(cmd, (list, tuple)) else cmd.split()[0]
+    increment("subprocess_spawns", program=os.path.basename(program))
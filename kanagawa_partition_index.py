@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import json
+import os
+import threading
+import time
+
+from kanagawa_adb_client import AdbError, get_client, su_command
+from kanagawa_dump_cache import CACHE_DIR
+from kanagawa_metrics import span
+
+BY_NAME_DIR = "/dev/block/by-name"
+INDEX_DIR = os.path.join(CACHE_DIR, "partitions")
+
+# One shell round-trip: the active slot, then "name target size" per by-name link.
+# blockdev is tried first; the sysfs sector count covers toolboxes without it.
+# Without a by-name directory the glob stays literal, hence the -e check.
+INDEX_SCRIPT = (
+    "echo \"slot $(getprop ro.boot.slot_suffix)\"; "
+    f"for p in {BY_NAME_DIR}/*; do "
+    "[ -e \"$p\" ] || continue; "
+    "t=$(readlink -f \"$p\"); "
+    "s=$(blockdev --getsize64 \"$t\" 2>/dev/null); "
+    "[ -n \"$s\" ] || s=$(( $(cat /sys/class/block/${t##*/}/size 2>/dev/null || echo 0) * 512 )); "
+    "echo \"part ${p##*/} $t $s\"; "
+    "done"
+)
+
+class PartitionIndex:
+    """Name -> (block device, size) for one device, plus its active A/B slot."""
+
+    def __init__(self, serial, entries=None, slot="", fetched_at=None):
+        self.serial = serial
+        self.entries = dict(entries or {})
+        self.slot = slot
+        self.fetched_at = fetched_at or time.time()
+
+    @classmethod
+    def parse(cls, serial, output):
+        entries = {}
+        slot = ""
+        for line in output.splitlines():
+            fields = line.split()
+            if fields[:1] == ["slot"]:
+                slot = fields[1] if len(fields) > 1 else ""
+            elif fields[:1] == ["part"] and len(fields) == 4 and fields[3].isdigit() and int(fields[3]):
+                entries[fields[1]] = (fields[2], int(fields[3]))
+        return cls(serial, entries, slot)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def path(self, name):
+        return f"{BY_NAME_DIR}/{name}"
+
+    def size(self, name):
+        entry = self.entries.get(name)
+        return entry[1] if entry else None
+
+    def is_ab(self):
+        return bool(self.slot) or any(name.endswith("_a") for name in self.entries)
+
+    def slotted(self):
+        """Base names that exist as both <name>_a and <name>_b."""
+        return sorted(name[:-2] for name in self.entries
+                      if name.endswith("_a") and f"{name[:-2]}_b" in self.entries)
+
+    def unslotted(self):
+        bases = set(self.slotted())
+        return sorted(name for name in self.entries if not (name[-2:] in ("_a", "_b") and name[:-2] in bases))
+
+    def total_size(self, names):
+        return sum(self.size(name) or 0 for name in names)
+
+    def to_dict(self):
+        return {"serial": self.serial, "slot": self.slot, "fetched_at": self.fetched_at,
+                "partitions": {name: {"target": target, "size": size} for name, (target, size) in self.entries.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        entries = {name: (entry["target"], entry["size"]) for name, entry in data.get("partitions", {}).items()}
+        return cls(data.get("serial"), entries, data.get("slot", ""), data.get("fetched_at"))
+
+def index_path(serial, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, f"{serial or 'default'}.json")
+
+def save_index(index, index_dir=INDEX_DIR):
+    os.makedirs(index_dir, exist_ok=True)
+    path = index_path(index.serial, index_dir)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(index.to_dict(), f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def load_index(serial, index_dir=INDEX_DIR):
+    try:
+        with open(index_path(serial, index_dir)) as f:
+            return PartitionIndex.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+def fetch_index(serial=None):
+    """Builds the index with a single adb round-trip; returns None if the device could not be read."""
+    with span("partition_index", serial=serial) as fields:
+        try:
+            output = get_client().shell(su_command(f"{INDEX_SCRIPT} 2>/dev/null"), serial)
+        except (AdbError, OSError):
+            output = ""
+        index = PartitionIndex.parse(serial, output)
+        fields.update(ok=bool(len(index)), partitions=len(index))
+    return index if len(index) else None
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_partition_index(serial=None, refresh=False, persist=True, offline=False):
+    """Returns the cached index for serial, fetching it from the device on first use.
+
+    persist keeps a copy under the cache directory. offline falls back to that
+    copy when the device cannot be read, which is enough for planning.
+    """
+    with _indexes_lock:
+        if not refresh and serial in _indexes:
+            return _indexes[serial]
+    index = fetch_index(serial)
+    if index is None:
+        return load_index(serial) if offline else None
+    if persist:
+        try:
+            save_index(index)
+        except OSError:
+            pass
+    with _indexes_lock:
+        _indexes[serial] = index
+    return index
+
+def forget_partition_index(serial=None):
+    with _indexes_lock:
+        _indexes.pop(serial, None)
+
+def format_size(size):
+    if size is None:
+        return "?"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import shutil
+import threading
+import time
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PER_DEVICE = 2
+DISK_MARGIN = 256 * 1024 * 1024
+
+class Job:
+    def __init__(self, serial, target):
+        self.serial = serial
+        self.target = target
+        self.ok = False
+        self.result = None
+        self.error = None
+        self.skipped = False
+        self.size = None
+        self.started = None
+        self.duration = 0.0
+
+    def __repr__(self):
+        return f"Job({self.serial!r}, {self.target!r})"
+
+class JobScheduler:
+    """Runs (serial, target) jobs with a global worker cap and a per-device cap.
+
+    A job is only started once both a global slot and a slot on its own device
+    are free, so a busy phone never ties up workers that another phone could use.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, per_device=DEFAULT_PER_DEVICE):
+        self.max_workers = max(1, max_workers)
+        self.per_device = max(1, per_device)
+        self._cond = threading.Condition()
+        self._running = 0
+        self._device_running = {}
+
+    def _can_start(self, job):
+        return (self._running < self.max_workers and
+                self._device_running.get(job.serial, 0) < self.per_device)
+
+    def _worker(self, job, func, on_complete, done):
+        job.started = time.monotonic()
+        try:
+            job.result = func(job)
+            job.ok = bool(job.result)
+        except Exception as e:
+            job.error = e
+            job.ok = False
+        job.duration = time.monotonic() - job.started
+
+        with self._cond:
+            self._running -= 1
+            self._device_running[job.serial] -= 1
+            done.append(job)
+            if on_complete:
+                on_complete(job, len(done))
+            self._cond.notify_all()
+
+    def run(self, jobs, func, on_complete=None, admit=None):
+        """Calls func(job) for every job and returns the jobs in completion order.
+
+        on_complete(job, finished_count) is invoked under the scheduler lock as
+        each job finishes, so it may print without interleaving with other reports.
+
+        admit(job), if given, is asked before a job starts. A refused job waits
+        for running jobs to finish and is asked again; once nothing is running
+        and it is still refused, it is marked skipped instead of started.
+        """
+        pending = list(jobs)
+        done = []
+        threads = []
+
+        with self._cond:
+            while pending:
+                job = next((j for j in pending if self._can_start(j) and (admit is None or admit(j))), None)
+                if job is None and self._running == 0:
+                    # Every slot is free and nothing was admitted: nothing left can ever start.
+                    for job in pending:
+                        job.skipped = True
+                        done.append(job)
+                        if on_complete:
+                            on_complete(job, len(done))
+                    break
+                if job is None:
+                    self._cond.wait()
+                    continue
+
+                pending.remove(job)
+                self._running += 1
+                self._device_running[job.serial] = self._device_running.get(job.serial, 0) + 1
+                t = threading.Thread(target=self._worker, args=(job, func, on_complete, done), daemon=True)
+                threads.append(t)
+                t.start()
+
+        for t in threads:
+            t.join()
+        return done
+
+class DiskBudget:
+    """Admits jobs only while the output filesystem can hold them.
+
+    Each admitted job reserves its full size until it is released, on top of
+    a safety margin. Bytes a running job has already written are counted twice
+    (once as used space, once as reserved), which errs on the side of stopping
+    early rather than filling the disk halfway through an image.
+    """
+
+    def __init__(self, path=".", margin=DISK_MARGIN):
+        self.path = path
+        self.margin = margin
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    def free(self):
+        return shutil.disk_usage(self.path).free
+
+    def available(self):
+        with self._lock:
+            return self.free() - self.reserved - self.margin
+
+    def reserve(self, size):
+        with self._lock:
+            if self.free() - self.reserved - self.margin < size:
+                return False
+            self.reserved += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.reserved -= size
+
+    def admit(self, job):
+        """JobScheduler admit hook; jobs of unknown size are let through."""
+        return job.size is None or self.reserve(job.size)
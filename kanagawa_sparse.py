@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import struct
+
+SPARSE_BLOCK_SIZE = 4096
+
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+SPARSE_HEADER_FORMAT = "<IHHHHIIII"
+CHUNK_HEADER_FORMAT = "<HHII"
+SPARSE_HEADER_SIZE = struct.calcsize(SPARSE_HEADER_FORMAT)
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_HEADER_FORMAT)
+
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+
+def is_zero(data):
+    return data.count(0) == len(data)
+
+def fill_pattern(block):
+    """Returns the 4-byte fill word if the block is one repeated word, else None."""
+    word = block[:4]
+    if block == word * (len(block) // 4):
+        return word
+    return None
+
+class SparseFileWriter:
+    """Writes a raw image, but seeks over all-zero blocks so they become holes."""
+
+    def __init__(self, path, block_size=SPARSE_BLOCK_SIZE):
+        self.f = open(path, 'wb')
+        self.block_size = block_size
+        self.position = 0
+        self.skipped = 0
+
+    def write(self, data):
+        bs = self.block_size
+        if is_zero(data):
+            return self.skip(len(data))
+
+        run_start = None
+        for offset in range(0, len(data), bs):
+            block = data[offset:offset + bs]
+            if not is_zero(block):
+                if run_start is None:
+                    run_start = offset
+                continue
+            self.skipped += len(block)
+            if run_start is not None:
+                self.f.seek(self.position + run_start)
+                self.f.write(data[run_start:offset])
+                run_start = None
+        if run_start is not None:
+            self.f.seek(self.position + run_start)
+            self.f.write(data[run_start:])
+        self.position += len(data)
+        return len(data)
+
+    def skip(self, length):
+        self.position += length
+        self.skipped += length
+        return length
+
+    def close(self):
+        self.f.truncate(self.position)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SparseImageWriter:
+    """Streams an Android sparse image (simg) that fastboot can flash directly.
+
+    Uniform blocks (including all-zero ones) become FILL chunks and everything
+    else is packed into RAW chunks. Chunk and header sizes are patched in place,
+    so nothing beyond one partial block is ever buffered.
+    """
+
+    def __init__(self, path, block_size=SPARSE_BLOCK_SIZE):
+        self.f = open(path, 'wb')
+        self.block_size = block_size
+        self.position = 0
+        self.skipped = 0
+        self.total_blocks = 0
+        self.total_chunks = 0
+        self._pending = b""
+        self._chunk = None  # [type, header offset, blocks, fill word]
+        self.f.write(b"\0" * SPARSE_HEADER_SIZE)
+
+    def _close_chunk(self):
+        if self._chunk is None:
+            return
+        chunk_type, header_offset, blocks, word = self._chunk
+        if chunk_type == CHUNK_TYPE_RAW:
+            total_size = CHUNK_HEADER_SIZE + blocks * self.block_size
+        elif chunk_type == CHUNK_TYPE_FILL:
+            total_size = CHUNK_HEADER_SIZE + 4
+        else:
+            total_size = CHUNK_HEADER_SIZE
+        end = self.f.tell()
+        self.f.seek(header_offset)
+        self.f.write(struct.pack(CHUNK_HEADER_FORMAT, chunk_type, 0, blocks, total_size))
+        if chunk_type == CHUNK_TYPE_FILL:
+            self.f.write(word)
+        self.f.seek(end)
+        self._chunk = None
+
+    def _add_blocks(self, chunk_type, count, block=None, word=None):
+        current = self._chunk
+        if current is None or current[0] != chunk_type or current[3] != word:
+            self._close_chunk()
+            header_offset = self.f.tell()
+            self.f.write(b"\0" * (CHUNK_HEADER_SIZE + (4 if chunk_type == CHUNK_TYPE_FILL else 0)))
+            self._chunk = current = [chunk_type, header_offset, 0, word]
+            self.total_chunks += 1
+        if block is not None:
+            self.f.write(block)
+        current[2] += count
+        self.total_blocks += count
+
+    def write(self, data):
+        bs = self.block_size
+        self.position += len(data)
+        if self._pending:
+            data = self._pending + data
+            self._pending = b""
+        whole = len(data) - len(data) % bs
+
+        for offset in range(0, whole, bs):
+            block = data[offset:offset + bs]
+            word = fill_pattern(block)
+            if word is None:
+                self._add_blocks(CHUNK_TYPE_RAW, 1, block=block)
+            else:
+                if word == b"\0\0\0\0":
+                    self.skipped += bs
+                self._add_blocks(CHUNK_TYPE_FILL, 1, word=word)
+
+        self._pending = data[whole:]
+        return len(data)
+
+    def skip(self, length):
+        """Records length bytes of zeros without them ever being read."""
+        total = length
+        if self._pending:
+            # Zero-fill the partial block first; only that much is ever allocated.
+            head = min(length, self.block_size - len(self._pending))
+            self.write(bytes(head))
+            length -= head
+            if not length:
+                return total
+        blocks, remainder = divmod(length, self.block_size)
+        if blocks:
+            self._add_blocks(CHUNK_TYPE_FILL, blocks, word=b"\0\0\0\0")
+            self.skipped += blocks * self.block_size
+            self.position += blocks * self.block_size
+        if remainder:
+            self.write(bytes(remainder))
+        return total
+
+    def close(self):
+        if self._pending:
+            # Sparse images must cover whole blocks, so pad the tail with zeros.
+            tail = len(self._pending)
+            self.write(bytes(self.block_size - tail))
+            self.position -= self.block_size - tail
+        self._close_chunk()
+        self.f.seek(0)
+        self.f.write(struct.pack(SPARSE_HEADER_FORMAT, SPARSE_HEADER_MAGIC, 1, 0,
+                                 SPARSE_HEADER_SIZE, CHUNK_HEADER_SIZE, self.block_size,
+                                 self.total_blocks, self.total_chunks, 0))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def unsparse(simg_path, raw_path):
+    """Expands a sparse image back into a raw image (handy for checking a backup)."""
+    with open(simg_path, 'rb') as src, open(raw_path, 'wb') as dst:
+        magic, _, _, file_hdr_sz, chunk_hdr_sz, blk_sz, total_blks, total_chunks, _ = \
+            struct.unpack(SPARSE_HEADER_FORMAT, src.read(SPARSE_HEADER_SIZE))
+        if magic != SPARSE_HEADER_MAGIC:
+            raise ValueError(f"{simg_path} is not an Android sparse image")
+        src.seek(file_hdr_sz)
+
+        for _ in range(total_chunks):
+            chunk_type, _, blocks, total_size = struct.unpack(CHUNK_HEADER_FORMAT, src.read(CHUNK_HEADER_SIZE))
+            src.seek(chunk_hdr_sz - CHUNK_HEADER_SIZE, 1)
+            length = blocks * blk_sz
+            if chunk_type == CHUNK_TYPE_RAW:
+                while length:
+                    data = src.read(min(length, 1024 * 1024))
+                    dst.write(data)
+                    length -= len(data)
+            elif chunk_type == CHUNK_TYPE_FILL:
+                word = src.read(4)
+                if word == b"\0\0\0\0":
+                    dst.seek(length, 1)
+                else:
+                    dst.write(word * (length // 4))
+            elif chunk_type == CHUNK_TYPE_DONT_CARE:
+                dst.seek(length, 1)
+            else:
+                src.seek(total_size - chunk_hdr_sz, 1)
+        dst.truncate(total_blks * blk_sz)
@@ -4,7 +4,13 @@ import sys
 import subprocess
 import itertools
 import os
-import urllib.request
+
+from kanagawa_adb_client import get_client, get_tracker
+from kanagawa_avb import AVB_FLAGS_DISABLED, AvbError, get_vbmeta_cache
+from kanagawa_fastboot import fastboot_devices, run_fastboot
+from kanagawa_inspect import describe, inspect_image
+from kanagawa_metrics import count_spawn, increment, span
+from kanagawa_scheduler import Job, JobScheduler
 
 class Colors:
     CYAN = '\033[96m'
@@ -15,6 +21,13 @@ class Colors:
     BOLD = '\033[1m'
 
 VBMETA_URL = "https://dl.google.com/developers/android/qt/images/gsi/vbmeta.img"
+FASTBOOT_REBOOT_WAIT = 20
+# Flashed in this order on each device; later entries are only tried if earlier ones succeeded.
+FLASH_PLANS = {
+    1: ["vbmeta"],
+    2: ["vbmeta_a", "vbmeta_b"],
+    3: ["vbmeta", "vbmeta_system", "vbmeta_vendor"],
+}
 
 def print_banner():
     banner = fr"""{Colors.RED}{Colors.BOLD}
@@ -29,6 +42,7 @@ def print_banner():
     print(banner)
 
 def run_command(cmd, show_output=True):
+    count_spawn(cmd)
     try:
         if show_output:
             print(f"{Colors.YELLOW}[>] Executing: {cmd}{Colors.RESET}")
@@ -39,75 +53,105 @@ def run_command(cmd, show_output=True):
         return ""
 
 def check_dependencies():
-    print(f"{Colors.CYAN}[*] Checking ADB and Fastboot dependencies...{Colors.RESET}")
-    if not run_command("fastboot --version", show_output=False):
-        print(f"{Colors.RED}[-] fastboot not found in PATH.{Colors.RESET}")
-        sys.exit(1)
-        
+    # Fastboot is spoken in-process, so only the ADB reboot phase needs a binary.
+    print(f"{Colors.CYAN}[*] Checking ADB dependencies...{Colors.RESET}")
     if not run_command("adb --version", show_output=False):
         print(f"{Colors.YELLOW}[!] adb not found in PATH. ADB reboot phase will be skipped.{Colors.RESET}")
     else:
-        print(f"{Colors.GREEN}[+] fastboot and adb verified.{Colors.RESET}\n")
+        print(f"{Colors.GREEN}[+] adb verified.{Colors.RESET}\n")
 
 def try_adb_reboot_bootloader():
+    """Sends every authorized ADB device to the bootloader and returns their serials."""
     print(f"{Colors.CYAN}[*] Checking for devices connected via ADB...{Colors.RESET}")
-    output = run_command("adb devices", show_output=False)
+    tracker = get_tracker()
+    # Give the tracker a moment to receive the server's initial device table.
+    tracker.wait_for(lambda states: tracker.updated_at, timeout=1)
     
-    if "device" in output and len(output.split('\n')) > 1:
-        lines = output.split('\n')[1:]
-        for line in lines:
-            if "device" in line and "unauthorized" not in line and "offline" not in line:
-                print(f"{Colors.GREEN}[+] Authorized ADB Device found! Rebooting to bootloader...{Colors.RESET}")
-                run_command("adb reboot bootloader")
-                print(f"{Colors.YELLOW}[*] Waiting a moment for the device to power cycle...{Colors.RESET}")
-                time.sleep(3)
-                return True
-                
-    print(f"{Colors.YELLOW}[*] No active ADB device found. Assuming device is already in Fastboot or disconnected.{Colors.RESET}")
-    return False
+    serials = tracker.ready_serials(("device",))
+    if not serials:
+        print(f"{Colors.YELLOW}[*] No active ADB device found. Assuming device is already in Fastboot or disconnected.{Colors.RESET}")
+        return []
+    
+    rebooted = []
+    for serial in serials:
+        print(f"{Colors.GREEN}[+] Authorized ADB Device {serial} found! Rebooting to bootloader...{Colors.RESET}")
+        if get_client().reboot("bootloader", serial):
+            rebooted.append(serial)
+        else:
+            print(f"{Colors.YELLOW}[!] {serial} did not accept the reboot (offline or unauthorized?), skipping it.{Colors.RESET}")
+    serials = rebooted
+    if not serials:
+        return []
+    print(f"{Colors.YELLOW}[*] Waiting a moment for the device(s) to power cycle...{Colors.RESET}")
+    tracker.wait_for(lambda table: all(table.get(serial) != "device" for serial in serials), timeout=3)
+    return serials
 
-def wait_for_fastboot():
+def wait_for_fastboot(expected=()):
+    """Returns the fastboot serials once a device shows up.
+
+    Devices just rebooted from ADB (expected) are given up to
+    FASTBOOT_REBOOT_WAIT seconds to join, so they can all be flashed together.
+    """
     print(f"\n{Colors.YELLOW}[*] Waiting for device in Fastboot mode...{Colors.RESET}")
     spinner = itertools.cycle(['|', '/', '-', '\\'])
     
+    with span("wait_fastboot", tool="vbmeta") as fields:
+        serials = poll_fastboot(expected, spinner)
+        fields["devices"] = len(serials)
+    return serials
+
+def poll_fastboot(expected, spinner):
+    first_seen = None
     while True:
-        output = run_command("fastboot devices", show_output=False)
-        if output and "fastboot" in output:
+        increment("fastboot_polls")
+        serials = fastboot_devices()
+        if serials and first_seen is None:
+            first_seen = time.monotonic()
+        if serials and (set(expected) <= set(serials) or time.monotonic() - first_seen > FASTBOOT_REBOOT_WAIT):
             sys.stdout.write('\r' + ' ' * 50 + '\r')
-            print(f"{Colors.GREEN}[+] Fastboot Device connected!{Colors.RESET}")
-            return True
+            print(f"{Colors.GREEN}[+] Fastboot Device(s) connected: {', '.join(serials)}{Colors.RESET}")
+            return serials
             
         sys.stdout.write(f'\r{Colors.CYAN}[{next(spinner)}] Polling fastboot interface...{Colors.RESET}')
         sys.stdout.flush()
         time.sleep(0.1)
 
 def get_vbmeta_image():
-    local_img = "vbmeta_disabled.img"
+    cache = get_vbmeta_cache()
     
     print(f"{Colors.BOLD}--- VBMeta Source ---{Colors.RESET}")
-    print("  [1] Download Google GSI empty vbmeta.img (Recommended)")
-    print("  [2] Use a local vbmeta.img")
+    print("  [1] Generate an empty vbmeta locally, verity and verification disabled (Recommended, works offline)")
+    print("  [2] Download Google GSI empty vbmeta.img")
+    print("  [3] Use a local vbmeta.img")
     
     try:
-        choice = int(input(f"\n{Colors.YELLOW}Select an option (1-2): {Colors.RESET}"))
+        choice = int(input(f"\n{Colors.YELLOW}Select an option (1-3): {Colors.RESET}"))
         
         if choice == 1:
-            print(f"\n{Colors.CYAN}[*] Downloading from: {VBMETA_URL}{Colors.RESET}")
+            img = cache.generated()
+            print(f"{Colors.GREEN}[+] Using generated vbmeta {img} (sha256 verified).{Colors.RESET}")
+            return img
+            
+        elif choice == 2:
+            print(f"\n{Colors.CYAN}[*] Fetching {VBMETA_URL} (reused from the cache when already verified)...{Colors.RESET}")
             try:
-                urllib.request.urlretrieve(VBMETA_URL, local_img)
-                print(f"{Colors.GREEN}[+] Download complete. Saved as {local_img}.{Colors.RESET}")
-                return local_img
-            except Exception as e:
+                img = cache.downloaded(VBMETA_URL)
+                print(f"{Colors.GREEN}[+] Ready: {img} (sha256 verified).{Colors.RESET}")
+                return img
+            except (OSError, AvbError) as e:
                 print(f"{Colors.RED}[-] Download failed: {e}{Colors.RESET}")
                 sys.exit(1)
                 
-        elif choice == 2:
+        elif choice == 3:
             path = input(f"{Colors.YELLOW}Enter path to vbmeta.img: {Colors.RESET}").strip().strip("'\"")
-            if os.path.exists(path):
-                return path
-            else:
+            if not os.path.exists(path):
                 print(f"{Colors.RED}[-] File not found.{Colors.RESET}")
                 sys.exit(1)
+            try:
+                return cache.local(path)
+            except AvbError as e:
+                print(f"{Colors.RED}[-] {path} is not a vbmeta image: {e}{Colors.RESET}")
+                sys.exit(1)
         else:
             print(f"{Colors.RED}[-] Invalid option.{Colors.RESET}")
             sys.exit(1)
@@ -116,7 +160,52 @@ def get_vbmeta_image():
         print(f"{Colors.RED}[-] Invalid input.{Colors.RESET}")
         sys.exit(1)
 
-def disable_avb(img_path):
+def flash_sequence(serial, partitions, img_path):
+    """Flashes partitions in order on one device, stopping at the first failure.
+
+    Returns {"serial", "ok", "partitions": [(name, ok, seconds, output)], "duration"}.
+    """
+    started = time.monotonic()
+    results = []
+    for partition in partitions:
+        start = time.monotonic()
+        with span("flash", tool="vbmeta", serial=serial, partition=partition) as fields:
+            ok, output = run_fastboot(serial, "--disable-verity", "--disable-verification", "flash", partition, img_path)
+            fields["ok"] = ok
+        results.append((partition, ok, time.monotonic() - start, output))
+        if not ok:
+            break
+    return {"serial": serial, "ok": len(results) == len(partitions) and all(r[1] for r in results),
+            "partitions": results, "duration": time.monotonic() - started}
+
+def flash_devices(serials, partitions, img_path):
+    """Runs flash_sequence on every serial at once; one device never waits for another."""
+    jobs = [Job(serial, "vbmeta") for serial in serials]
+    done = JobScheduler(max(1, len(jobs)), 1).run(jobs, lambda job: flash_sequence(job.serial, partitions, img_path))
+    reports = {job.serial: job.result or {"serial": job.serial, "ok": False, "partitions": [], "duration": job.duration}
+               for job in done}
+    return [reports[serial] for serial in serials]
+
+def print_flash_report(reports, partitions):
+    header = "".join(f" {p[:14]:>14}" for p in partitions)
+    print(f"\n{Colors.BOLD}{'serial':<20}{header} {'total':>8}{Colors.RESET}")
+    for report in reports:
+        cells = {name: (ok, seconds) for name, ok, seconds, _ in report["partitions"]}
+        row = ""
+        for p in partitions:
+            if p not in cells:
+                row += f" {'skipped':>14}"
+            else:
+                ok, seconds = cells[p]
+                row += f" {f'{seconds * 1000:.0f} ms' if ok else 'FAILED':>14}"
+        color = Colors.GREEN if report["ok"] else Colors.RED
+        print(f"{color}{report['serial']:<20}{row} {report['duration']:>7.2f}s{Colors.RESET}")
+        for name, ok, _, output in report["partitions"]:
+            if not ok and output:
+                print(f"{Colors.RED}    {name}: {output.splitlines()[-1]}{Colors.RESET}")
+
+def disable_avb(img_path, serials=None):
+    serials = serials or fastboot_devices()
     print(f"\n{Colors.BOLD}--- Flashing Options ---{Colors.RESET}")
     print("  [1] Flash to current slot only (Standard)")
     print("  [2] Flash to both slots (A/B Devices)")
@@ -127,40 +216,59 @@ def disable_avb(img_path):
     except ValueError:
         print(f"{Colors.RED}[-] Invalid input.{Colors.RESET}")
         sys.exit(1)
-
-    print(f"\n{Colors.CYAN}[*] Patching AVB...{Colors.RESET}")
-    
-    base_cmd = f"fastboot --disable-verity --disable-verification flash"
     
-    if choice == 1:
-        run_command(f"{base_cmd} vbmeta \"{img_path}\"")
-    elif choice == 2:
-        run_command(f"{base_cmd} vbmeta_a \"{img_path}\"")
-        run_command(f"{base_cmd} vbmeta_b \"{img_path}\"")
-    elif choice == 3:
-        partitions = ["vbmeta", "vbmeta_system", "vbmeta_vendor"]
-        for p in partitions:
-            run_command(f"{base_cmd} {p} \"{img_path}\"")
-    else:
+    if choice not in FLASH_PLANS:
         print(f"{Colors.RED}[-] Invalid choice.{Colors.RESET}")
         sys.exit(1)
-        
-    print(f"\n{Colors.GREEN}{Colors.BOLD}[+] VBMeta flashed successfully. AVB is now disabled.{Colors.RESET}")
+    partitions = FLASH_PLANS[choice]
+    
+    # flash_sequence passes --disable-verity --disable-verification, so what reaches the device is the
+    # image's flags with both disable bits OR'd in. That only works on an image with a vbmeta header.
+    info = inspect_image(img_path)
+    disables = info.get("kind") == "vbmeta"
+    print(f"\n{Colors.CYAN}[*] Image: {describe(info)}{Colors.RESET}")
+    if not disables:
+        print(f"{Colors.YELLOW}[!] This is not a vbmeta image, so the disable flags cannot be patched into it; "
+              f"flashing it will not turn dm-verity and verification off.{Colors.RESET}")
+    elif "flags" in info and info["flags"] | AVB_FLAGS_DISABLED != info["flags"]:
+        print(f"{Colors.CYAN}[*] Flags {info['flags']} in the image are patched to {info['flags'] | AVB_FLAGS_DISABLED} "
+              f"while it is sent.{Colors.RESET}")
+    
+    if len(serials) > 1:
+        print(f"\n{Colors.CYAN}[*] Patching AVB on {len(serials)} devices in parallel...{Colors.RESET}")
+    else:
+        print(f"\n{Colors.CYAN}[*] Patching AVB...{Colors.RESET}")
+    
+    start = time.monotonic()
+    reports = flash_devices(serials, partitions, img_path)
+    print_flash_report(reports, partitions)
+    
+    flashed = [report["serial"] for report in reports if report["ok"]]
+    if len(flashed) == len(reports):
+        outcome = " AVB is now disabled." if disables else ""
+        print(f"\n{Colors.GREEN}{Colors.BOLD}[+] VBMeta flashed successfully on {len(flashed)} device(s) "
+              f"in {time.monotonic() - start:.1f}s.{outcome}{Colors.RESET}")
+    else:
+        print(f"\n{Colors.RED}[-] VBMeta flashing failed on {len(reports) - len(flashed)} of {len(reports)} device(s).{Colors.RESET}")
+    if not flashed:
+        return
     
-    reboot = input(f"{Colors.YELLOW}Reboot device now? [Y/n]: {Colors.RESET}").strip().lower()
+    reboot = input(f"{Colors.YELLOW}Reboot flashed device(s) now? [Y/n]: {Colors.RESET}").strip().lower()
     if reboot != 'n':
-        run_command("fastboot reboot")
+        jobs = [Job(serial, "reboot") for serial in flashed]
+        JobScheduler(len(jobs), 1).run(jobs, lambda job: run_fastboot(job.serial, "reboot")[0])
 
 def main():
     print_banner()
     check_dependencies()
     
-    try_adb_reboot_bootloader()
+    rebooted = try_adb_reboot_bootloader()
     
     img_target = get_vbmeta_image()
     
-    if wait_for_fastboot():
-        disable_avb(img_target)
+    serials = wait_for_fastboot(rebooted)
+    if serials:
+        disable_avb(img_target, serials)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()